@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Chat API load-test / latency benchmark.
+
+Against an in-process server with the deterministic fake model (offline, CI-friendly):
+
+    python -m benchmarks run --fake --endpoint stream --mode closed --concurrency 8 --requests 64 --output head.json
+
+Against a running server:
+
+    python -m benchmarks run --url http://localhost:8000/api/v1 --endpoint generate --mode open --rate 2
+
+Compare two runs (e.g. base commit vs head):
+
+    python -m benchmarks compare base.json head.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from benchmarks import loadgen
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def start_fake_server(args) -> str:
+    """Run src.main:app in a background thread with FakeLlama replicas"""
+    # Tắt cache để mọi request đều đi qua model path
+    os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+    os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "0")
+    os.environ["MODEL_REPLICAS"] = str(args.replicas)
+    os.environ.setdefault("ADMISSION_MAX_QUEUE", str(max(16, args.concurrency * 4)))
+
+    import functools
+    import uvicorn
+    from benchmarks.fake_llama import FakeLlama
+    from src.chat_service import chatService
+    from src.main import app
+
+    model_file = tempfile.NamedTemporaryFile(suffix=".gguf", delete=False)
+    model_file.close()
+    chatService.model_path = model_file.name
+    chatService.model_factory = functools.partial(
+        FakeLlama,
+        token_delay_ms=args.token_delay_ms,
+        prefill_ms_per_token=args.prefill_ms_per_token,
+        answer_tokens=args.max_tokens,
+    )
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("Fake server did not start")
+        time.sleep(0.05)
+    # Model load + warmup chạy nền sau khi server start, đợi /ready
+    while httpx.get(f"http://127.0.0.1:{args.port}/ready").status_code != 200:
+        if time.time() > deadline:
+            raise RuntimeError("Fake server did not become ready")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{args.port}/api/v1"
+
+
+def cmd_run(args):
+    base_url = start_fake_server(args) if args.fake else args.url
+    summary = asyncio.run(loadgen.run(
+        base_url,
+        endpoint=args.endpoint,
+        mode=args.mode,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        n_requests=args.requests,
+        max_tokens=args.max_tokens,
+        unique=not args.repeat_prompts,
+    ))
+    result = {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "config": {k: v for k, v in vars(args).items() if k != "func"},
+        "results": summary,
+    }
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+def _flatten(prefix: str, value, out: dict):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}.{k}" if prefix else k, v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+
+
+def cmd_compare(args):
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.head, encoding="utf-8") as f:
+        head = json.load(f)
+
+    base_metrics, head_metrics = {}, {}
+    _flatten("", base["results"], base_metrics)
+    _flatten("", head["results"], head_metrics)
+
+    print(f"{'metric':<28}{base.get('commit', 'base'):>14}{head.get('commit', 'head'):>14}{'change':>10}")
+    for key in sorted(set(base_metrics) & set(head_metrics)):
+        if key.startswith("status_codes"):
+            continue
+        b, h = base_metrics[key], head_metrics[key]
+        change = f"{(h - b) / b * 100:+.1f}%" if b else "n/a"
+        print(f"{key:<28}{b:>14}{h:>14}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Drive the chat API and report latency / throughput")
+    target = run.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Base URL of a running API, e.g. http://localhost:8000/api/v1")
+    target.add_argument("--fake", action="store_true", help="Start an in-process server with the fake model")
+    run.add_argument("--endpoint", choices=["generate", "stream"], default="stream")
+    run.add_argument("--mode", choices=["closed", "open"], default="closed")
+    run.add_argument("--concurrency", type=int, default=4, help="Closed loop: virtual users")
+    run.add_argument("--rate", type=float, default=1.0, help="Open loop: Poisson arrival rate (req/s)")
+    run.add_argument("--requests", type=int, default=32)
+    run.add_argument("--max-tokens", type=int, default=64)
+    run.add_argument("--repeat-prompts", action="store_true", help="Reuse identical prompts (exercise caches)")
+    run.add_argument("--output", help="Write results JSON to this file")
+    run.add_argument("--port", type=int, default=8765, help="Fake server port")
+    run.add_argument("--replicas", type=int, default=1, help="Fake server model replicas")
+    run.add_argument("--token-delay-ms", type=float, default=20.0, help="Fake model decode time per token")
+    run.add_argument("--prefill-ms-per-token", type=float, default=0.5, help="Fake model prefill time per token")
+    run.set_defaults(func=cmd_run)
+
+    compare = sub.add_parser("compare", help="Diff two result files")
+    compare.add_argument("base")
+    compare.add_argument("head")
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Aggregate tokens/sec: current one-at-a-time path vs continuous batching.
+
+    python -m benchmarks.bench_batching --model ./gguf_model.gguf --requests 16 --concurrency 8
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from llama_cpp import Llama
+
+from src.batch_engine import BatchEngine
+from benchmarks.prompts import QUESTIONS, SYSTEM_PROMPT
+
+
+def _messages(i: int):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": QUESTIONS[i % len(QUESTIONS)]},
+    ]
+
+
+def _run(fn, n_requests: int, concurrency: int) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda i: _timed(fn, i, latencies), range(n_requests)))
+    wall = time.perf_counter() - start
+    tokens = sum(results)
+    latencies.sort()
+    return {
+        "requests": n_requests,
+        "completion_tokens": tokens,
+        "wall_seconds": round(wall, 3),
+        "tokens_per_sec": round(tokens / wall, 2),
+        "p50_latency": round(latencies[len(latencies) // 2], 3),
+        "max_latency": round(latencies[-1], 3),
+    }
+
+
+def _timed(fn, i, latencies):
+    t0 = time.perf_counter()
+    n = fn(i)
+    latencies.append(time.perf_counter() - t0)
+    return n
+
+
+def bench_sequential(model: Llama, args) -> dict:
+    """Baseline: one Llama, requests serialized like ChatService today"""
+    lock = threading.Lock()
+
+    def one(i):
+        with lock:
+            out = model.create_chat_completion(
+                messages=_messages(i), max_tokens=args.max_tokens,
+                temperature=args.temperature, top_p=0.9, top_k=40,
+            )
+        return out["usage"]["completion_tokens"]
+
+    return _run(one, args.requests, args.concurrency)
+
+
+def bench_batched(model: Llama, args) -> dict:
+    engine = BatchEngine(
+        model,
+        max_batch_size=args.batch_size,
+        max_wait_ms=args.max_wait_ms,
+        n_ctx_per_seq=args.n_ctx,
+        n_threads=args.threads,
+    )
+    try:
+        def one(i):
+            out = engine.complete(
+                _messages(i), max_tokens=args.max_tokens,
+                temperature=args.temperature, top_p=0.9, top_k=40,
+            )
+            return out["completion_tokens"]
+
+        return _run(one, args.requests, args.concurrency)
+    finally:
+        engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="./gguf_model.gguf")
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--n-ctx", type=int, default=2048)
+    parser.add_argument("--output", help="Write results JSON to this file")
+    args = parser.parse_args()
+
+    model = Llama(model_path=args.model, n_ctx=args.n_ctx, n_threads=args.threads, verbose=False)
+
+    results = {"config": vars(args)}
+    results["sequential"] = bench_sequential(model, args)
+    results["batched"] = bench_batched(model, args)
+    results["speedup"] = round(
+        results["batched"]["tokens_per_sec"] / max(results["sequential"]["tokens_per_sec"], 1e-9), 2
+    )
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
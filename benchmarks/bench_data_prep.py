@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Wall time and peak RSS of dataset preparation: the original row-by-row pandas
+get_dataset vs the batched Arrow pipeline in src/utils/data_prep.py.
+
+    python -m benchmarks.bench_data_prep --synthetic 50000 --num-proc 1 4
+    python -m benchmarks.bench_data_prep --hub --num-proc 1 4
+
+Each variant runs in a fresh process; peak RSS is ru_maxrss of that process (and of
+its map workers for num_proc > 1). "cached" is a second call that hits the on-disk
+Arrow cache. --synthetic builds a dataset with the same schema as
+thangvip/vietnamese-legal-qa, for machines without Hub access.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.prompts import QUESTIONS
+
+DATASET_NAME = "thangvip/vietnamese-legal-qa"
+
+
+def legacy_get_dataset(ds, n_samples=8000):
+    """get_dataset before the Arrow rewrite (loop over ds[i], pandas, .apply)"""
+    from datasets import Dataset
+    from src.utils.data_prep import preprocess_function
+
+    rows = []
+    for i in range(len(ds)):
+        qa_pairs = ds[i]["generated_qa_pairs"]
+        for qa_pair in qa_pairs:
+            rows.append({
+                "question": qa_pair["question"],
+                "answer": qa_pair["answer"]
+            })
+
+    df = pd.DataFrame(rows)
+    df = df.assign(
+        num_tokens=df["answer"].apply(lambda text: len(str(text).split()))
+    )
+    df = df.loc[df["num_tokens"] < 256]
+    if len(df) > n_samples:
+        df = df.sample(n_samples, random_state=42).reset_index(drop=True)
+
+    ds_train = Dataset.from_pandas(df)
+    return ds_train.map(preprocess_function).select_columns(["messages"])
+
+
+def _synthetic(rows: int, path: str, seed: int = 0):
+    from datasets import Dataset
+
+    rng = random.Random(seed)
+    words = " ".join(QUESTIONS).split()
+
+    def text(n):
+        return " ".join(rng.choice(words) for _ in range(n))
+
+    def gen():
+        for i in range(rows):
+            yield {
+                "id": i,
+                "context": text(rng.randint(100, 600)),
+                "generated_qa_pairs": [
+                    {"question": text(rng.randint(10, 40)), "answer": text(rng.randint(20, 400))}
+                    for _ in range(rng.randint(1, 8))
+                ],
+            }
+
+    Dataset.from_generator(gen).save_to_disk(path)
+
+
+def _load(source: str):
+    from datasets import load_dataset, load_from_disk
+
+    return load_dataset(DATASET_NAME, split="train") if source == "hub" else load_from_disk(source)
+
+
+def _rss_mb(who) -> float:
+    # Linux: ru_maxrss tính bằng KB
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _run(variant: str, source: str, n_samples: int, num_proc: int, cache_dir: str, queue):
+    import datasets
+    from src.utils.data_prep import get_dataset
+
+    datasets.disable_progress_bars()
+    ds = _load(source)
+    # Mỗi lần đo phải tính lại, không dùng cache map() theo fingerprint của lần trước
+    if variant != "cached":
+        datasets.disable_caching()
+    baseline = _rss_mb(resource.RUSAGE_SELF)
+
+    start = time.perf_counter()
+    if variant == "legacy":
+        out = legacy_get_dataset(ds, n_samples)
+    else:
+        out = get_dataset(n_samples, num_proc=num_proc, cache_dir=cache_dir, dataset=ds)
+    elapsed = time.perf_counter() - start
+
+    queue.put({
+        "wall_s": elapsed,
+        "rows": len(out),
+        "peak_rss_mb": _rss_mb(resource.RUSAGE_SELF),
+        "rss_growth_mb": _rss_mb(resource.RUSAGE_SELF) - baseline,
+        "workers_peak_rss_mb": _rss_mb(resource.RUSAGE_CHILDREN),
+    })
+
+
+def _measure(variant: str, source: str, n_samples: int, num_proc: int, cache_dir: str) -> dict:
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run, args=(variant, source, n_samples, num_proc, cache_dir, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--synthetic", type=int, metavar="ROWS", help="Generate a dataset with ROWS documents")
+    target.add_argument("--hub", action="store_true", help=f"Use {DATASET_NAME} from the Hugging Face Hub")
+    parser.add_argument("--n-samples", type=int, default=8000)
+    parser.add_argument("--num-proc", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--output", help="Write results JSON to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-data-prep-")
+    try:
+        source = "hub"
+        if args.synthetic:
+            source = f"{workdir}/source"
+            _synthetic(args.synthetic, source)
+
+        runs = [("legacy", 1)] + [("arrow", n) for n in args.num_proc] + [("cached", args.num_proc[-1])]
+        results = []
+        for variant, num_proc in runs:
+            # cached: dùng lại cache của lần arrow cuối cùng
+            cache_dir = f"{workdir}/cache-{num_proc}" if variant != "legacy" else None
+            if variant == "arrow":
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            row = {"variant": variant, "num_proc": num_proc,
+                   **_measure(variant, source, args.n_samples, num_proc, cache_dir)}
+            results.append(row)
+            print(json.dumps(row), flush=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    base = results[0]["wall_s"]
+    print(f"\n{'variant':<8} {'proc':>4} {'rows':>7} {'wall s':>8} {'speedup':>8} {'peak MB':>8} {'+MB':>7} {'workers MB':>10}")
+    for row in results:
+        print(f"{row['variant']:<8} {row['num_proc']:>4} {row['rows']:>7} {row['wall_s']:>8.2f} "
+              f"{base / row['wall_s']:>7.1f}x {row['peak_rss_mb']:>8.0f} {row['rss_growth_mb']:>7.0f} "
+              f"{row['workers_peak_rss_mb']:>10.0f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
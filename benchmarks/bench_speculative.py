@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Single-stream tokens/sec: plain decoding vs speculative decoding, plus output equivalence.
+
+    python -m benchmarks.bench_speculative --model ./gguf_model.gguf --mode prompt_lookup
+    python -m benchmarks.bench_speculative --model ./gguf_model.gguf --mode draft --draft-model ./draft.gguf
+
+Greedy (temperature 0) by default: speculative decoding must then reproduce plain
+decoding token for token, and any mismatch is reported.
+"""
+import argparse
+import json
+import time
+
+from llama_cpp import Llama
+
+from src.speculative import draft_factory
+from benchmarks.prompts import QUESTIONS, SYSTEM_PROMPT
+
+
+def _messages(question: str):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": question},
+    ]
+
+
+def _load(args, draft=None) -> Llama:
+    kwargs = {"draft_model": draft, "logits_all": True} if draft is not None else {}
+    return Llama(
+        model_path=args.model,
+        n_ctx=args.n_ctx,
+        n_threads=args.threads,
+        use_mmap=True,
+        verbose=False,
+        seed=args.seed,
+        **kwargs,
+    )
+
+
+def _run(model: Llama, args) -> dict:
+    outputs, tokens, decode_time = [], 0, 0.0
+    for i in range(args.requests):
+        question = QUESTIONS[i % len(QUESTIONS)]
+        # Reset để lượt nào cũng prefill như nhau, chỉ so phần decode
+        model.reset()
+        start = time.perf_counter()
+        first_token_at = None
+        text = []
+        n = 0
+        for chunk in model.create_chat_completion(
+            messages=_messages(question), max_tokens=args.max_tokens, stream=True,
+            temperature=args.temperature, top_p=0.9, top_k=40, seed=args.seed,
+        ):
+            delta = chunk["choices"][0]["delta"]
+            if "content" in delta:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                text.append(delta["content"])
+                n += 1
+        end = time.perf_counter()
+        if first_token_at is not None and n > 1:
+            decode_time += end - first_token_at
+            tokens += n - 1
+        outputs.append("".join(text))
+    return {
+        "decode_tokens": tokens,
+        "decode_seconds": round(decode_time, 3),
+        "tokens_per_sec": round(tokens / decode_time, 2) if decode_time > 0 else None,
+        "outputs": outputs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="./gguf_model.gguf")
+    parser.add_argument("--mode", choices=["prompt_lookup", "draft"], default="prompt_lookup")
+    parser.add_argument("--draft-model", default=None)
+    parser.add_argument("--draft-tokens", type=int, default=10)
+    parser.add_argument("--ngram", type=int, default=2)
+    parser.add_argument("--draft-threads", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--n-ctx", type=int, default=2048)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write results JSON to this file")
+    args = parser.parse_args()
+
+    plain = _load(args)
+    baseline = _run(plain, args)
+    plain.close()
+
+    draft = draft_factory(
+        args.mode,
+        num_pred_tokens=args.draft_tokens,
+        max_ngram_size=args.ngram,
+        draft_model_path=args.draft_model,
+        n_ctx=args.n_ctx,
+        n_threads=args.draft_threads,
+    )()
+    speculative_model = _load(args, draft)
+    speculative = _run(speculative_model, args)
+    speculative_model.close()
+    draft.close()
+
+    mismatches = [
+        i for i, (a, b) in enumerate(zip(baseline["outputs"], speculative["outputs"])) if a != b
+    ]
+    result = {
+        "config": vars(args),
+        "plain": {k: v for k, v in baseline.items() if k != "outputs"},
+        "speculative": {k: v for k, v in speculative.items() if k != "outputs"},
+        "speedup": (
+            round(speculative["tokens_per_sec"] / baseline["tokens_per_sec"], 3)
+            if speculative["tokens_per_sec"] and baseline["tokens_per_sec"] else None
+        ),
+        "draft_tokens": draft.drafted,
+        "accepted_tokens": draft.accepted,
+        "acceptance_rate": round(draft.accepted / draft.drafted, 3) if draft.drafted else None,
+        "identical_outputs": not mismatches,
+        "mismatched_requests": mismatches,
+    }
+    if mismatches and args.temperature <= 0:
+        print("WARNING: greedy outputs differ between plain and speculative decoding")
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Throughput scaling with worker processes on one node (python -m src.serve).
+
+For each N, compares
+  threads:   1 process, N model replicas (one GIL)
+  processes: N worker processes x 1 replica behind the router
+
+    python -m benchmarks.bench_workers --fake --workers 1 2 4 --python-us-per-token 400
+    python -m benchmarks.bench_workers --model ./gguf_model.gguf --workers 1 2 4 --threads 8
+
+Each configuration gets its own `src.serve` subprocess; the load is the closed-loop
+stream benchmark from benchmarks.loadgen with concurrency = 2 x N.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks import loadgen
+
+
+def _wait_ready(url: str, timeout: float) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = httpx.get(f"{url}/ready", timeout=2.0)
+            body = response.json()
+            # Router: đợi mọi worker ready, không chỉ worker đầu tiên
+            if response.status_code == 200 and all(w["ready"] for w in body.get("workers", [])):
+                return
+        except (httpx.HTTPError, ValueError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not become ready in {timeout:.0f}s")
+
+
+def _start(args, workers: int, replicas: int, model_path: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update(
+        MODEL_PATH=model_path,
+        RESPONSE_CACHE_ENABLED="0",
+        SEMANTIC_CACHE_ENABLED="0",
+        ADMISSION_MAX_QUEUE=str(max(16, args.concurrency_per_worker * workers * 4)),
+        FAKE_TOKEN_DELAY_MS=str(args.token_delay_ms),
+        FAKE_PYTHON_US_PER_TOKEN=str(args.python_us_per_token),
+        FAKE_ANSWER_TOKENS=str(args.max_tokens),
+        SESSION_STATE_DIR=tempfile.mkdtemp(prefix="bench-sessions-"),
+    )
+    cmd = [
+        sys.executable, "-m", "src.serve",
+        "--workers", str(workers),
+        "--replicas", str(replicas),
+        "--threads", str(args.threads),
+        "--host", "127.0.0.1",
+        "--port", str(args.port),
+        "--socket-dir", tempfile.mkdtemp(prefix="bench-sockets-"),
+        "--app", "benchmarks.fake_worker:app" if args.fake else "src.main:app",
+    ]
+    return subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _stop(proc: subprocess.Popen) -> None:
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def _measure(args, workers: int, replicas: int, model_path: str) -> dict:
+    url = f"http://127.0.0.1:{args.port}"
+    proc = _start(args, workers, replicas, model_path)
+    try:
+        _wait_ready(url, args.startup_timeout)
+        concurrency = args.concurrency_per_worker * max(workers, replicas)
+        return asyncio.run(loadgen.run(
+            f"{url}/api/v1",
+            endpoint="stream",
+            mode="closed",
+            concurrency=concurrency,
+            rate=0.0,
+            n_requests=args.requests_per_worker * max(workers, replicas),
+            max_tokens=args.max_tokens,
+            unique=True,
+        ))
+    finally:
+        _stop(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--fake", action="store_true", help="Workers run the fake model")
+    target.add_argument("--model", help="GGUF path for real llama.cpp workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=8, help="Total llama.cpp threads, split across workers")
+    parser.add_argument("--concurrency-per-worker", type=int, default=2)
+    parser.add_argument("--requests-per-worker", type=int, default=16)
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--token-delay-ms", type=float, default=20.0, help="Fake model decode time per token")
+    parser.add_argument("--python-us-per-token", type=float, default=400.0,
+                        help="Fake model GIL-held work per token")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="Write results JSON to this file")
+    args = parser.parse_args()
+
+    model_path = args.model
+    if args.fake:
+        model_file = tempfile.NamedTemporaryFile(suffix=".gguf", delete=False)
+        model_file.close()
+        model_path = model_file.name
+
+    results = []
+    for n in args.workers:
+        for layout, workers, replicas in (("threads", 1, n), ("processes", n, 1)):
+            # N=1: hai layout giống nhau, chỉ đo một lần
+            if n == 1 and layout == "processes":
+                continue
+            summary = _measure(args, workers, replicas, model_path)
+            row = {
+                "n": n,
+                "layout": layout,
+                "workers": workers,
+                "replicas_per_worker": replicas,
+                "throughput_rps": summary["throughput_rps"],
+                "tokens_per_sec": summary["tokens_per_sec"],
+                "latency_p50": summary["latency"]["p50"],
+                "latency_p95": summary["latency"]["p95"],
+                "ttft_p50": summary["ttft"]["p50"],
+                "failed": summary["failed"],
+            }
+            results.append(row)
+            print(json.dumps(row, ensure_ascii=False), flush=True)
+
+    base = results[0]["tokens_per_sec"] or 0
+    print(f"\n{'n':>3} {'layout':<10} {'req/s':>8} {'tok/s':>9} {'p50 s':>8} {'p95 s':>8} {'scaling':>8}")
+    for row in results:
+        scaling = f"{row['tokens_per_sec'] / base:.2f}x" if base and row["tokens_per_sec"] else "n/a"
+        print(f"{row['n']:>3} {row['layout']:<10} {row['throughput_rps'] or 0:>8.2f} {row['tokens_per_sec'] or 0:>9.1f} "
+              f"{row['latency_p50'] or 0:>8.3f} {row['latency_p95'] or 0:>8.3f} {scaling:>8}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Deterministic stand-in for llama_cpp.Llama, so the API can be benchmarked offline / in CI.
+
+Answers are derived from a hash of the prompt; prefill and decode cost are simulated
+with sleeps (which release the GIL, like llama.cpp does). `python_us_per_token` adds
+a busy loop that holds the GIL per token, standing in for the Python-side work
+(detokenize, JSON, SSE framing) that contends across threads of one process.
+"""
+import copy
+import hashlib
+import time
+from typing import Iterator, List, Optional
+
+_WORDS = (
+    "theo quy định của pháp luật việt nam cơ quan nhà nước có thẩm quyền trách nhiệm "
+    "thực hiện điều khoản luật nghị định hồ sơ giấy tờ chế độ bảo hiểm hàng không "
+    "giao thông đường bộ thi hành án dân sự người phiên dịch nguyên tắc quản lý"
+).split()
+
+
+class FakeLlamaState:
+    def __init__(self, input_ids: List[int]):
+        self.input_ids = list(input_ids)
+        self.n_tokens = len(input_ids)
+        self.llama_state_size = 4 * len(input_ids)
+
+
+class FakeLlama:
+    def __init__(
+        self,
+        model_path: Optional[str] = None,
+        n_ctx: int = 4096,
+        n_threads: int = 1,
+        token_delay_ms: float = 20.0,
+        prefill_ms_per_token: float = 0.5,
+        answer_tokens: int = 128,
+        python_us_per_token: float = 0.0,
+        **kwargs,
+    ):
+        self.model_path = model_path
+        self._n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.token_delay = token_delay_ms / 1000.0
+        self.prefill_delay = prefill_ms_per_token / 1000.0
+        self.answer_tokens = answer_tokens
+        self.python_work = python_us_per_token / 1e6
+        self.metadata = {}
+        self._input_ids: List[int] = []
+        self.n_tokens = 0
+
+    # ---- tokenizer ----
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        words = text.decode("utf-8", errors="ignore").split()
+        tokens = [3 + int(hashlib.md5(w.encode()).hexdigest()[:6], 16) % 32000 for w in words]
+        return ([self.token_bos()] if add_bos else []) + tokens
+
+    def detokenize(self, tokens: List[int], prev_tokens=None, special: bool = False) -> bytes:
+        return "".join(" " + _WORDS[t % len(_WORDS)] for t in tokens).encode("utf-8")
+
+    def token_bos(self) -> int:
+        return 1
+
+    def token_eos(self) -> int:
+        return 2
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def n_vocab(self) -> int:
+        return 32000
+
+    # ---- KV cache ----
+
+    def reset(self):
+        self._input_ids = []
+        self.n_tokens = 0
+
+    def eval(self, tokens: List[int]):
+        time.sleep(self.prefill_delay * len(tokens))
+        self._input_ids.extend(tokens)
+        self.n_tokens = len(self._input_ids)
+
+    def save_state(self) -> FakeLlamaState:
+        return FakeLlamaState(self._input_ids)
+
+    def load_state(self, state: FakeLlamaState):
+        self._input_ids = list(state.input_ids)
+        self.n_tokens = state.n_tokens
+
+    def _prefill(self, prompt_tokens: List[int]):
+        # Giống llama.cpp: chỉ prefill phần sau longest common prefix
+        common = 0
+        for a, b in zip(self._input_ids, prompt_tokens):
+            if a != b:
+                break
+            common += 1
+        self._input_ids = self._input_ids[:common]
+        self.eval(prompt_tokens[common:])
+
+    # ---- generation ----
+
+    def _answer(self, prompt: str, max_tokens: int) -> List[int]:
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+        n = min(max_tokens or self.answer_tokens, self.answer_tokens)
+        return [(seed >> (i % 200)) % 997 + 3 for i in range(n)]
+
+    def create_chat_completion(self, messages, stream: bool = False, max_tokens: int = 256, **kwargs):
+        prompt = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        prompt_tokens = self.tokenize(prompt.encode("utf-8"))
+        self._prefill(prompt_tokens)
+        answer = self._answer(prompt, max_tokens)
+
+        if stream:
+            return self._stream(answer)
+
+        for token in answer:
+            time.sleep(self.token_delay)
+            self._hold_gil()
+            self._input_ids.append(token)
+        self.n_tokens = len(self._input_ids)
+        return {
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.detokenize(answer).decode("utf-8")},
+                "finish_reason": "length",
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt_tokens),
+                "completion_tokens": len(answer),
+                "total_tokens": len(prompt_tokens) + len(answer),
+            },
+        }
+
+    def _hold_gil(self):
+        if self.python_work <= 0:
+            return
+        end = time.perf_counter() + self.python_work
+        while time.perf_counter() < end:
+            pass
+
+    def _stream(self, answer: List[int]) -> Iterator[dict]:
+        yield {"choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]}
+        for token in answer:
+            time.sleep(self.token_delay)
+            self._hold_gil()
+            self._input_ids.append(token)
+            self.n_tokens = len(self._input_ids)
+            yield {"choices": [{"index": 0, "delta": {"content": self.detokenize([token]).decode("utf-8")}, "finish_reason": None}]}
+        yield {"choices": [{"index": 0, "delta": {}, "finish_reason": "length"}]}
+
+    def close(self):
+        pass
@@ -0,0 +1,22 @@
+"""
+src.main:app with FakeLlama replicas, for multi-process runs without a GGUF:
+
+    MODEL_PATH=/tmp/empty.gguf python -m src.serve --workers 4 --app benchmarks.fake_worker:app
+
+Fake model timings come from FAKE_TOKEN_DELAY_MS, FAKE_PREFILL_MS_PER_TOKEN,
+FAKE_PYTHON_US_PER_TOKEN and FAKE_ANSWER_TOKENS.
+"""
+import functools
+import os
+
+from benchmarks.fake_llama import FakeLlama
+from src.chat_service import chatService
+from src.main import app  # noqa: F401
+
+chatService.model_factory = functools.partial(
+    FakeLlama,
+    token_delay_ms=float(os.getenv("FAKE_TOKEN_DELAY_MS", "20")),
+    prefill_ms_per_token=float(os.getenv("FAKE_PREFILL_MS_PER_TOKEN", "0.5")),
+    python_us_per_token=float(os.getenv("FAKE_PYTHON_US_PER_TOKEN", "0")),
+    answer_tokens=int(os.getenv("FAKE_ANSWER_TOKENS", "128")),
+)
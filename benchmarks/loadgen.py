@@ -0,0 +1,179 @@
+"""
+Async load generator for /api/v1/generate and /api/v1/chat/stream.
+
+Closed loop: `concurrency` virtual users, each sends the next request as soon as the
+previous one finishes. Open loop: requests arrive as a Poisson process at `rate` req/s
+regardless of how fast the server answers (the queueing behaviour users actually see).
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.prompts import QUESTIONS
+
+
+class RequestResult:
+    def __init__(self):
+        self.ok = False
+        self.status_code: Optional[int] = None
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.first_chunk_at: Optional[float] = None
+        self.last_chunk_at: Optional[float] = None
+        self.completion_tokens = 0
+        self.error: Optional[str] = None
+
+    @property
+    def latency(self) -> float:
+        return self.end - self.start
+
+    @property
+    def ttft(self) -> Optional[float]:
+        return None if self.first_chunk_at is None else self.first_chunk_at - self.start
+
+    @property
+    def itl(self) -> Optional[float]:
+        """Mean inter-token latency, robust to server-side chunk coalescing"""
+        if self.first_chunk_at is None or self.completion_tokens < 2:
+            return None
+        return (self.last_chunk_at - self.first_chunk_at) / (self.completion_tokens - 1)
+
+
+def _payload(i: int, max_tokens: int, unique: bool) -> dict:
+    message = QUESTIONS[i % len(QUESTIONS)]
+    if unique:
+        # Tránh response cache / single-flight khi đo model path
+        message = f"{message} (#{i})"
+    return {"message": message, "max_tokens": max_tokens}
+
+
+async def _generate(client: httpx.AsyncClient, payload: dict) -> RequestResult:
+    result = RequestResult()
+    try:
+        response = await client.post("/generate", json=payload)
+        result.status_code = response.status_code
+        result.end = time.perf_counter()
+        result.ok = response.status_code == 200
+        if result.ok:
+            result.first_chunk_at = result.last_chunk_at = result.end
+        else:
+            result.error = response.text[:200]
+    except httpx.HTTPError as e:
+        result.end = time.perf_counter()
+        result.error = repr(e)
+    return result
+
+
+async def _stream(client: httpx.AsyncClient, payload: dict) -> RequestResult:
+    result = RequestResult()
+    try:
+        async with client.stream("POST", "/chat/stream", json=payload) as response:
+            result.status_code = response.status_code
+            if response.status_code != 200:
+                result.error = (await response.aread()).decode("utf-8", "replace")[:200]
+            else:
+                event, data = "message", []
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                    elif line.startswith("data:"):
+                        data.append(line[6:] if line.startswith("data: ") else line[5:])
+                    elif not line and data:
+                        now = time.perf_counter()
+                        text = "\n".join(data)
+                        if event == "chunk":
+                            if result.first_chunk_at is None:
+                                result.first_chunk_at = now
+                            result.last_chunk_at = now
+                        elif event == "usage":
+                            result.completion_tokens = json.loads(text).get("completion_tokens") or 0
+                        elif event == "error":
+                            result.error = text
+                        elif text == "[DONE]":
+                            result.ok = result.error is None
+                        event, data = "message", []
+    except httpx.HTTPError as e:
+        result.error = repr(e)
+    result.end = time.perf_counter()
+    return result
+
+
+async def closed_loop(client, endpoint: str, concurrency: int, n_requests: int,
+                      max_tokens: int, unique: bool) -> List[RequestResult]:
+    send = _stream if endpoint == "stream" else _generate
+    counter = itertools.count()
+    results: List[RequestResult] = []
+
+    async def user():
+        while True:
+            i = next(counter)
+            if i >= n_requests:
+                return
+            results.append(await send(client, _payload(i, max_tokens, unique)))
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return results
+
+
+async def open_loop(client, endpoint: str, rate: float, n_requests: int,
+                    max_tokens: int, unique: bool, seed: int = 0) -> List[RequestResult]:
+    send = _stream if endpoint == "stream" else _generate
+    rng = random.Random(seed)
+    tasks = []
+    for i in range(n_requests):
+        tasks.append(asyncio.create_task(send(client, _payload(i, max_tokens, unique))))
+        # Poisson arrivals: khoảng cách giữa các request ~ Exp(rate)
+        await asyncio.sleep(rng.expovariate(rate))
+    return list(await asyncio.gather(*tasks))
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    values = sorted(values)
+
+    def pct(p):
+        k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+        return round(values[k], 4)
+
+    return {"p50": pct(50), "p95": pct(95), "p99": pct(99), "mean": round(sum(values) / len(values), 4)}
+
+
+def summarize(results: List[RequestResult], wall: float) -> dict:
+    ok = [r for r in results if r.ok]
+    status_codes: Dict[str, int] = {}
+    for r in results:
+        key = str(r.status_code) if r.status_code is not None else "error"
+        status_codes[key] = status_codes.get(key, 0) + 1
+
+    tokens = sum(r.completion_tokens for r in ok)
+    return {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "status_codes": status_codes,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 3) if wall > 0 else None,
+        "tokens_per_sec": round(tokens / wall, 2) if wall > 0 and tokens else None,
+        "latency": _percentiles([r.latency for r in ok]),
+        "ttft": _percentiles([r.ttft for r in ok if r.ttft is not None]),
+        "itl": _percentiles([r.itl for r in ok if r.itl is not None]),
+    }
+
+
+async def run(base_url: str, endpoint: str, mode: str, concurrency: int, rate: float,
+              n_requests: int, max_tokens: int, unique: bool, timeout: float = 300.0) -> dict:
+    limits = httpx.Limits(max_connections=max(concurrency, 64), max_keepalive_connections=max(concurrency, 64))
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        if mode == "open":
+            results = await open_loop(client, endpoint, rate, n_requests, max_tokens, unique)
+        else:
+            results = await closed_loop(client, endpoint, concurrency, n_requests, max_tokens, unique)
+        wall = time.perf_counter() - start
+    return summarize(results, wall)
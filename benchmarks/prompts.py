@@ -0,0 +1,11 @@
+# Câu hỏi mẫu giống src/frontend.py, dùng chung cho các benchmark
+
+SYSTEM_PROMPT = "Bạn là một trợ lý luật pháp Việt Nam thông minh, luôn trả lời bằng tiếng Việt chuẩn và dễ hiểu."
+
+QUESTIONS = [
+    "Theo Điều 161 Dự thảo Luật Kinh doanh bảo hiểm (sửa đổi), cơ quan quản lý nhà nước về hoạt động kinh doanh bảo hiểm hoạt động trên những nguyên tắc nào?",
+    "Dựa vào Điều 59 của Luật Hàng không dân dụng Việt Nam, chức năng chính của Cảng vụ hàng không là gì?",
+    "Một công dân Việt Nam sinh con ở nước ngoài và muốn nộp hồ sơ hưởng chế độ thai sản tại Việt Nam. Theo Điều 61 của Luật Bảo hiểm xã hội, giấy tờ này cần đáp ứng những yêu cầu gì?",
+    "Theo Điều 8 của Luật Thi hành án dân sự, người phiên dịch có những trách nhiệm gì và phải chịu trách nhiệm như thế nào nếu cố ý dịch sai?",
+    "Điều 37 của Dự thảo Luật Giao thông đường bộ (sửa đổi) quy định gì về việc thi công xây dựng, sửa chữa đường bộ ở nơi giao nhau đồng mức với đường sắt?",
+]
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Offline batch inference through the API at low priority.
+
+Questions are sent in chunks to /api/v1/generate/batch, which answers them in LOW
+priority admission slots: the job fills idle model capacity and yields to
+interactive traffic instead of competing with it.
+
+    python scripts/batch_generate.py questions.jsonl answers.jsonl
+    python scripts/batch_generate.py train.parquet answers.jsonl --parallel 2 --max-tokens 256
+
+Input rows (JSONL or Parquet) carry `message` or `question`, or `messages` in the chat
+format produced by src/utils/data_prep.get_dataset (the user turn is the question, the
+assistant turn is kept as `reference`). `id` is used when present, else the row number.
+
+Results are appended to the output JSONL as they arrive, and the output doubles as the
+checkpoint: rerunning the same command skips answered ids and retries failed ones.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+from typing import List, Optional, Set
+
+import httpx
+
+
+def _to_item(row: dict, index: int) -> Optional[dict]:
+    message = row.get("message") or row.get("question")
+    reference = row.get("answer")
+    for turn in row.get("messages") or []:
+        if turn.get("role") == "user" and not row.get("message") and not row.get("question"):
+            message = turn.get("content")
+        elif turn.get("role") == "assistant":
+            reference = turn.get("content")
+    if not message or not str(message).strip():
+        return None
+    item = {"id": str(row.get("id", index)), "message": str(message).strip()}
+    if reference is not None:
+        item["reference"] = reference
+    return item
+
+
+def read_questions(path: str) -> List[dict]:
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        rows = pq.read_table(path).to_pylist()
+    else:
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    items = [_to_item(row, i) for i, row in enumerate(rows)]
+    return [item for item in items if item is not None]
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    """ids answered successfully in `path`; a partial last line left by a crash is cut off"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    valid_end = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            valid_end += len(line)
+            if record.get("error") is None:
+                done.add(record["id"])
+    if valid_end < os.path.getsize(path):
+        print(f"Truncating partial record at the end of {path}")
+        with open(path, "r+b") as f:
+            f.truncate(valid_end)
+    return done
+
+
+class BatchJob:
+    def __init__(self, args, items: List[dict], out):
+        self.args = args
+        self.out = out
+        self.references = {item["id"]: item.get("reference") for item in items}
+        self.chunks = deque(items[i:i + args.chunk_size] for i in range(0, len(items), args.chunk_size))
+        self.total = len(items)
+        self.answered = 0
+        self.errors = 0
+        self.cached = 0
+        self.completion_tokens = 0
+        self.start = time.perf_counter()
+        self._last_report = self.start
+
+    def _write(self, result: dict):
+        reference = self.references.get(result["id"])
+        if reference is not None:
+            result["reference"] = reference
+        # Ghi + flush từng dòng: crash giữa chừng chỉ mất các câu đang chạy
+        self.out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self.out.flush()
+        if result.get("error") is None:
+            self.answered += 1
+        else:
+            self.errors += 1
+        self.cached += bool(result.get("cached"))
+        self.completion_tokens += result.get("completion_tokens") or 0
+        self._report()
+
+    def _report(self):
+        now = time.perf_counter()
+        if now - self._last_report < self.args.report_every:
+            return
+        self._last_report = now
+        elapsed = now - self.start
+        print(f"{self.answered + self.errors}/{self.total} done ({self.errors} errors, {self.cached} cached), "
+              f"{self.completion_tokens} tokens, {self.completion_tokens / elapsed:.1f} tok/s", flush=True)
+
+    async def _send(self, client: httpx.AsyncClient, chunk: List[dict]):
+        remaining = {item["id"]: item for item in chunk}
+        for attempt in range(self.args.retries + 1):
+            payload = {
+                "items": [{"id": i["id"], "message": i["message"]} for i in remaining.values()],
+                "max_tokens": self.args.max_tokens,
+            }
+            retry_after = min(60, 2 ** attempt)
+            try:
+                async with client.stream("POST", "/generate/batch", json=payload) as response:
+                    if response.status_code != 200:
+                        await response.aread()
+                        retry_after = int(response.headers.get("Retry-After", retry_after))
+                        print(f"Batch request failed ({response.status_code}): {response.text[:200]}")
+                    else:
+                        async for line in response.aiter_lines():
+                            if not line.strip():
+                                continue
+                            result = json.loads(line)
+                            if "summary" in result:
+                                continue
+                            remaining.pop(result["id"], None)
+                            self._write(result)
+            except httpx.HTTPError as e:
+                print(f"Batch request failed: {e}")
+            if not remaining:
+                return
+            await asyncio.sleep(retry_after)
+        print(f"Giving up on {len(remaining)} questions after {self.args.retries} retries (rerun to resume)")
+
+    async def run(self):
+        async with httpx.AsyncClient(base_url=self.args.url, timeout=httpx.Timeout(None, connect=10.0)) as client:
+            async def worker():
+                while self.chunks:
+                    await self._send(client, self.chunks.popleft())
+            await asyncio.gather(*(worker() for _ in range(self.args.parallel)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Questions (.jsonl or .parquet)")
+    parser.add_argument("output", help="Results JSONL, appended to and used as the checkpoint")
+    parser.add_argument("--url", default=os.getenv("API_BASE_URL", "http://localhost:8000/api/v1"))
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=16, help="Questions per /generate/batch request")
+    parser.add_argument("--parallel", type=int, default=1, help="Chunks in flight (one per worker with src.serve)")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    items = read_questions(args.input)
+    done = load_checkpoint(args.output)
+    pending = [item for item in items if item["id"] not in done]
+    print(f"{len(items)} questions, {len(items) - len(pending)} already answered, {len(pending)} to go")
+    if not pending:
+        return
+
+    with open(args.output, "a", encoding="utf-8") as out:
+        job = BatchJob(args, pending, out)
+        asyncio.run(job.run())
+
+    elapsed = time.perf_counter() - job.start
+    print(f"Answered {job.answered}, failed {job.errors}, cached {job.cached} in {elapsed:.1f}s: "
+          f"{job.completion_tokens} completion tokens, {job.completion_tokens / elapsed:.1f} tok/s aggregate")
+    if job.answered + job.errors < len(pending) or job.errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
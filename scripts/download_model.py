@@ -2,14 +2,388 @@
 """
 Model downloader for build-time model deployment.
 Uses MLflow model registry to get S3 path, then downloads directly via boto3.
+
+The GGUF is fetched as parallel ranged GETs (tunable via DOWNLOAD_CHUNK_MB /
+DOWNLOAD_CONCURRENCY), resumes from a partial file after an interrupted build,
+is verified against SHA256 (object checksum / metadata / `<key>.sha256`) or the S3
+ETag, and is kept in a content-addressed cache (MODEL_CACHE_DIR) so rebuilds with
+an unchanged model skip the download entirely.
 """
+import base64
+import hashlib
+import json
 import os
-import sys
 import re
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import boto3
 import mlflow
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from tqdm import tqdm
 
+MB = 1024 * 1024
+# Block size khi hash file; mọi part size ứng viên đều là bội số của 1 MiB
+HASH_BLOCK = MB
+# S3: mọi part trừ part cuối >= 5 MiB
+MIN_PART_SIZE = 5 * MB
+# Part size hay gặp (aws cli / boto3 8 MiB, SDK khác 5, 16, 64, 100 MiB...) thử trước
+COMMON_PART_SIZES = tuple(n * MB for n in (8, 5, 16, 15, 32, 64, 100, 128, 256, 512))
+# Mỗi lượt đọc file tính ETag cho tối đa chừng này part size ứng viên
+ETAG_CANDIDATES_PER_PASS = 32
+MAX_ETAG_CANDIDATES = 256
+
+
+def transfer_config() -> TransferConfig:
+    """Chunk size / concurrency for ranged downloads, overridable from env"""
+    return TransferConfig(
+        multipart_chunksize=int(os.getenv("DOWNLOAD_CHUNK_MB", "64")) * MB,
+        max_concurrency=int(os.getenv("DOWNLOAD_CONCURRENCY", "16")),
+    )
+
+
+def list_objects(s3_client, bucket, prefix):
+    """All objects under prefix, following list_objects_v2 pagination"""
+    paginator = s3_client.get_paginator("list_objects_v2")
+    objects = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend(page.get("Contents", []))
+    return objects
+
+
+def pick_model(objects):
+    """Largest .gguf object (typically the main model), single pass"""
+    gguf_objects = [obj for obj in objects if obj["Key"].endswith(".gguf")]
+    if not gguf_objects:
+        return None
+    return max(gguf_objects, key=lambda obj: obj["Size"])
+
+
+def expected_checksums(s3_client, bucket, key):
+    """
+    What the downloaded bytes must match: (sha256 hex or None, etag, size).
+
+    SHA256 comes from, in order: the S3 full-object checksum, `sha256` user metadata,
+    or a `<key>.sha256` sidecar object.
+    """
+    head = s3_client.head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+    etag = head["ETag"].strip('"')
+    sha256 = None
+
+    checksum = head.get("ChecksumSHA256")
+    # Checksum dạng composite ("...-N") là hash của các part, không so được với file
+    if checksum and "-" not in checksum and head.get("ChecksumType", "FULL_OBJECT") == "FULL_OBJECT":
+        sha256 = base64.b64decode(checksum).hex()
+    if sha256 is None:
+        sha256 = (head.get("Metadata") or {}).get("sha256")
+    if sha256 is None:
+        try:
+            sidecar = s3_client.get_object(Bucket=bucket, Key=f"{key}.sha256")["Body"].read().decode().split()
+            sha256 = sidecar[0] if sidecar else None
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                raise
+    return (sha256.lower() if sha256 else None), etag, head["ContentLength"]
+
+
+def _etag_part_sizes(size, etag, chunk_size):
+    """
+    Every MiB-aligned part size that splits `size` into the ETag's part count, the
+    download chunk size and common upload part sizes first.
+    """
+    if "-" not in etag:
+        return []
+    n_parts = int(etag.rsplit("-", 1)[1])
+    if n_parts <= 1:
+        # Một part: part size không ảnh hưởng ETag
+        return [max(MB, -(-size // MB) * MB)]
+    # ceil(size / p) == n_parts  <=>  size / n_parts <= p <= (size - 1) / (n_parts - 1)
+    lowest = max(MIN_PART_SIZE, -(-size // n_parts))
+    highest = (size - 1) // (n_parts - 1)
+    first_mb, last_mb = -(-lowest // MB), highest // MB
+    if first_mb > last_mb:
+        return []
+
+    preferred = [p for p in (chunk_size, *COMMON_PART_SIZES)
+                 if p % MB == 0 and first_mb <= p // MB <= last_mb]
+    candidates = list(dict.fromkeys(preferred))
+    candidates += [mb * MB for mb in range(first_mb, last_mb + 1) if mb * MB not in candidates]
+    return candidates
+
+
+def _multipart_etags(path, size, part_sizes, on_block=None, desc="Verifying"):
+    """One read pass over `path`: the multipart ETag each part size would give"""
+    state = {p: [hashlib.md5(), []] for p in part_sizes}
+    offset = 0
+    with open(path, "rb") as f, tqdm(total=size, unit="B", unit_scale=True, desc=desc) as pbar:
+        while True:
+            block = f.read(HASH_BLOCK)
+            if not block:
+                break
+            if on_block is not None:
+                on_block(block)
+            offset += len(block)
+            for part_size, (md5, digests) in state.items():
+                md5.update(block)
+                if offset % part_size == 0 or offset == size:
+                    digests.append(md5.digest())
+                    state[part_size][0] = hashlib.md5()
+            pbar.update(len(block))
+    return {p: f"{hashlib.md5(b''.join(d)).hexdigest()}-{len(d)}" for p, (_, d) in state.items()}
+
+
+def verify_file(path, size, sha256, etag, chunk_size, allow_unverified=None):
+    """
+    SHA256, or the MD5 / multipart ETag when no SHA256 is published. Returns (ok, sha256 hex).
+
+    A multipart ETag is recomputed for every part size consistent with it, a batch of
+    candidates per read pass. If none reproduces it (KMS-encrypted object, non-MiB part
+    size) the file is rejected unless `allow_unverified` (DOWNLOAD_ALLOW_UNVERIFIED=1).
+    """
+    if allow_unverified is None:
+        allow_unverified = os.getenv("DOWNLOAD_ALLOW_UNVERIFIED", "0") == "1"
+    if os.path.getsize(path) != size:
+        print(f"ERROR: Size mismatch: expected {size}, got {os.path.getsize(path)}")
+        return False, None
+
+    sha = hashlib.sha256()
+    whole_md5 = hashlib.md5() if "-" not in etag else None
+
+    def consume(block):
+        sha.update(block)
+        if whole_md5 is not None:
+            whole_md5.update(block)
+
+    # Có SHA256 thì không cần tính lại multipart ETag
+    part_sizes = _etag_part_sizes(size, etag, chunk_size) if sha256 is None else []
+    if len(part_sizes) > MAX_ETAG_CANDIDATES:
+        print(f"WARNING: {len(part_sizes)} part sizes fit ETag {etag}, trying the first {MAX_ETAG_CANDIDATES}")
+        part_sizes = part_sizes[:MAX_ETAG_CANDIDATES]
+    batches = [part_sizes[i:i + ETAG_CANDIDATES_PER_PASS]
+               for i in range(0, len(part_sizes), ETAG_CANDIDATES_PER_PASS)] or [[]]
+
+    etags = _multipart_etags(path, size, batches[0], on_block=consume)
+    actual_sha = sha.hexdigest()
+    if sha256 is not None:
+        if actual_sha != sha256:
+            print(f"ERROR: SHA256 mismatch: expected {sha256}, got {actual_sha}")
+            return False, actual_sha
+        print("SHA256 verified")
+        return True, actual_sha
+
+    if whole_md5 is not None:
+        if whole_md5.hexdigest() != etag:
+            print(f"ERROR: ETag (MD5) mismatch: expected {etag}, got {whole_md5.hexdigest()}")
+            return False, actual_sha
+        print("ETag (MD5) verified")
+        return True, actual_sha
+
+    for i, batch in enumerate(batches):
+        if i > 0:
+            etags = _multipart_etags(path, size, batch, desc=f"Verifying ETag ({i + 1}/{len(batches)})")
+        for part_size, candidate in etags.items():
+            if candidate == etag:
+                print(f"Multipart ETag verified (part size {part_size // MB} MB)")
+                return True, actual_sha
+
+    if allow_unverified:
+        print(f"WARNING: Could not reproduce multipart ETag {etag}; size verified only (allowed)")
+        return True, actual_sha
+    # ETag của object mã hoá KMS không phải MD5 - cần SHA256 (checksum, metadata hoặc sidecar)
+    print(f"ERROR: Could not reproduce multipart ETag {etag} with any part size; publish a SHA256 "
+          f"for the object or set DOWNLOAD_ALLOW_UNVERIFIED=1 / --allow-unverified")
+    return False, actual_sha
+
+
+def _load_resume_state(state_path, etag, size, chunk_size):
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    # Object đổi (ETag khác) hoặc đổi chunk size thì tải lại từ đầu
+    if state.get("etag") != etag or state.get("size") != size or state.get("chunk_size") != chunk_size:
+        return set()
+    return set(state.get("done", []))
+
+
+def ranged_download(s3_client, bucket, key, dest, size, etag, config: TransferConfig):
+    """
+    Parallel ranged GETs into `dest + '.part'`, resumable.
+
+    Finished part indices are recorded in `dest + '.part.json'` (bound to the ETag), so an
+    interrupted download only fetches the missing ranges next time.
+    """
+    part_path = f"{dest}.part"
+    state_path = f"{dest}.part.json"
+    chunk_size = config.multipart_chunksize
+    n_parts = max(1, -(-size // chunk_size))
+
+    done = _load_resume_state(state_path, etag, size, chunk_size) if os.path.exists(part_path) else set()
+    if not done:
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+    elif os.path.getsize(part_path) != size:
+        with open(part_path, "r+b") as f:
+            f.truncate(size)
+
+    todo = [i for i in range(n_parts) if i not in done]
+    if done:
+        print(f"Resuming download: {len(done)}/{n_parts} parts already present")
+
+    lock = threading.Lock()
+
+    def save_state():
+        tmp = f"{state_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"etag": etag, "size": size, "chunk_size": chunk_size, "done": sorted(done)}, f)
+        os.replace(tmp, state_path)
+
+    def fetch(index):
+        start = index * chunk_size
+        end = min(size, start + chunk_size) - 1
+        # IfMatch: object bị ghi đè giữa chừng thì fail thay vì trộn 2 phiên bản
+        body = s3_client.get_object(
+            Bucket=bucket, Key=key, Range=f"bytes={start}-{end}", IfMatch=f'"{etag}"'
+        )["Body"]
+        with open(part_path, "r+b") as f:
+            f.seek(start)
+            for block in body.iter_chunks(chunk_size=HASH_BLOCK):
+                f.write(block)
+                pbar.update(len(block))
+        with lock:
+            done.add(index)
+            save_state()
+
+    already = sum(min(size, (i + 1) * chunk_size) - i * chunk_size for i in done)
+    with tqdm(total=size, initial=already, unit="B", unit_scale=True, desc="Downloading") as pbar:
+        with ThreadPoolExecutor(max_workers=config.max_concurrency) as pool:
+            futures = [pool.submit(fetch, i) for i in todo]
+            for future in as_completed(futures):
+                future.result()
+
+    return part_path
+
+
+def _place(src, dest):
+    """Hard-link cache blob to dest when possible, copy otherwise (e.g. across mounts)"""
+    tmp = f"{dest}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+def download_s3_model(s3_client, bucket, prefix, dest="./gguf_model.gguf", cache_dir=None, config=None,
+                      allow_unverified=None):
+    """
+    Download the largest .gguf under s3://bucket/prefix to `dest`.
+
+    Returns True on success. Works with any boto3-compatible client (e.g. moto in tests).
+    """
+    config = config or transfer_config()
+    cache_dir = cache_dir if cache_dir is not None else os.getenv("MODEL_CACHE_DIR", "")
+
+    print("Scanning for .gguf files...")
+    objects = list_objects(s3_client, bucket, prefix)
+    if not objects:
+        print(f"ERROR: No files found in s3://{bucket}/{prefix}")
+        return False
+
+    obj = pick_model(objects)
+    if obj is None:
+        print("ERROR: No .gguf files found")
+        print(f"Available files (first 10): {[o['Key'] for o in objects[:10]]}")
+        return False
+
+    key = obj["Key"]
+    sha256, etag, size = expected_checksums(s3_client, bucket, key)
+    print(f"Model: {key} ({size / MB:.1f} MB, etag={etag}, sha256={sha256 or 'n/a'})")
+
+    # Content-addressed cache: blob theo sha256 (nếu biết) hoặc etag+size
+    blob = None
+    if cache_dir:
+        blob_name = f"sha256-{sha256}" if sha256 else f"etag-{etag.replace('-', '_')}-{size}"
+        blob = os.path.join(cache_dir, "blobs", blob_name)
+        if os.path.exists(blob) and os.path.getsize(blob) == size:
+            print(f"Cache hit: {blob}")
+            _place(blob, dest)
+            print("Model ready (from cache)")
+            return True
+
+    target = blob or dest
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    part_path = ranged_download(s3_client, bucket, key, target, size, etag, config)
+
+    ok, _ = verify_file(part_path, size, sha256, etag, config.multipart_chunksize, allow_unverified)
+    if not ok:
+        # File hỏng thì bỏ luôn trạng thái resume
+        os.remove(part_path)
+        if os.path.exists(f"{target}.part.json"):
+            os.remove(f"{target}.part.json")
+        return False
+
+    os.replace(part_path, target)
+    os.remove(f"{target}.part.json")
+    if blob is not None:
+        _place(blob, dest)
+
+    print("Model downloaded successfully")
+    return True
+
+
+def resolve_version(model_name, version=None):
+    """
+    Registry version to deploy: `version` if given, else the latest one.
+
+    Returns (version, s3_path), or None if the model has no versions.
+    """
+    mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI"))
+    client = mlflow.tracking.MlflowClient()
+    if version is not None:
+        model_version = client.get_model_version(model_name, str(version))
+    else:
+        versions = client.get_latest_versions(model_name)
+        if not versions:
+            return None
+        model_version = max(versions, key=lambda v: int(v.version))
+    return str(model_version.version), model_version.source
+
+
+def make_s3_client(config=None):
+    config = config or transfer_config()
+    return boto3.client(
+        's3',
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        region_name=os.getenv("AWS_DEFAULT_REGION"),
+        # Đủ connection cho mọi worker tải song song
+        config=Config(max_pool_connections=max(10, config.max_concurrency)),
+    )
+
+
+def download_source(s3_path, dest, config=None):
+    """Download the model registered at `s3_path` (s3://bucket/prefix) to `dest`"""
+    match = re.match(r"s3://([^/]+)/(.*)", s3_path)
+    if not match:
+        print(f"ERROR: Invalid S3 path format: {s3_path}")
+        return False
+
+    bucket, prefix = match.groups()
+    print(f"S3 Bucket: {bucket}, Prefix: {prefix}")
+
+    # Direct S3 connection (faster than MLflow), list + download song song + verify
+    config = config or transfer_config()
+    return download_s3_model(make_s3_client(config), bucket, prefix, dest=dest, config=config)
+
+
 def download_model():
     """
     Download model from S3 using MLflow model registry metadata.
@@ -30,74 +404,24 @@ def download_model():
     try:
         # Step 1: Query MLflow for S3 path (minimal MLflow usage)
         print(f"Querying MLflow for model: {model_name}")
-        mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI"))
-        client = mlflow.tracking.MlflowClient()
-
-        versions = client.get_latest_versions(model_name)
-        if not versions:
+        resolved = resolve_version(model_name, os.getenv("MODEL_VERSION") or None)
+        if resolved is None:
             print(f"ERROR: No versions found for model '{model_name}'")
             return False
 
-        s3_path = versions[0].source
-        print(f"Model S3 path: {s3_path}")
-
-        # Step 2: Parse S3 path
-        match = re.match(r"s3://([^/]+)/(.*)", s3_path)
-        if not match:
-            print(f"ERROR: Invalid S3 path format: {s3_path}")
-            return False
-
-        bucket, prefix = match.groups()
-        print(f"S3 Bucket: {bucket}, Prefix: {prefix}")
-
-        # Step 3: Direct S3 connection (faster than MLflow)
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-            region_name=os.getenv("AWS_DEFAULT_REGION")
-        )
-
-        # Step 4: Find .gguf files
-        print("Scanning for .gguf files...")
-        response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-
-        if 'Contents' not in response:
-            print(f"ERROR: No files found in s3://{bucket}/{prefix}")
-            return False
-
-        gguf_files = [obj['Key'] for obj in response['Contents'] if obj['Key'].endswith('.gguf')]
-        if not gguf_files:
-            print("ERROR: No .gguf files found")
-            all_files = [obj['Key'] for obj in response['Contents'][:10]]  # Show first 10
-            print(f"Available files (first 10): {all_files}")
-            return False
-
-        # Step 5: Download largest .gguf file (typically the main model)
-        gguf_file = max(gguf_files, key=lambda f: next(obj['Size'] for obj in response['Contents'] if obj['Key'] == f))
-        file_size = next(obj['Size'] for obj in response['Contents'] if obj['Key'] == gguf_file)
-
-        print(f"Downloading: {gguf_file} ({file_size / 1024 / 1024:.1f} MB)")
-
-        # Step 6: Download with progress bar
-        def progress_callback(bytes_transferred):
-            pbar.update(bytes_transferred)
-
-        with tqdm(total=file_size, unit='B', unit_scale=True, desc="Downloading") as pbar:
-            s3_client.download_file(
-                Bucket=bucket,
-                Key=gguf_file,
-                Filename="./gguf_model.gguf",
-                Callback=progress_callback
-            )
+        version, s3_path = resolved
+        print(f"Model version {version}, S3 path: {s3_path}")
 
-        print("Model downloaded successfully")
-        return True
+        # Step 2: download
+        return download_source(s3_path, os.getenv("MODEL_PATH", "./gguf_model.gguf"))
 
     except Exception as e:
         print(f"ERROR: Download failed: {e}")
         return False
 
 if __name__ == "__main__":
+    if "--allow-unverified" in sys.argv[1:]:
+        # Chấp nhận file chỉ khớp size khi không tính lại được checksum (object mã hoá KMS)
+        os.environ["DOWNLOAD_ALLOW_UNVERIFIED"] = "1"
     success = download_model()
-    sys.exit(0 if success else 1)
\ No newline at end of file
+    sys.exit(0 if success else 1)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Measure llama.cpp runtime settings on this machine and write the best ones to the
+runtime config that ChatService loads at startup (MODEL_RUNTIME_CONFIG).
+
+    python scripts/tune_llama.py gguf_model.gguf --output runtime_config.json
+    python scripts/tune_llama.py model-f16.gguf --quantize q4_k_m q5_k_m q8_0 --output runtime_config.json
+
+n_threads, n_threads_batch, n_batch, n_ubatch, flash_attn, the KV cache type (and
+use_mlock with --mlock) are tuned one at a time on the first model, keeping a change
+only if it improves the objective by more than --min-gain. Every other model (the
+given files and the --quantize variants) is then measured with the tuned settings
+and the best one within --max-rss-mb is recommended. Only pass quantizations whose
+answer quality is acceptable: the tuner measures speed and memory, not quality.
+
+Each measurement loads the model in a fresh process and reports load time, prefill
+tokens/s (--prefill-tokens prompt), TTFT (--prompt-tokens prompt) and decode tokens/s
+(--decode-tokens), medians over --repeats runs after one warmup, and peak RSS.
+
+The profile is stored under this node's type (architecture/CPU model/usable CPUs, see
+src/runtime_config.py) and merged into an existing --output file, so one file can
+carry profiles for every node type in the cluster. Env vars such as MODEL_THREADS
+still override the profile.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import resource
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.runtime_config import KV_CACHE_TYPES, available_cpus, node_type  # noqa: E402
+
+TEXT = (
+    "Bạn là một trợ lý luật pháp Việt Nam thông minh, luôn trả lời bằng tiếng Việt chuẩn và dễ hiểu. "
+    "Theo Điều 161 Dự thảo Luật Kinh doanh bảo hiểm (sửa đổi), cơ quan quản lý nhà nước về hoạt động "
+    "kinh doanh bảo hiểm hoạt động trên những nguyên tắc nào? Dựa vào Điều 59 của Luật Hàng không dân "
+    "dụng Việt Nam, chức năng chính của Cảng vụ hàng không là gì? "
+)
+
+QUANT_TYPES = {
+    "q2_k": "LLAMA_FTYPE_MOSTLY_Q2_K",
+    "q3_k_m": "LLAMA_FTYPE_MOSTLY_Q3_K_M",
+    "q4_0": "LLAMA_FTYPE_MOSTLY_Q4_0",
+    "q4_k_s": "LLAMA_FTYPE_MOSTLY_Q4_K_S",
+    "q4_k_m": "LLAMA_FTYPE_MOSTLY_Q4_K_M",
+    "q5_k_s": "LLAMA_FTYPE_MOSTLY_Q5_K_S",
+    "q5_k_m": "LLAMA_FTYPE_MOSTLY_Q5_K_M",
+    "q6_k": "LLAMA_FTYPE_MOSTLY_Q6_K",
+    "q8_0": "LLAMA_FTYPE_MOSTLY_Q8_0",
+}
+
+
+def quantize(source: str, quant: str, out_dir: Optional[str]) -> str:
+    """Write `source` requantized to `quant` next to it (or in out_dir); reuses an existing file"""
+    import llama_cpp
+
+    stem = os.path.splitext(os.path.basename(source))[0]
+    path = os.path.join(out_dir or os.path.dirname(os.path.abspath(source)), f"{stem}-{quant}.gguf")
+    if os.path.exists(path):
+        print(f"Using existing {path}")
+        return path
+    params = llama_cpp.llama_model_quantize_default_params()
+    params.ftype = getattr(llama_cpp, QUANT_TYPES[quant])
+    params.nthread = available_cpus()
+    # Notebook convert xuất q8_0: cho phép lượng tử hoá lại (kém chất lượng hơn đi từ f16)
+    params.allow_requantize = True
+    print(f"Quantizing {source} -> {path}", flush=True)
+    if llama_cpp.llama_model_quantize(source.encode(), path.encode(), params) != 0:
+        raise RuntimeError(f"Quantization to {quant} failed")
+    return path
+
+
+def _median(values: List[float]) -> float:
+    return statistics.median(values) if values else 0.0
+
+
+def _measure(model_path: str, settings: dict, args, queue):
+    from llama_cpp import Llama
+
+    kwargs = dict(settings)
+    for key in ("type_k", "type_v"):
+        kwargs[key] = KV_CACHE_TYPES[kwargs[key]]
+    start = time.perf_counter()
+    llm = Llama(model_path=model_path, n_ctx=args.n_ctx, use_mmap=True, verbose=False, **kwargs)
+    load_s = time.perf_counter() - start
+
+    tokens = llm.tokenize(TEXT.encode("utf-8"))
+    while len(tokens) < args.prefill_tokens:
+        tokens += tokens
+    prefill_tokens = tokens[:args.prefill_tokens]
+    prompt_tokens = tokens[:args.prompt_tokens]
+
+    prefill, ttft, decode = [], [], []
+    for run in range(args.repeats + 1):
+        llm.reset()
+        start = time.perf_counter()
+        llm.eval(prefill_tokens)
+        prefill_s = time.perf_counter() - start
+
+        # generate() không dừng ở EOS: luôn đo đủ decode_tokens
+        llm.reset()
+        start = time.perf_counter()
+        first = None
+        for i, _ in enumerate(llm.generate(prompt_tokens, temp=0.0)):
+            if i == 0:
+                first = time.perf_counter()
+            if i + 1 >= args.decode_tokens:
+                break
+        end = time.perf_counter()
+        if run == 0:
+            continue  # Warmup: page fault, khởi tạo compute buffer
+        prefill.append(len(prefill_tokens) / prefill_s)
+        ttft.append((first - start) * 1000)
+        decode.append((args.decode_tokens - 1) / (end - first))
+
+    queue.put({
+        "load_s": round(load_s, 3),
+        "prefill_tps": round(_median(prefill), 1),
+        "ttft_ms": round(_median(ttft), 1),
+        "decode_tps": round(_median(decode), 2),
+        # Linux: ru_maxrss tính bằng KB
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    })
+
+
+class Tuner:
+    def __init__(self, args):
+        self.args = args
+        self.runs: List[dict] = []
+
+    def measure(self, model_path: str, settings: dict) -> Optional[dict]:
+        ctx = mp.get_context("spawn")
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_measure, args=(model_path, settings, self.args, queue))
+        proc.start()
+        proc.join()
+        result = None if queue.empty() else queue.get()
+        run = {"model": model_path, **settings, **(result or {"error": f"exit code {proc.exitcode}"})}
+        run["score"] = self.score(run) if result else None
+        self.runs.append(run)
+        print(json.dumps(run, ensure_ascii=False), flush=True)
+        return run if result else None
+
+    def score(self, run: dict) -> float:
+        """Higher is better"""
+        objective = self.args.objective
+        if objective == "prefill":
+            return run["prefill_tps"]
+        if objective == "decode":
+            return run["decode_tps"]
+        if objective == "ttft":
+            return -run["ttft_ms"]
+        # latency: thời gian trả lời một request điển hình (TTFT + answer_tokens token)
+        return -(run["ttft_ms"] / 1000 + (self.args.answer_tokens - 1) / max(run["decode_tps"], 1e-9))
+
+    def candidates(self, knob: str, settings: dict) -> list:
+        cpus = available_cpus()
+        if knob in ("n_threads", "n_threads_batch"):
+            return sorted({n for n in (1, 2, 4, 8, 16, 32, 64, cpus // 2, cpus - 1, cpus) if 1 <= n <= cpus})
+        if knob == "n_batch":
+            return [n for n in (128, 256, 512, 1024, 2048) if n <= self.args.n_ctx]
+        if knob == "n_ubatch":
+            return [n for n in (64, 128, 256, 512, 1024) if n <= settings["n_batch"]]
+        if knob == "flash_attn":
+            return [False, True]
+        if knob == "kv":
+            # V cache lượng tử hoá cần flash attention
+            return [("f16", "f16"), ("q8_0", "f16")] + ([("q8_0", "q8_0")] if settings["flash_attn"] else [])
+        if knob == "use_mlock":
+            return [False, True]
+        raise ValueError(knob)
+
+    @staticmethod
+    def apply(settings: dict, knob: str, value) -> dict:
+        if knob == "kv":
+            return {**settings, "type_k": value[0], "type_v": value[1]}
+        updated = {**settings, knob: value}
+        if knob == "n_batch":
+            updated["n_ubatch"] = min(updated["n_ubatch"], value)
+        return updated
+
+    def tune(self, model_path: str) -> tuple:
+        cpus = available_cpus()
+        best_settings = {
+            "n_threads": cpus, "n_threads_batch": cpus, "n_batch": 512, "n_ubatch": 512,
+            "flash_attn": False, "type_k": "f16", "type_v": "f16", "use_mlock": False,
+        }
+        best = self.measure(model_path, best_settings)
+        if best is None:
+            raise SystemExit(f"Baseline run failed on {model_path}")
+        knobs = ["n_threads", "n_threads_batch", "n_batch", "n_ubatch", "flash_attn", "kv"]
+        if self.args.mlock:
+            knobs.append("use_mlock")
+        for knob in knobs:
+            for value in self.candidates(knob, best_settings):
+                settings = self.apply(best_settings, knob, value)
+                if settings == best_settings:
+                    continue
+                run = self.measure(model_path, settings)
+                # Chỉ đổi khi cải thiện rõ rệt hơn nhiễu đo
+                if run is not None and run["score"] > best["score"] + abs(best["score"]) * self.args.min_gain:
+                    best, best_settings = run, settings
+            print(f"{knob}: {best_settings}", flush=True)
+        return best_settings, best
+
+    def pick_model(self, models: List[str], settings: dict, tuned: dict) -> dict:
+        results = {models[0]: tuned}
+        for model_path in models[1:]:
+            run = self.measure(model_path, settings)
+            if run is not None:
+                results[model_path] = run
+        fits = {m: r for m, r in results.items()
+                if not self.args.max_rss_mb or r["peak_rss_mb"] <= self.args.max_rss_mb}
+        if not fits:
+            raise SystemExit(f"No model fits in --max-rss-mb {self.args.max_rss_mb}")
+        return max(fits.values(), key=lambda r: r["score"])
+
+
+def write_profile(path: str, name: str, profile: dict):
+    config: Dict[str, dict] = {"profiles": {}}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+    config.setdefault("profiles", {})[name] = profile
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("models", nargs="+", help="GGUF files; settings are tuned on the first one")
+    parser.add_argument("--quantize", nargs="+", default=[], choices=sorted(QUANT_TYPES),
+                        help="Also measure these quantizations of the first model (requantizing a q8_0 "
+                             "file works but loses more quality than starting from f16)")
+    parser.add_argument("--quant-dir", help="Where to write quantized variants (default: next to the model)")
+    parser.add_argument("--output", default=os.getenv("MODEL_RUNTIME_CONFIG", "./runtime_config.json"))
+    parser.add_argument("--profile", help="Profile name (default: this node's type)")
+    parser.add_argument("--objective", default="latency", choices=["latency", "decode", "prefill", "ttft"],
+                        help="latency: TTFT + --answer-tokens at the decode rate")
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--n-ctx", type=int, default=int(os.getenv("MODEL_N_CTX") or 4096))
+    parser.add_argument("--prefill-tokens", type=int, default=512)
+    parser.add_argument("--prompt-tokens", type=int, default=128, help="Prompt length for TTFT and decode")
+    parser.add_argument("--decode-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-gain", type=float, default=0.03, help="Relative improvement needed to change a knob")
+    parser.add_argument("--max-rss-mb", type=float, default=0, help="Only recommend models within this peak RSS")
+    parser.add_argument("--mlock", action="store_true", help="Also try use_mlock (needs IPC_LOCK / memlock limit)")
+    parser.add_argument("--results", help="Write every measurement to this JSON file")
+    args = parser.parse_args()
+
+    models = list(args.models)
+    for quant in args.quantize:
+        path = quantize(args.models[0], quant, args.quant_dir)
+        if path not in models:
+            models.append(path)
+
+    name = args.profile or node_type()
+    print(f"Tuning for node type {node_type()} ({available_cpus()} usable CPUs), objective {args.objective}")
+    tuner = Tuner(args)
+    settings, tuned = tuner.tune(models[0])
+    best = tuner.pick_model(models, settings, tuned)
+
+    profile = {
+        "model_path": best["model"],
+        "llama": settings,
+        "measured": {k: best[k] for k in ("load_s", "prefill_tps", "ttft_ms", "decode_tps", "peak_rss_mb")},
+        "objective": args.objective,
+        "n_ctx": args.n_ctx,
+        "tuned_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    write_profile(args.output, name, profile)
+
+    print(f"\n{'model':<40} {'thr':>3} {'thrB':>4} {'batch':>5} {'ubat':>4} {'fa':>2} {'kv':>9} "
+          f"{'prefill/s':>9} {'ttft ms':>8} {'decode/s':>8} {'RSS MB':>7}")
+    for run in tuner.runs:
+        if "error" in run:
+            continue
+        print(f"{os.path.basename(run['model'])[-40:]:<40} {run['n_threads']:>3} {run['n_threads_batch']:>4} "
+              f"{run['n_batch']:>5} {run['n_ubatch']:>4} {'y' if run['flash_attn'] else 'n':>2} "
+              f"{run['type_k'] + '/' + run['type_v']:>9} {run['prefill_tps']:>9.0f} {run['ttft_ms']:>8.1f} "
+              f"{run['decode_tps']:>8.1f} {run['peak_rss_mb']:>7.0f}")
+    print(f"\nRecommended {os.path.basename(best['model'])} with {settings}")
+    print(f"Wrote profile {name!r} to {args.output}")
+
+    if args.results:
+        with open(args.results, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "runs": tuner.runs}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
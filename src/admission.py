@@ -0,0 +1,212 @@
+from loguru import logger
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import List, Optional
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+
+from .metrics import ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_WAIT, ADMISSION_REJECTED
+from .tracing import span
+
+
+class Priority(IntEnum):
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class AdmissionRejected(Exception):
+    """Base class cho request bị từ chối trước khi chạm vào model"""
+    status_code = 503
+    reason = "rejected"
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFullError(AdmissionRejected):
+    status_code = 429
+    reason = "queue_full"
+
+
+class QueueTimeoutError(AdmissionRejected):
+    status_code = 503
+    reason = "queue_timeout"
+
+
+class AdmissionController:
+    """
+    Bounded priority queue in front of ChatService.
+
+    At most `max_concurrency` generations hold a model slot; up to `max_queue_depth`
+    more wait in (priority, FIFO) order. Anything beyond that is rejected immediately,
+    and waiters that exceed `queue_timeout` are rejected instead of piling up.
+
+    LOW (batch/offline) work only fills idle capacity: it holds at most `max_low_active`
+    slots, never counts against the queue depth seen by interactive arrivals, and waits
+    `low_queue_timeout` (None: as long as it takes).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 1,
+        max_queue_depth: int = 16,
+        queue_timeout: float = 30.0,
+        max_low_active: Optional[int] = None,
+        low_queue_timeout: Optional[float] = None,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue_depth = max(0, max_queue_depth)
+        self.queue_timeout = queue_timeout
+        # Mặc định chừa 1 slot cho request interactive (trừ khi chỉ có 1 slot)
+        if max_low_active is None:
+            max_low_active = self.max_concurrency - 1
+        self.max_low_active = min(self.max_concurrency, max(1, max_low_active))
+        self.low_queue_timeout = low_queue_timeout
+
+        self._active = 0
+        self._low_active = 0
+        self._queued = 0
+        self._queued_by = [0] * len(Priority)
+        self._waiters: List[list] = []
+        self._seq = itertools.count()
+        # EWMA thời gian giữ slot, dùng để ước lượng Retry-After
+        self._avg_service_time = 5.0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def retry_after(self) -> int:
+        """Estimated seconds until a slot frees up for a new arrival"""
+        backlog = self._queued + 1
+        return max(1, math.ceil(self._avg_service_time * backlog / self.max_concurrency))
+
+    def _update_gauges(self):
+        ADMISSION_QUEUE_DEPTH.set(self._queued)
+        ADMISSION_ACTIVE.set(self._active)
+
+    def _queued_ahead(self, priority: Priority) -> int:
+        """Waiters served before (or FIFO with) a new arrival of `priority`"""
+        return sum(self._queued_by[: int(priority) + 1])
+
+    def _can_run(self, priority: int) -> bool:
+        return priority < Priority.LOW or self._low_active < self.max_low_active
+
+    def _take(self, priority: int):
+        if priority == Priority.LOW:
+            self._low_active += 1
+
+    async def acquire(self, priority: Priority = Priority.NORMAL) -> float:
+        """Wait for a model slot. Returns the time spent queued."""
+        with span("admission.wait", priority=priority.name, queue_depth=self.queue_depth):
+            return await self._acquire(priority)
+
+    async def _acquire(self, priority: Priority) -> float:
+        start = time.perf_counter()
+
+        # Slot trống mà vẫn có waiter thì đó chỉ có thể là LOW đã chạm max_low_active
+        if self._active < self.max_concurrency and self._queued_ahead(priority) == 0 and self._can_run(priority):
+            self._active += 1
+            self._take(priority)
+            self._update_gauges()
+            ADMISSION_QUEUE_WAIT.observe(0.0)
+            return 0.0
+
+        if self._queued_ahead(priority) >= self.max_queue_depth:
+            ADMISSION_REJECTED.labels(reason=QueueFullError.reason).inc()
+            raise QueueFullError("Server is busy, generation queue is full", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [int(priority), next(self._seq), future])
+        self._queued += 1
+        self._queued_by[priority] += 1
+        self._update_gauges()
+
+        timeout = self.low_queue_timeout if priority == Priority.LOW else self.queue_timeout
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Slot vừa được chuyển cho mình đúng lúc timeout - trả lại
+                self.release(priority=priority)
+            else:
+                future.cancel()
+                self._queued -= 1
+                self._queued_by[priority] -= 1
+                self._update_gauges()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            ADMISSION_REJECTED.labels(reason=QueueTimeoutError.reason).inc()
+            raise QueueTimeoutError("Timed out waiting for a model slot", self.retry_after())
+
+        wait_time = time.perf_counter() - start
+        ADMISSION_QUEUE_WAIT.observe(wait_time)
+        return wait_time
+
+    def release(self, service_time: float = None, priority: Priority = Priority.NORMAL):
+        """Give the slot back, handing it directly to the next live waiter if any"""
+        if service_time is not None:
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+        if priority == Priority.LOW:
+            self._low_active = max(0, self._low_active - 1)
+
+        while self._waiters:
+            waiter_priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            # Heap theo priority: waiter đầu là LOW nghĩa là chỉ còn LOW đang chờ
+            if not self._can_run(waiter_priority):
+                break
+            heapq.heappop(self._waiters)
+            # Chuyển slot thẳng cho waiter, _active giữ nguyên
+            self._queued -= 1
+            self._queued_by[waiter_priority] -= 1
+            self._take(waiter_priority)
+            future.set_result(True)
+            self._update_gauges()
+            return
+
+        self._active = max(0, self._active - 1)
+        self._update_gauges()
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority = Priority.NORMAL):
+        """async with admissionController.slot(): ... holds a model slot for the block"""
+        await self.acquire(priority)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start, priority)
+
+
+def _default_concurrency() -> str:
+    # Batching: mỗi slot trong batch là một request đồng thời
+    if os.getenv("BATCHING_ENABLED", "0") == "1":
+        return os.getenv("BATCH_MAX_SIZE", "4")
+    return os.getenv("MODEL_REPLICAS", "1")
+
+
+admissionController = AdmissionController(
+    max_concurrency=int(os.getenv("MAX_CONCURRENT_GENERATIONS", _default_concurrency())),
+    max_queue_depth=int(os.getenv("ADMISSION_MAX_QUEUE", "16")),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30")),
+    max_low_active=int(os.environ["ADMISSION_LOW_MAX_ACTIVE"]) if os.getenv("ADMISSION_LOW_MAX_ACTIVE") else None,
+    low_queue_timeout=float(os.getenv("ADMISSION_LOW_QUEUE_TIMEOUT", "0")) or None,
+)
+logger.info(
+    f"Admission control: concurrency={admissionController.max_concurrency}, "
+    f"max_queue={admissionController.max_queue_depth}, timeout={admissionController.queue_timeout}s, "
+    f"low_priority_slots={admissionController.max_low_active}"
+)
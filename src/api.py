@@ -1,50 +1,452 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response, status
 from fastapi.responses import JSONResponse, StreamingResponse
 from loguru import logger
+import asyncio
+import functools
 import time
 import json
-from typing import Optional, Generator
+import os
+import secrets
+from typing import List, Optional, Generator, Set, Tuple
 
 # Import models và services
-from .dto import ChatRequestDTO, ChatResponseDTO, ErrorResponseDTO, StreamChatRequestDTO
+from .dto import (
+    BatchGenerateRequestDTO, BatchItemDTO, ChatRequestDTO, ChatResponseDTO, ErrorResponseDTO, ModelSwapRequestDTO,
+    SessionResponseDTO, StreamChatRequestDTO,
+)
 from .chat_service import chatService
+from .admission import admissionController, AdmissionRejected, Priority
+from .response_cache import responseCache, replay_chunks
+from .semantic_cache import semanticCache
+from .instrumentation import RequestMetrics, GenerationTracker
+from .generations import InvalidGenerationId, generationRegistry
+from .context_window import ContextBudgetError
+from .model_registry import modelRegistry
+from .metrics import BATCH_ITEMS
+from .single_flight import Flight, singleFlight
+from .sse import FlushPolicy, coalesce, encode_event, encode_json_event, HEARTBEAT, HEARTBEAT_FRAME, DONE_FRAME
+from .tracing import handler_entered, span, start_span
+from .profiler import MODES, ProfilerBusy, collapsed, samplingProfiler
 
 # Tạo router
 router = APIRouter()
 
+# Gom token trước khi ghi ra socket (STREAM_FLUSH_TOKENS / STREAM_FLUSH_MS)
+flush_policy = FlushPolicy.from_env()
+
+# Câu trả lời đã cache là của model cũ
+if responseCache is not None:
+    chatService.swap_listeners.append(responseCache.clear)
+if semanticCache is not None:
+    chatService.swap_listeners.append(semanticCache.clear)
+
+def _admission_error(e: AdmissionRejected) -> HTTPException:
+    """Map admission rejection to 429/503 with Retry-After"""
+    return HTTPException(
+        status_code=e.status_code,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+def _require_admin(x_admin_token: Optional[str]):
+    admin_token = os.getenv("ADMIN_TOKEN", "")
+    if not admin_token or not secrets.compare_digest(x_admin_token or "", admin_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin token required")
+
+def _model_unavailable() -> HTTPException:
+    """Model chưa load / đang warmup - client thử lại sau, không tự load trong request"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="AI model is not available. Please try again later.",
+        headers={"Retry-After": "5"},
+    )
+
+def _start_generation(max_tokens: int, http_request: Request):
+    """Generation id do server sinh, hoặc id client tự đặt (400 nếu dễ đoán, 409 nếu trùng)"""
+    try:
+        return generationRegistry.start(max_tokens, http_request.headers.get("X-Generation-Id"))
+    except InvalidGenerationId as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+def _context_error(e: ContextBudgetError) -> HTTPException:
+    """Prompt không vừa n_ctx - 413, không tốn prefill"""
+    return HTTPException(status_code=e.status_code, detail=str(e))
+
+async def _plan(message: str, max_tokens: int, session_id: Optional[str]):
+    """Context plan cho request, None nếu model chưa load (generate sẽ trả MODEL_NOT_LOADED)"""
+    if not chatService.is_model_loaded():
+        return None
+    try:
+        return await chatService.aplan_request(message, max_tokens, session_id)
+    except ContextBudgetError as e:
+        raise _context_error(e)
+
+def _stream_response(frames) -> StreamingResponse:
+    return StreamingResponse(
+        frames,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            # Tắt buffering của nginx ingress cho stream
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+def _usage_payload(tracker: Optional[GenerationTracker], cached: bool = False) -> dict:
+    if tracker is None:
+        return {"cached": cached}
+    tps = tracker.tokens_per_second
+    ttft = tracker.ttft
+    return {
+        "prompt_tokens": tracker.prompt_tokens,
+        "completion_tokens": tracker.completion_tokens,
+        "ttft": round(ttft, 4) if ttft is not None else None,
+        "tokens_per_second": round(tps, 2) if tps is not None else None,
+        "cached": cached,
+    }
+
+def _cacheable(session_id: Optional[str]) -> bool:
+    """Câu trả lời phụ thuộc lịch sử hội thoại - chỉ cache lượt đầu của session"""
+    return session_id is None or not chatService.sessions.history(session_id, create=False)
+
+async def _cached_answer(message: str, max_tokens: int, endpoint: str) -> Tuple[Optional[str], str, object]:
+    """
+    Exact-match cache first, then semantic near-duplicate lookup.
+    Returns (answer or None, exact cache key, question embedding or None).
+    """
+    with span("cache.lookup", endpoint=endpoint) as current:
+        answer, cache_key, vector = await _lookup_caches(message, max_tokens, endpoint)
+        if current is not None:
+            current.set_attribute("hit", answer is not None)
+    return answer, cache_key, vector
+
+async def _lookup_caches(message: str, max_tokens: int, endpoint: str) -> Tuple[Optional[str], str, object]:
+    cache_key = chatService.cache_key(message, max_tokens)
+    if responseCache is not None:
+        cached = responseCache.get(cache_key, endpoint=endpoint)
+        if cached is not None:
+            return cached, cache_key, None
+
+    vector = None
+    if semanticCache is not None:
+        try:
+            answer, vector = await semanticCache.alookup(message, chatService.cache_key("", max_tokens))
+            if answer is not None:
+                # cache_key và params key cùng gắn model version: hit của model cũ không ghi vào key mới
+                if responseCache is not None:
+                    responseCache.set(cache_key, answer)
+                return answer, cache_key, vector
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {e}")
+
+    return None, cache_key, vector
+
+async def _remember_answer(message: str, max_tokens: int, cache_key: str, answer: str, vector=None):
+    """Store a successful generation in both cache layers"""
+    if not answer or chatService.is_error_response(answer):
+        return
+    if responseCache is not None:
+        responseCache.set(cache_key, answer)
+    if semanticCache is not None:
+        try:
+            await semanticCache.astore(message, answer, chatService.cache_key("", max_tokens), vector)
+        except Exception as e:
+            logger.warning(f"Semantic cache store failed: {e}")
+
+async def _watch_disconnect(http_request: Request, generation, interval: float = 0.25):
+    """Cancel the generation as soon as the streaming client goes away"""
+    while not generation.cancelled:
+        if await http_request.is_disconnected():
+            generation.cancel("disconnect")
+            return
+        await asyncio.sleep(interval)
+
+async def _produce_flight(
+    flight: Flight,
+    message: str,
+    max_tokens: int,
+    plan,
+    session_id: Optional[str],
+    cache_key: str,
+    question_vector=None,
+):
+    """Generation behind a shared flight: holds the model slot and publishes every piece"""
+    try:
+        await admissionController.acquire()
+    except BaseException as e:
+        # Bị từ chối hoặc mọi subscriber rời đi khi còn xếp hàng: chưa có slot để release
+        if isinstance(e, asyncio.CancelledError):
+            flight.generation.cancel("disconnect")
+        generationRegistry.finish(flight.generation, 0)
+        raise
+    # TTFT / prefill tính từ lúc có slot như request không qua flight, không gồm thời gian xếp hàng
+    flight.tracker = GenerationTracker()
+    flight.started()
+    slot_start = time.perf_counter()
+    try:
+        # session_id của request dẫn đầu: lượt hội thoại + KV snapshot lưu vào session đó
+        async for piece in chatService.astreaming_response(
+            user_input=message,
+            max_tokens=max_tokens,
+            tracker=flight.tracker,
+            cancel_event=flight.generation.cancel_event,
+            session_id=session_id,
+            plan=plan,
+        ):
+            flight.publish(piece)
+    finally:
+        generationRegistry.finish(flight.generation, flight.tracker.completion_tokens)
+        admissionController.release(time.perf_counter() - slot_start)
+    if not flight.generation.cancelled:
+        await _remember_answer(message, max_tokens, cache_key, flight.text, question_vector)
+
+def _coalescing(cacheable: bool) -> bool:
+    """Identical requests may share one generation: cacheable and deterministic (or opted in)"""
+    return cacheable and singleFlight is not None and singleFlight.coalesces(chatService.temperature)
+
+def _join_flight(message: str, max_tokens: int, plan, session_id: Optional[str], cache_key: str,
+                 question_vector, endpoint: str) -> Tuple[Flight, bool]:
+    """Attach to the identical in-flight generation, or start it"""
+    produce = functools.partial(
+        _produce_flight,
+        message=message,
+        max_tokens=max_tokens,
+        plan=plan,
+        session_id=session_id,
+        cache_key=cache_key,
+        question_vector=question_vector,
+    )
+    return singleFlight.acquire(cache_key, max_tokens, produce, endpoint)
+
+def _finish_follower(flight: Flight, session_id: Optional[str], message: str):
+    """Request that attached to another's flight: record the turn in its own session"""
+    if session_id is not None and flight.completed:
+        chatService.sessions.append_turn(session_id, message, flight.text)
+
 @router.post("/generate", response_model=ChatResponseDTO, status_code=status.HTTP_200_OK)
-async def generate_chat_response(request: ChatRequestDTO):
+async def generate_chat_response(request: ChatRequestDTO, http_request: Request, response: Response):
     """
     Generate AI response for user message
     """
+    handler_entered()
 
     # start timer for response time measurement
     start_time = time.time()
+    request_metrics = RequestMetrics("generate")
+
+    # Câu hỏi lặp lại - trả lời từ cache, không cần model slot
+    cacheable = _cacheable(request.session_id)
+    cached, cache_key, question_vector = None, None, None
+    if cacheable:
+        cached, cache_key, question_vector = await _cached_answer(request.message, request.max_tokens, "generate")
+    if cached is not None:
+        if request.session_id is not None:
+            chatService.sessions.append_turn(request.session_id, request.message, cached)
+        request_metrics.done(status.HTTP_200_OK)
+        return ChatResponseDTO(
+            response=cached,
+            response_time=time.time() - start_time,
+            model_used="gguf",
+            timestamp=time.time(),
+            cached=True,
+            session_id=request.session_id,
+        )
+
+    # Kiểm tra context window trước khi xếp hàng chờ model slot
+    try:
+        plan = await _plan(request.message, request.max_tokens, request.session_id)
+    except HTTPException as e:
+        request_metrics.done(e.status_code)
+        raise
+
+    # Client có thể tự đặt id (khó đoán, không trùng) để huỷ qua DELETE /generations/{id} khi đang chờ
+    try:
+        generation = _start_generation(request.max_tokens, http_request)
+    except HTTPException as e:
+        request_metrics.done(e.status_code)
+        raise
+    response.headers["X-Generation-Id"] = generation.id
+    tracker = None
+    flight, leader = None, False
 
     # Generate response using the service
     try:
-        ai_response = chatService.generate_response(
-            user_input=request.message,
-            max_tokens=request.max_tokens,
-        )
+        if _coalescing(cacheable) and plan is not None:
+            # Câu hỏi giống hệt đang được sinh: dùng chung generation đó
+            flight, leader = _join_flight(request.message, request.max_tokens, plan, request.session_id,
+                                          cache_key, question_vector, "generate")
+            await flight.wait_started()
+            ai_response = "".join([piece async for piece in flight.stream(generation.cancel_event)])
+            tracker = flight.tracker
+            if not leader:
+                _finish_follower(flight, request.session_id, request.message)
+        else:
+            async with admissionController.slot():
+                tracker = GenerationTracker()
+                ai_response = await chatService.agenerate_response(
+                    user_input=request.message,
+                    max_tokens=request.max_tokens,
+                    tracker=tracker,
+                    cancel_event=generation.cancel_event,
+                    session_id=request.session_id,
+                    plan=plan,
+                )
 
+    except AdmissionRejected as e:
+        request_metrics.done(e.status_code)
+        raise _admission_error(e)
     except Exception as e:
         logger.error(f"Error generating AI response: {e}")
+        request_metrics.done(status.HTTP_500_INTERNAL_SERVER_ERROR)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to generate response. Please try again."
         )
+    finally:
+        generationRegistry.finish(generation, tracker.completion_tokens if tracker else 0)
+        if flight is not None:
+            singleFlight.leave(flight)
 
     response_time = time.time() - start_time
 
+    # Câu trả lời bị huỷ giữa chừng không được cache (flight tự cache khi xong)
+    if cacheable and flight is None and not generation.cancelled:
+        await _remember_answer(request.message, request.max_tokens, cache_key, ai_response, question_vector)
+    request_metrics.done(status.HTTP_200_OK)
+
     # Return response (không save database)
     return ChatResponseDTO(
         response=ai_response,
         response_time=response_time,
         model_used="gguf",
-        timestamp=time.time()
+        timestamp=time.time(),
+        deduplicated=flight is not None and not leader,
+        session_id=request.session_id,
     )
 
+async def _generate_in_low_slot(message: str, max_tokens: int, plan, generation) -> Tuple[str, GenerationTracker]:
+    """Runs with a LOW slot already acquired and gives it back itself, so it can be shielded"""
+    tracker = GenerationTracker()
+    slot_start = time.perf_counter()
+    try:
+        answer = await chatService.agenerate_response(
+            user_input=message,
+            max_tokens=max_tokens,
+            tracker=tracker,
+            cancel_event=generation.cancel_event,
+            plan=plan,
+        )
+        return answer, tracker
+    finally:
+        admissionController.release(time.perf_counter() - slot_start, Priority.LOW)
+        generationRegistry.finish(generation, tracker.completion_tokens)
+
+async def _answer_batch_item(item: BatchItemDTO, max_tokens: int, generations: Set) -> dict:
+    """One batch question: cache lookup, then generation in a LOW priority slot"""
+    start = time.perf_counter()
+    result = {"id": item.id, "message": item.message, "response": None, "cached": False,
+              "prompt_tokens": 0, "completion_tokens": 0, "error": None}
+    try:
+        cached, cache_key, question_vector = await _cached_answer(item.message, max_tokens, "generate_batch")
+        if cached is not None:
+            result.update(response=cached, cached=True)
+        else:
+            plan = await chatService.aplan_request(item.message, max_tokens)
+            while True:
+                try:
+                    await admissionController.acquire(Priority.LOW)
+                    break
+                except AdmissionRejected as e:
+                    # Hàng đợi đầy request interactive: batch lùi lại, không giành chỗ
+                    await asyncio.sleep(e.retry_after)
+            generation = generationRegistry.start(max_tokens)
+            generations.add(generation)
+            try:
+                # Client ngắt kết nối: huỷ generation, slot được trả khi decode thật sự dừng
+                answer, tracker = await asyncio.shield(
+                    _generate_in_low_slot(item.message, max_tokens, plan, generation)
+                )
+            finally:
+                generations.discard(generation)
+            result.update(prompt_tokens=tracker.prompt_tokens, completion_tokens=tracker.completion_tokens)
+            if generation.cancelled:
+                result["error"] = "cancelled"
+            elif chatService.is_error_response(answer):
+                result["error"] = answer
+            else:
+                result["response"] = answer
+                await _remember_answer(item.message, max_tokens, cache_key, answer, question_vector)
+    except ContextBudgetError as e:
+        result["error"] = str(e)
+    except Exception as e:
+        logger.error(f"Error answering batch item {item.id}: {e}")
+        result["error"] = "Failed to generate response"
+
+    result["latency"] = round(time.perf_counter() - start, 4)
+    BATCH_ITEMS.labels(status="error" if result["error"] else "cached" if result["cached"] else "generated").inc()
+    return result
+
+def _cancel_batch(tasks: List[asyncio.Task], generations: Set):
+    # Generation đang chạy dừng trong một token, item đang chờ slot bị huỷ luôn
+    for generation in list(generations):
+        generation.cancel("disconnect")
+    for task in tasks:
+        task.cancel()
+
+async def _watch_batch_disconnect(http_request: Request, tasks: List[asyncio.Task], generations: Set, interval: float = 0.5):
+    while not await http_request.is_disconnected():
+        await asyncio.sleep(interval)
+    _cancel_batch(tasks, generations)
+
+@router.post("/generate/batch")
+async def generate_batch(request: BatchGenerateRequestDTO, http_request: Request):
+    """
+    Answer many questions at low priority. Results stream back as NDJSON lines in
+    completion order, followed by a {"summary": ...} line.
+    """
+    handler_entered()
+    request_metrics = RequestMetrics("generate_batch")
+    if not chatService.is_model_loaded():
+        request_metrics.done(status.HTTP_503_SERVICE_UNAVAILABLE)
+        raise _model_unavailable()
+
+    max_tokens = request.max_tokens or 200
+    # Mặc định đủ để lấp các slot LOW, không xếp thêm vào hàng đợi admission
+    concurrency = min(request.concurrency or admissionController.max_low_active, len(request.items))
+
+    async def results():
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(concurrency)
+        generations = set()
+
+        async def run(item: BatchItemDTO) -> dict:
+            async with semaphore:
+                return await _answer_batch_item(item, max_tokens, generations)
+
+        tasks = [asyncio.create_task(run(item)) for item in request.items]
+        watcher = asyncio.create_task(_watch_batch_disconnect(http_request, tasks, generations))
+        summary = {"items": len(tasks), "errors": 0, "cached": 0, "completion_tokens": 0}
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                summary["errors"] += result["error"] is not None
+                summary["cached"] += result["cached"]
+                summary["completion_tokens"] += result["completion_tokens"]
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+
+            elapsed = time.perf_counter() - start
+            summary["elapsed"] = round(elapsed, 3)
+            summary["tokens_per_second"] = round(summary["completion_tokens"] / elapsed, 2) if elapsed > 0 else None
+            yield json.dumps({"summary": summary}) + "\n"
+            request_metrics.done(status.HTTP_200_OK)
+        finally:
+            watcher.cancel()
+            _cancel_batch(tasks, generations)
+            request_metrics.done(499)
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 @router.get("/health")
 async def health_check():
     """
@@ -80,6 +482,13 @@ async def get_model_status():
             "model_loaded": chatService.is_model_loaded(),
             "model_path": chatService.model_path,
             "device": chatService.device if hasattr(chatService, 'device') else "unknown",
+            "replicas": chatService.pool.size if chatService.pool else 0,
+            "idle_replicas": chatService.pool.idle if chatService.pool else 0,
+            "model_version": chatService.model_version,
+            "runtime_profile": chatService.runtime_profile.get("name"),
+            "last_swap": chatService.last_swap,
+            "active_generations": admissionController.active,
+            "queue_depth": admissionController.queue_depth,
         }
     except Exception as e:
         logger.error(f"Error getting model status: {e}")
@@ -89,69 +498,240 @@ async def get_model_status():
         }
 
 @router.post("/chat/stream")
-async def stream_chat_response(request: StreamChatRequestDTO):
+async def stream_chat_response(request: StreamChatRequestDTO, http_request: Request):
     """
     Stream AI response for chat interface
     """
+    handler_entered()
+    request_metrics = RequestMetrics("chat_stream")
     try:
-        # Validate model is loaded
+        max_tokens = request.max_tokens or 256
+        session_id = request.session_id
+        cacheable = _cacheable(session_id)
+        cached, cache_key, question_vector = None, None, None
+        if cacheable:
+            cached, cache_key, question_vector = await _cached_answer(request.message, max_tokens, "chat_stream")
+
+        # Cache hit - replay câu trả lời dưới dạng chunks, cùng format với stream thật
+        if cached is not None:
+            if session_id is not None:
+                chatService.sessions.append_turn(session_id, request.message, cached)
+
+            def replay_stream():
+                try:
+                    for content_chunk in replay_chunks(cached, chunk_chars=64):
+                        yield encode_event(content_chunk, "chunk")
+                    yield encode_json_event(_usage_payload(None, cached=True), "usage")
+                    yield DONE_FRAME
+                finally:
+                    request_metrics.done(status.HTTP_200_OK)
+
+            return _stream_response(replay_stream())
+
+        # Model load + warmup chạy nền lúc startup; trong lúc đó /ready là 503, request cũng vậy
         if not chatService.is_model_loaded():
-            logger.warning("Model not loaded, attempting to load...")
-            try:
-                await chatService.load_model()
-            except Exception as e:
-                logger.error(f"Failed to load model: {e}")
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail="AI model is not available. Please try again later."
-                )
+            raise _model_unavailable()
+
+        # Prompt quá dài bị từ chối trước khi chiếm slot hay tốn prefill
+        plan = await _plan(request.message, max_tokens, session_id)
+
+        # Đăng ký trước khi xếp hàng: id sai / trùng bị từ chối trước khi chiếm slot hay flight
+        generation = _start_generation(max_tokens, http_request)
+
+        # Câu hỏi giống hệt đang được sinh: nghe chung stream, không cần slot riêng
+        flight, leader = None, False
+        if _coalescing(cacheable):
+            flight, leader = _join_flight(request.message, max_tokens, plan, session_id,
+                                          cache_key, question_vector, "chat_stream")
+
+        # Admission control - reject nhanh thay vì để request dồn lên model
+        try:
+            if flight is not None:
+                await flight.wait_started()
+            else:
+                await admissionController.acquire()
+        except AdmissionRejected as e:
+            if flight is not None:
+                singleFlight.leave(flight)
+            generationRegistry.finish(generation, 0)
+            raise _admission_error(e)
+        except (asyncio.CancelledError, Exception):
+            if flight is not None:
+                singleFlight.leave(flight)
+            generationRegistry.finish(generation, 0)
+            raise
+        slot_start = time.perf_counter()
 
         # Create streaming generator
-        def generate_stream():
+        async def generate_stream():
+            chunks = []
+            tracker = GenerationTracker() if flight is None else flight.tracker
+            watcher = asyncio.create_task(_watch_disconnect(http_request, generation))
+            # Không đặt làm span hiện tại: generator có thể bị đóng từ context khác khi disconnect
+            stream_span = start_span("sse.stream", deduplicated=flight is not None and not leader)
+            encode_time, frames = 0.0, 0
             try:
-                # Build context như notebook - chỉ dùng current message
+                # Frame đầu tiên mang id để client huỷ qua DELETE /generations/{id}
+                yield encode_json_event({"id": generation.id, "session_id": session_id}, "start")
+
+                # Lịch sử hội thoại lấy từ session store phía server
                 user_message = request.message
 
-                # Use real streaming từ ChatService (như notebook)
-                for content_chunk in chatService.streaming_response(
-                    user_input=user_message,
-                    max_tokens=request.max_tokens or 256,
-                ):
-                    if content_chunk:  # Only send non-empty chunks
-                        data = {
-                            "content": content_chunk,
-                            "type": "chunk"
-                        }
-                        yield f"data: {json.dumps(data)}\n\n"
-
-                # Send completion signal
-                yield f"data: [DONE]\n\n"
+                # Decode chạy trên inference executor, event loop vẫn phục vụ /health, /metrics
+                if flight is not None:
+                    pieces = flight.stream(generation.cancel_event)
+                else:
+                    pieces = chatService.astreaming_response(
+                        user_input=user_message,
+                        max_tokens=max_tokens,
+                        tracker=tracker,
+                        cancel_event=generation.cancel_event,
+                        session_id=session_id,
+                        plan=plan,
+                    )
+                async for text in coalesce(pieces, flush_policy):
+                    if text is HEARTBEAT:
+                        yield HEARTBEAT_FRAME
+                        continue
+                    chunks.append(text)
+                    encode_start = time.perf_counter()
+                    frame = encode_event(text, "chunk")
+                    encode_time += time.perf_counter() - encode_start
+                    frames += 1
+                    yield frame
+
+                # Frame cuối mang usage stats, sau đó completion signal
+                usage = _usage_payload(tracker)
+                if generation.cancelled:
+                    usage["cancelled"] = True
+                if flight is not None and not leader:
+                    usage["deduplicated"] = True
+                yield encode_json_event(usage, "usage")
+                yield DONE_FRAME
+                if not generation.cancelled:
+                    request_metrics.done(status.HTTP_200_OK)
+
+                # Flight tự cache câu trả lời khi generation chung kết thúc
+                if flight is None and cacheable and not generation.cancelled:
+                    await _remember_answer(user_message, max_tokens, cache_key, "".join(chunks), question_vector)
+                elif flight is not None and not leader:
+                    _finish_follower(flight, session_id, user_message)
 
             except Exception as e:
                 logger.error(f"Error in stream generation: {e}")
-                error_data = {
-                    "error": str(e),
-                    "type": "error"
-                }
-                yield f"data: {json.dumps(error_data)}\n\n"
-
-        return StreamingResponse(
-            generate_stream(),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Content-Type": "text/plain; charset=utf-8"
-            }
-        )
+                request_metrics.done(status.HTTP_500_INTERNAL_SERVER_ERROR)
+                yield encode_event(str(e), "error")
+            finally:
+                watcher.cancel()
+                generationRegistry.finish(generation, tracker.completion_tokens)
+                if flight is not None:
+                    singleFlight.leave(flight)
+                else:
+                    admissionController.release(time.perf_counter() - slot_start)
+                # Không tới được DONE frame: client ngắt kết nối hoặc generation bị huỷ
+                request_metrics.done(499)
+                if stream_span is not None:
+                    stream_span.set_attribute("sse.frames", frames)
+                    stream_span.set_attribute("sse.encode_ms", round(encode_time * 1000, 3))
+                    stream_span.set_attribute("cancelled", generation.cancelled)
+                    stream_span.end()
 
+        streaming_response = _stream_response(generate_stream())
+        streaming_response.headers["X-Generation-Id"] = generation.id
+        return streaming_response
+
+    except HTTPException as e:
+        request_metrics.done(e.status_code)
+        raise
     except Exception as e:
         logger.error(f"Error in stream chat: {e}")
+        request_metrics.done(status.HTTP_500_INTERNAL_SERVER_ERROR)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to process chat request"
         )
 
+@router.delete("/generations/{generation_id}")
+async def cancel_generation(generation_id: str):
+    """
+    Cancel an in-flight generation; decode stops within one token
+    """
+    if not generationRegistry.cancel(generation_id, reason="api"):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Generation not found or already finished"
+        )
+    return {"id": generation_id, "cancelled": True}
+
+@router.get("/sessions/{session_id}", response_model=SessionResponseDTO)
+async def get_session(session_id: str):
+    """
+    Conversation history stored for a session
+    """
+    history = chatService.sessions.history(session_id, create=False)
+    if history is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found or expired"
+        )
+    return SessionResponseDTO(session_id=session_id, history=history)
+
+@router.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """
+    Drop a session's history and KV snapshot
+    """
+    if not chatService.sessions.delete(session_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found or expired"
+        )
+    return {"session_id": session_id, "deleted": True}
+
+@router.post("/admin/model/swap")
+async def swap_model(request: ModelSwapRequestDTO, x_admin_token: Optional[str] = Header(default=None)):
+    """
+    Hot-swap the serving model to a registry version (or a local GGUF) with canary + rollback
+    """
+    _require_admin(x_admin_token)
+    try:
+        if request.model_path and os.path.abspath(request.model_path) == os.path.abspath(chatService.model_path):
+            result = {"status": "unchanged", "version": chatService.model_version, "model_path": chatService.model_path}
+        elif request.model_path:
+            result = await chatService.swap_model(request.model_path, request.version)
+        else:
+            result = await modelRegistry.swap(chatService, request.version)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    if result["status"] in ("failed", "rolled_back"):
+        return JSONResponse(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, content=result)
+    return result
+
+@router.post("/admin/profile")
+async def capture_profile(
+    seconds: float = Query(10, gt=0, le=samplingProfiler.max_seconds),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    mode: str = Query("cpu", pattern=f"^({'|'.join(MODES)})$"),
+    lines: bool = Query(False),
+    x_admin_token: Optional[str] = Header(default=None),
+):
+    """
+    Sample every thread of the running server for `seconds` and return collapsed stacks
+    (flamegraph.pl / inferno / speedscope). Profiling stays on only for the capture.
+    `lines=true` keys frames by call site (module:function:line) instead of function.
+    """
+    _require_admin(x_admin_token)
+    loop = asyncio.get_running_loop()
+    try:
+        stacks, stats = await loop.run_in_executor(
+            None, functools.partial(samplingProfiler.profile, seconds, interval_ms / 1000, mode, lines)
+        )
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return Response(collapsed(stacks), media_type="text/plain", headers={"X-Profile-Stats": json.dumps(stats)})
+
 # Export router
 Router = router
 
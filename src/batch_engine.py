@@ -0,0 +1,345 @@
+import llama_cpp
+from llama_cpp import Llama
+from loguru import logger
+from collections import deque
+from typing import Callable, Deque, Dict, Iterator, List, Optional
+import codecs
+import itertools
+import queue
+import threading
+import time
+
+import numpy as np
+
+from .model_pool import PoolClosed
+from .chat_template import render_prompt, tokenize_prompt
+
+# Đánh dấu sequence đã kết thúc trong output queue
+_SEQ_END = object()
+
+
+def _seq_rm(ctx, seq_id: int):
+    """Drop a sequence's KV cells, across llama.cpp API renames"""
+    if hasattr(llama_cpp, "llama_memory_seq_rm") and hasattr(llama_cpp, "llama_get_memory"):
+        llama_cpp.llama_memory_seq_rm(llama_cpp.llama_get_memory(ctx), seq_id, -1, -1)
+    elif hasattr(llama_cpp, "llama_kv_self_seq_rm"):
+        llama_cpp.llama_kv_self_seq_rm(ctx, seq_id, -1, -1)
+    else:
+        llama_cpp.llama_kv_cache_seq_rm(ctx, seq_id, -1, -1)
+
+
+def _new_context(model: Llama, params):
+    if hasattr(llama_cpp, "llama_init_from_model"):
+        return llama_cpp.llama_init_from_model(model.model, params)
+    return llama_cpp.llama_new_context_with_model(model.model, params)
+
+
+def _eog_check(model: Llama) -> Callable[[int], bool]:
+    """End-of-generation test (EOS, EOT, <|im_end|>, ...), across llama.cpp API renames"""
+    if hasattr(llama_cpp, "llama_vocab_is_eog") and hasattr(llama_cpp, "llama_model_get_vocab"):
+        vocab = llama_cpp.llama_model_get_vocab(model.model)
+        return lambda token: bool(llama_cpp.llama_vocab_is_eog(vocab, token))
+    if hasattr(llama_cpp, "llama_token_is_eog"):
+        return lambda token: bool(llama_cpp.llama_token_is_eog(model.model, token))
+    eos_token = model.token_eos()
+    return lambda token: token == eos_token
+
+
+def sample_token(logits: np.ndarray, temperature: float, top_p: float, top_k: int, rng: np.random.Generator) -> int:
+    """Temperature / top-k / top-p sampling over one row of logits"""
+    if temperature <= 0:
+        return int(np.argmax(logits))
+
+    logits = logits.astype(np.float64) / temperature
+    if 0 < top_k < logits.shape[0]:
+        candidates = np.argpartition(logits, -top_k)[-top_k:]
+    else:
+        candidates = np.arange(logits.shape[0])
+
+    cand_logits = logits[candidates]
+    order = np.argsort(cand_logits)[::-1]
+    candidates, cand_logits = candidates[order], cand_logits[order]
+
+    probs = np.exp(cand_logits - cand_logits[0])
+    probs /= probs.sum()
+    if top_p < 1.0:
+        keep = int(np.searchsorted(np.cumsum(probs), top_p)) + 1
+        candidates, probs = candidates[:keep], probs[:keep]
+        probs /= probs.sum()
+
+    return int(rng.choice(candidates, p=probs))
+
+
+class _Sequence:
+    def __init__(self, request_id: int, prompt_tokens: List[int], max_tokens: int,
+                 temperature: float, top_p: float, top_k: int):
+        self.request_id = request_id
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+
+        self.seq_id: Optional[int] = None
+        self.n_prefilled = 0
+        self.n_past = 0
+        self.n_generated = 0
+        self.last_token: Optional[int] = None
+        self.cancelled = False
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.output: "queue.Queue" = queue.Queue()
+
+    @property
+    def prefilling(self) -> bool:
+        return self.n_prefilled < len(self.prompt_tokens)
+
+
+class BatchEngine:
+    """
+    Continuous batching over one llama.cpp context with multiple sequences.
+
+    A scheduler thread packs every active sequence into a single `llama_decode` call
+    per step: one decode token per generating sequence, plus prefill chunks of newly
+    admitted prompts up to `n_batch` tokens. Finished or cancelled sequences free their
+    KV cells and slot immediately, so waiting requests join the running batch without
+    waiting for the others to finish.
+    """
+
+    def __init__(
+        self,
+        model: Llama,
+        max_batch_size: int = 4,
+        max_wait_ms: float = 5.0,
+        n_ctx_per_seq: int = 4096,
+        n_batch: int = 512,
+        n_threads: int = 8,
+        seed: Optional[int] = None,
+    ):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.n_ctx_per_seq = n_ctx_per_seq
+        self.n_batch = n_batch
+        self.n_vocab = model.n_vocab()
+        # Model có thể có nhiều token kết thúc (EOS + EOT / <|im_end|>), không chỉ token_eos
+        self.is_eog = _eog_check(model)
+        self.rng = np.random.default_rng(seed)
+
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = n_ctx_per_seq * max_batch_size
+        params.n_batch = n_batch
+        params.n_ubatch = n_batch
+        params.n_seq_max = max_batch_size
+        params.n_threads = n_threads
+        params.n_threads_batch = n_threads
+        self.ctx = _new_context(model, params)
+        if not self.ctx:
+            raise RuntimeError("Failed to create batched llama.cpp context")
+        self.batch = llama_cpp.llama_batch_init(n_batch, 0, max_batch_size)
+
+        self._ids = itertools.count()
+        self._pending: Deque[_Sequence] = deque()
+        self._active: Dict[int, _Sequence] = {}
+        self._free_slots: List[int] = list(range(max_batch_size))
+        self._cond = threading.Condition()
+        self._running = True
+        # Decode thread đã thoát / phải tự free context khi thoát (close() hết timeout)
+        self._exited = False
+        self._free_on_exit = False
+        self._thread = threading.Thread(target=self._run, name="batch-engine", daemon=True)
+        self._thread.start()
+
+    # ---- public API ----
+
+    def submit(self, messages: List[dict], max_tokens: int = 256, temperature: float = 0.7,
+               top_p: float = 0.9, top_k: int = 40) -> _Sequence:
+        rendered = render_prompt(self.model, messages)
+        if rendered is None:
+            raise RuntimeError("Batching requires a GGUF with a chat template")
+        prompt_tokens = tokenize_prompt(self.model, *rendered)
+        if len(prompt_tokens) + max_tokens > self.n_ctx_per_seq:
+            max_tokens = max(1, self.n_ctx_per_seq - len(prompt_tokens))
+
+        seq = _Sequence(next(self._ids), prompt_tokens, max_tokens, temperature, top_p, top_k)
+        with self._cond:
+            if not self._running:
+                raise PoolClosed("Batch engine has been closed")
+            self._pending.append(seq)
+            self._cond.notify()
+        return seq
+
+    def generate(self, messages: List[dict], **generation_options) -> Iterator[str]:
+        """Blocking iterator over text pieces for one request"""
+        return self.stream(self.submit(messages, **generation_options))
+
+    def stream(self, seq: _Sequence) -> Iterator[str]:
+        """Blocking iterator over text pieces of a submitted sequence"""
+        try:
+            while True:
+                item = seq.output.get()
+                if item is _SEQ_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Consumer dừng sớm (disconnect / cancel) - giải phóng slot ở step tiếp theo
+            seq.cancelled = True
+
+    def complete(self, messages: List[dict], **generation_options) -> dict:
+        """Blocking full completion, with token counts"""
+        seq = self.submit(messages, **generation_options)
+        pieces = []
+        while True:
+            item = seq.output.get()
+            if item is _SEQ_END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            pieces.append(item)
+        return {
+            "text": "".join(pieces),
+            "prompt_tokens": len(seq.prompt_tokens),
+            "completion_tokens": seq.n_generated,
+        }
+
+    @property
+    def active(self) -> int:
+        return len(self._active)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout=5)
+        with self._cond:
+            if not self._exited:
+                # Decode thread còn trong llama_decode: free lúc này là use-after-free
+                logger.error("Batch engine decode thread still running after 5s; it frees the context when it exits")
+                self._free_on_exit = True
+                return
+        self._free()
+
+    def _free(self):
+        llama_cpp.llama_batch_free(self.batch)
+        llama_cpp.llama_free(self.ctx)
+
+    # ---- scheduler ----
+
+    def _admit(self):
+        while self._pending and self._free_slots:
+            seq = self._pending.popleft()
+            if seq.cancelled:
+                seq.output.put(_SEQ_END)
+                continue
+            seq.seq_id = self._free_slots.pop()
+            self._active[seq.seq_id] = seq
+
+    def _finish(self, seq: _Sequence, error: Optional[Exception] = None):
+        if error is None:
+            tail = seq.decoder.decode(b"", final=True)
+            if tail:
+                seq.output.put(tail)
+        else:
+            seq.output.put(error)
+        seq.output.put(_SEQ_END)
+        _seq_rm(self.ctx, seq.seq_id)
+        del self._active[seq.seq_id]
+        self._free_slots.append(seq.seq_id)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending and not self._active:
+                    self._cond.wait()
+                if not self._running:
+                    break
+                if not self._active and self._pending:
+                    # Batch window: gom thêm request tới trong vài ms
+                    deadline = time.monotonic() + self.max_wait
+                    while len(self._pending) < self.max_batch_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                self._admit()
+
+            try:
+                self._step()
+            except Exception as e:
+                logger.error(f"Batch engine step failed: {e}")
+                for seq in list(self._active.values()):
+                    self._finish(seq, e)
+
+        for seq in list(self._active.values()) + list(self._pending):
+            seq.output.put(_SEQ_END)
+        with self._cond:
+            self._exited = True
+            free = self._free_on_exit
+        if free:
+            self._free()
+
+    def _step(self):
+        for seq in [s for s in self._active.values() if s.cancelled]:
+            self._finish(seq)
+        if not self._active:
+            return
+
+        batch = self.batch
+        n = 0
+        logit_rows: Dict[int, _Sequence] = {}
+
+        def add(token: int, pos: int, seq: _Sequence, want_logits: bool):
+            nonlocal n
+            batch.token[n] = token
+            batch.pos[n] = pos
+            batch.n_seq_id[n] = 1
+            batch.seq_id[n][0] = seq.seq_id
+            batch.logits[n] = 1 if want_logits else 0
+            if want_logits:
+                logit_rows[n] = seq
+            n += 1
+
+        # Decode: mỗi sequence đang generate góp 1 token
+        for seq in self._active.values():
+            if not seq.prefilling:
+                add(seq.last_token, seq.n_past, seq, True)
+                seq.n_past += 1
+
+        # Prefill: lấp phần còn lại của batch bằng prompt của sequence mới
+        for seq in self._active.values():
+            if n >= self.n_batch:
+                break
+            if seq.prefilling:
+                chunk = seq.prompt_tokens[seq.n_prefilled:seq.n_prefilled + (self.n_batch - n)]
+                for i, token in enumerate(chunk):
+                    is_last = seq.n_prefilled + i == len(seq.prompt_tokens) - 1
+                    add(token, seq.n_past, seq, is_last)
+                    seq.n_past += 1
+                seq.n_prefilled += len(chunk)
+
+        batch.n_tokens = n
+        ret = llama_cpp.llama_decode(self.ctx, batch)
+        if ret != 0:
+            raise RuntimeError(f"llama_decode failed with code {ret}")
+
+        for row, seq in logit_rows.items():
+            ptr = llama_cpp.llama_get_logits_ith(self.ctx, row)
+            logits = np.ctypeslib.as_array(ptr, shape=(self.n_vocab,))
+            token = sample_token(logits, seq.temperature, seq.top_p, seq.top_k, self.rng)
+
+            if self.is_eog(token):
+                self._finish(seq)
+                continue
+
+            seq.last_token = token
+            seq.n_generated += 1
+            text = seq.decoder.decode(self.model.detokenize([token]))
+            if text:
+                seq.output.put(text)
+            if seq.n_generated >= seq.max_tokens or seq.n_past >= self.n_ctx_per_seq:
+                self._finish(seq)
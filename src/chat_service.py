@@ -1,95 +1,593 @@
-from llama_cpp import Llama
 from loguru import logger
-from typing import Optional
+from typing import TYPE_CHECKING, Callable, Optional, AsyncIterator, Iterator, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import asyncio
+import functools
+import threading
+import time
 import os
 
+from .model_pool import ModelPool, PoolClosed
+from .prefix_cache import PrefixStateCache
+from .session_store import sessionStore, state_tokens
+from .context_window import contextWindow, ContextPlan
+from .chat_template import render_prompt, tokenize_prompt
+from .metrics import MODEL_INFO, MODEL_SWAPS, MODEL_SWAP_WARMUP_SECONDS, SESSION_REUSED_TOKENS
+from .response_cache import make_key
+from .instrumentation import GenerationTracker
+from .startup import startupReport, prefault, warmup
+from .runtime_config import as_bool, env, kv_cache_type, load_runtime_profile, setting
+from .tracing import bind, span
+
+if TYPE_CHECKING:
+    from .batch_engine import BatchEngine
+
+MODEL_NOT_LOADED_MESSAGE = "Model not loaded yet."
+GENERATION_ERROR_PREFIX = "Lỗi khi tạo phản hồi"
+
+# Sentinel đánh dấu producer thread đã stream xong
+_STREAM_END = object()
+
+
+class GenerationError(RuntimeError):
+    """Generation failed part-way; the partial answer must not be returned or cached"""
+
+
 class ChatService:
     def __init__(self):
         self.model_loaded = False
-        self.model = None
-        self.model_path = "./gguf_model.gguf"
+        self.pool: Optional[ModelPool] = None
+        self.model_path = os.getenv("MODEL_PATH", "./gguf_model.gguf")
+        # Version trong MLflow registry của model đang phục vụ (None: model build sẵn trong image)
+        self.model_version: Optional[str] = os.getenv("MODEL_VERSION") or None
         self.system_prompt = "Bạn là một trợ lý luật pháp Việt Nam thông minh, luôn trả lời bằng tiếng Việt chuẩn và dễ hiểu."
 
-    async def load_model(self):
+        # Sampling params dùng chung cho generate và stream
+        self.temperature = 0.7
+        self.top_p = 0.9
+        self.top_k = 40
+
+        # llama.cpp settings đo bằng scripts/tune_llama.py cho loại node này; env var vẫn ưu tiên
+        self.runtime_profile = load_runtime_profile()
+        if not os.getenv("MODEL_PATH") and self.runtime_profile.get("model_path"):
+            self.model_path = self.runtime_profile["model_path"]
+
+        # Replica pool config: trade per-request latency (threads) vs throughput (replicas)
+        self.n_ctx = env("MODEL_N_CTX", 4096)
+        self.replicas = env("MODEL_REPLICAS", 1)
+        self.n_threads = setting(self.runtime_profile, "n_threads", "MODEL_THREADS", 8)
+        self.threads_per_replica = env("MODEL_THREADS_PER_REPLICA", 0) or None
+        self.n_threads_batch = setting(self.runtime_profile, "n_threads_batch", "MODEL_THREADS_BATCH", None)
+        # Prefill batch size, flash attention, KV cache type: None giữ default của llama.cpp
+        self.llama_kwargs = {
+            key: value for key, value in {
+                "n_batch": setting(self.runtime_profile, "n_batch", "MODEL_N_BATCH", None),
+                "n_ubatch": setting(self.runtime_profile, "n_ubatch", "MODEL_N_UBATCH", None),
+                "flash_attn": setting(self.runtime_profile, "flash_attn", "MODEL_FLASH_ATTN", None, as_bool),
+                "type_k": setting(self.runtime_profile, "type_k", "MODEL_KV_TYPE_K", None, kv_cache_type),
+                "type_v": setting(self.runtime_profile, "type_v", "MODEL_KV_TYPE_V", None, kv_cache_type),
+            }.items() if value is not None
+        }
+        # Override Llama constructor (benchmarks dùng FakeLlama để chạy offline)
+        self.model_factory = None
+
+        # Startup: đọc trước file GGUF vào page cache, khoá weights trong RAM, warmup
+        self.prefault = os.getenv("MODEL_PREFAULT", "0") == "1"
+        self.mlock = setting(self.runtime_profile, "use_mlock", "MODEL_MLOCK", False, as_bool)
+        self.warmup_tokens = env("STARTUP_WARMUP_TOKENS", 8)
+
+        # Hot swap: canary trên model mới trước khi chuyển, rollback nếu vượt budget
+        self.swap_canary_requests = env("SWAP_CANARY_REQUESTS", 3)
+        self.swap_max_warmup_seconds = env("SWAP_MAX_WARMUP_SECONDS", 30.0, float)
+        self.swap_error_budget = env("SWAP_ERROR_BUDGET", 0.0, float)
+        self.swap_drain_timeout = env("SWAP_DRAIN_TIMEOUT", 120.0, float)
+        self.swap_listeners: List[Callable[[], None]] = []
+        self._swap_lock = asyncio.Lock()
+        # Startup load chạy nền; caller khác (admin, test) chờ cùng lần load thay vì load pool thứ hai
+        self._load_lock = asyncio.Lock()
+        self.last_swap: Optional[dict] = None
+
+        # Speculative decoding: off | prompt_lookup | draft (GGUF nhỏ cùng tokenizer)
+        self.speculative_mode = os.getenv("SPECULATIVE_MODE", "off")
+        self.speculative_draft_tokens = env("SPECULATIVE_DRAFT_TOKENS", 10)
+        self.speculative_ngram = env("SPECULATIVE_NGRAM", 2)
+        self.speculative_draft_model = os.getenv("SPECULATIVE_DRAFT_MODEL", "")
+        self.speculative_draft_threads = env("SPECULATIVE_DRAFT_THREADS", 2)
+
+        # KV state của system prompt, evaluate một lần lúc load_model
+        self.prefix_cache_enabled = os.getenv("PREFIX_CACHE", "1") == "1"
+        self.prefix_cache = PrefixStateCache(self.system_prompt)
+
+        # Lịch sử hội thoại + KV snapshot theo session_id
+        self.sessions = sessionStore
+
+        # Đếm token / cắt lịch sử / clamp max_tokens trước khi chiếm model slot
+        self.context_window = contextWindow
+
+        # Continuous batching: nhiều request chung một llama_decode mỗi step
+        self.batching_enabled = os.getenv("BATCHING_ENABLED", "0") == "1"
+        self.batch_max_size = env("BATCH_MAX_SIZE", 4)
+        self.batch_max_wait_ms = env("BATCH_MAX_WAIT_MS", 5.0, float)
+        self.batch_engine: Optional["BatchEngine"] = None
+
+        # Dedicated executor so llama.cpp never runs on the asyncio event loop
+        default_workers = self.batch_max_size if self.batching_enabled else self.replicas
+        self.inference_workers = env("INFERENCE_WORKERS", default_workers)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.inference_workers,
+            thread_name_prefix="inference",
+        )
+        # Load/canary của model mới chạy riêng, không chiếm worker đang phục vụ request
+        self.swap_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-swap")
+
+    async def _build_pool(self, model_path: str, executor: ThreadPoolExecutor, startup: bool = False) -> Tuple[ModelPool, Optional["BatchEngine"]]:
+        """Load, warm up and prefix-cache K replicas of `model_path` (not yet serving)"""
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model not found at: {model_path}")
+        # Chỉ lần load lúc khởi động mới ghi vào startup report
+        phase = startupReport.phase if startup else (lambda name: nullcontext())
+
+        loop = asyncio.get_running_loop()
+        if self.prefault:
+            with phase("prefault"):
+                n_bytes = await loop.run_in_executor(executor, prefault, model_path)
+            logger.info(f"Prefaulted {n_bytes / 1024 / 1024:.0f} MB of model weights into page cache")
+
+        # llama_cpp import nặng: chỉ khi load model, không làm chậm lúc import app (/health lên sớm)
+        from .batch_engine import BatchEngine
+        from .speculative import draft_factory
+
+        drafts = draft_factory(
+            self.speculative_mode,
+            num_pred_tokens=self.speculative_draft_tokens,
+            max_ngram_size=self.speculative_ngram,
+            draft_model_path=self.speculative_draft_model,
+            n_ctx=self.n_ctx,
+            n_threads=self.speculative_draft_threads,
+        )
+
+        # Load K replicas cùng một file GGUF (mmap, weights dùng chung)
+        pool = ModelPool(
+            model_path=model_path,
+            replicas=self.replicas,
+            n_threads=self.n_threads,
+            threads_per_replica=self.threads_per_replica,
+            n_threads_batch=self.n_threads_batch,
+            n_ctx=self.n_ctx,
+            draft_factory=drafts,
+            use_mlock=self.mlock,
+            **self.llama_kwargs,
+            **({"model_factory": self.model_factory} if self.model_factory else {}),
+        )
         try:
-            # Check if model exists
-            if not os.path.exists(self.model_path):
-                raise FileNotFoundError(f"Model not found at: {self.model_path}")
+            with phase("load"):
+                await loop.run_in_executor(executor, pool.load)
 
-            logger.info(f"Loading model from: {self.model_path}")
+            if self.warmup_tokens > 0:
+                # Request đầu tiên không phải trả page fault + khởi tạo compute buffer
+                with phase("warmup"):
+                    for model in pool.models:
+                        await loop.run_in_executor(
+                            executor, warmup, model, self.system_prompt, self.warmup_tokens
+                        )
+
+            if self.prefix_cache_enabled:
+                with phase("prefix_cache"):
+                    for model in pool.models:
+                        n_prefix = await loop.run_in_executor(executor, self.prefix_cache.warm, model)
+                logger.info(f"System prompt prefix pre-evaluated ({n_prefix} tokens per replica)")
 
-            # Load model với config tương tự notebook
-            self.model = Llama(
-                model_path=self.model_path,
-                n_ctx=4096,
-                n_threads=8,
-                verbose=False  # Tắt verbose như notebook
-            )
+            batch_engine = None
+            if self.batching_enabled:
+                batch_engine = BatchEngine(
+                    pool.models[0],
+                    max_batch_size=self.batch_max_size,
+                    max_wait_ms=self.batch_max_wait_ms,
+                    n_ctx_per_seq=self.n_ctx,
+                    n_threads=self.n_threads,
+                )
+                logger.info(f"Continuous batching enabled (max_batch_size={self.batch_max_size})")
+        except BaseException:
+            self._close_pool(pool)
+            raise
+        return pool, batch_engine
+
+    async def load_model(self):
+        async with self._load_lock:
+            if self.is_model_loaded():
+                return "Already loaded"
+            return await self._load_model()
+
+    async def _load_model(self):
+        try:
+            logger.info(f"Loading model from: {self.model_path}")
+            self.pool, self.batch_engine = await self._build_pool(self.model_path, self.executor, startup=True)
             self.model_loaded = True
-            logger.info("LLaMA model loaded successfully")
+            MODEL_INFO.labels(version=self.model_version or "build", path=self.model_path).set(1)
+            logger.info(f"LLaMA model loaded successfully ({self.pool.size} replicas)")
             return "Loaded successfully"
         except Exception as e:
             logger.error(f"Error loading model: {e}")
             raise
 
+    def _close_pool(self, pool: ModelPool, batch_engine: Optional["BatchEngine"] = None):
+        if batch_engine is not None:
+            batch_engine.close()
+        for model in pool.models:
+            self.prefix_cache.forget(model)
+        pool.close()
+
+    def _canary(self, pool: ModelPool) -> Tuple[int, float]:
+        """Short generations on the candidate pool. Returns (failures, slowest seconds)."""
+        failures, slowest = 0, 0.0
+        question = "Người lao động có quyền đơn phương chấm dứt hợp đồng lao động không?"
+        for i in range(self.swap_canary_requests):
+            start = time.perf_counter()
+            try:
+                with pool.acquire() as model:
+                    self.prefix_cache.prepare(model)
+                    warmup(model, self.system_prompt, max(1, self.warmup_tokens), question)
+            except Exception as e:
+                logger.warning(f"Canary generation {i + 1}/{self.swap_canary_requests} failed: {e}")
+                failures += 1
+            slowest = max(slowest, time.perf_counter() - start)
+        return failures, slowest
+
+    async def _retire(self, pool: ModelPool, batch_engine: Optional["BatchEngine"]):
+        """Let in-flight requests finish on the old model, then free it"""
+        pool.retire()
+        loop = asyncio.get_running_loop()
+        # Default executor: inference executor có thể đang bận với chính các request cần drain
+        while batch_engine is not None and (batch_engine.active or batch_engine.pending):
+            await asyncio.sleep(0.05)
+        while not await loop.run_in_executor(None, pool.drain, self.swap_drain_timeout):
+            logger.warning(f"Old model still has in-flight requests after {self.swap_drain_timeout:.0f}s, waiting")
+        self._close_pool(pool, batch_engine)
+        logger.info(f"Old model {pool.model_path} drained and unloaded")
+
+    async def swap_model(self, model_path: str, version: Optional[str] = None) -> dict:
+        """
+        Load `model_path` next to the serving model, warm it up and run canary requests,
+        then switch atomically. New requests go to the new model while in-flight ones
+        drain on the old one. If the canary exceeds SWAP_MAX_WARMUP_SECONDS or
+        SWAP_ERROR_BUDGET the candidate is dropped and the current model keeps serving.
+        """
+        if self._swap_lock.locked():
+            raise RuntimeError("A model swap is already in progress")
+        async with self._swap_lock:
+            started = time.perf_counter()
+            result = {"version": version, "model_path": model_path,
+                      "previous_version": self.model_version, "previous_model_path": self.model_path}
+            logger.info(f"Model swap: loading candidate {model_path} (version={version})")
+            try:
+                pool, batch_engine = await self._build_pool(model_path, self.swap_executor)
+            except Exception as e:
+                logger.error(f"Model swap: candidate failed to load: {e}")
+                MODEL_SWAPS.labels(result="failed").inc()
+                self.last_swap = {**result, "status": "failed", "reason": str(e)}
+                return self.last_swap
+
+            loop = asyncio.get_running_loop()
+            failures, slowest = await loop.run_in_executor(self.swap_executor, self._canary, pool)
+            MODEL_SWAP_WARMUP_SECONDS.observe(slowest)
+            error_rate = failures / self.swap_canary_requests if self.swap_canary_requests else 0.0
+            reason = None
+            if error_rate > self.swap_error_budget:
+                reason = f"canary error rate {error_rate:.0%} exceeds budget {self.swap_error_budget:.0%}"
+            elif slowest > self.swap_max_warmup_seconds:
+                reason = f"canary latency {slowest:.2f}s exceeds {self.swap_max_warmup_seconds:.0f}s"
+            if reason is not None:
+                logger.error(f"Model swap rolled back: {reason}")
+                self._close_pool(pool, batch_engine)
+                MODEL_SWAPS.labels(result="rolled_back").inc()
+                self.last_swap = {**result, "status": "rolled_back", "reason": reason}
+                return self.last_swap
+
+            old_pool, old_engine = self.pool, self.batch_engine
+            old_labels = (self.model_version or "build", self.model_path)
+            # Chuyển atomically: request mới đọc self.pool / self.batch_engine sau dòng này
+            self.pool, self.batch_engine = pool, batch_engine
+            self.model_path, self.model_version = model_path, version
+            self.model_loaded = True
+
+            # KV snapshot / token count / câu trả lời cache đều gắn với model cũ
+            self.sessions.drop_states()
+            self.context_window.clear()
+            for listener in self.swap_listeners:
+                try:
+                    listener()
+                except Exception as e:
+                    logger.warning(f"Model swap listener failed: {e}")
+
+            MODEL_INFO.labels(version=old_labels[0], path=old_labels[1]).set(0)
+            MODEL_INFO.labels(version=version or "build", path=model_path).set(1)
+            MODEL_SWAPS.labels(result="swapped").inc()
+            self.last_swap = {
+                **result,
+                "status": "swapped",
+                "canary_seconds": round(slowest, 3),
+                "seconds": round(time.perf_counter() - started, 3),
+            }
+            logger.info(f"Model swap: now serving {model_path} (version={version})")
+
+        if old_pool is not None:
+            asyncio.create_task(self._retire(old_pool, old_engine))
+        return self.last_swap
+
     def is_model_loaded(self) -> bool:
-        return self.model_loaded and self.model is not None
+        return self.model_loaded and self.pool is not None
 
-    def generate_response(self, user_input: str, max_tokens: int = 256, temperature: float = 0.7):
-        """Batch prediction like in notebook"""
-        if not self.model_loaded:
-            return "Model not loaded yet."
+    def cache_key(self, user_input: str, max_tokens: int, temperature: Optional[float] = None) -> str:
+        """Response cache key: normalized message + every param that affects sampling + model version"""
+        return make_key(
+            user_input,
+            max_tokens=max_tokens,
+            temperature=self.temperature if temperature is None else temperature,
+            top_p=self.top_p,
+            top_k=self.top_k,
+            # Sau hot swap, câu trả lời của model cũ không còn khớp key nào (kể cả lookup đang chạy dở)
+            model=self.model_version or "build",
+        )
+
+    @staticmethod
+    def is_error_response(text: str) -> bool:
+        return text == MODEL_NOT_LOADED_MESSAGE
+
+    def plan_request(self, user_input: str, max_tokens: Optional[int], session_id: Optional[str] = None) -> ContextPlan:
+        """
+        Fit system prompt + session history + question into n_ctx and clamp max_tokens.
+        Raises ContextBudgetError for requests that can never fit.
+        """
+        history, start = None, 0
+        if session_id is not None:
+            history = self.sessions.history(session_id)
+            start = self.sessions.window_start(session_id)
 
-        # Format như trong notebook - chat template
-        messages = [
-            {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": user_input}
-        ]
+        # Tokenizer giống nhau giữa các replica, chỉ đọc vocab nên không cần acquire
+        for attempt in range(2):
+            pool = self.pool
+            try:
+                with pool.tokenizer() as model, span("context.plan", history=len(history or [])) as current:
+                    plan = self.context_window.fit(
+                        model, self.system_prompt, history, user_input, max_tokens, start
+                    )
+                    if current is not None:
+                        current.set_attribute("prompt_tokens", plan.prompt_tokens)
+                        current.set_attribute("max_tokens", plan.max_tokens)
+                break
+            except PoolClosed:
+                # Pool vừa bị thay bởi model swap - đếm lại bằng model mới
+                if attempt:
+                    raise
+        if session_id is not None and plan.dropped != start:
+            self.sessions.set_window_start(session_id, plan.dropped)
+        return plan
 
-        generation_options = {
+    async def aplan_request(self, user_input: str, max_tokens: Optional[int], session_id: Optional[str] = None) -> ContextPlan:
+        """plan_request off the event loop; default executor so it never waits behind decode"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, bind(functools.partial(self.plan_request, user_input, max_tokens, session_id))
+        )
+
+    def _generation_options(self, max_tokens: Optional[int], temperature: Optional[float]) -> dict:
+        return {
             "max_tokens": max_tokens,
-            "temperature": temperature,
-            "top_p": 0.9,
-            "top_k": 40,
+            "temperature": self.temperature if temperature is None else temperature,
+            "top_p": self.top_p,
+            "top_k": self.top_k,
             "stop": None,
         }
 
+    def _restore_session(self, model, session_id: str, messages: List[dict]) -> bool:
+        """Roll the replica to the session's last KV snapshot so only the new turn is prefilled"""
+        state = self.sessions.snapshot(session_id)
+        if state is None:
+            return False
+        tokens = state_tokens(state)
+        n = len(tokens)
+        # Replica vẫn còn giữ KV của session từ lượt trước thì không cần load_state
+        if not (model.n_tokens >= n and list(model._input_ids[:n]) == tokens):
+            model.load_state(state)
+
+        rendered = render_prompt(model, messages)
+        if rendered is not None:
+            prompt_tokens = tokenize_prompt(model, *rendered)
+            reused = 0
+            for a, b in zip(prompt_tokens, tokens):
+                if a != b:
+                    break
+                reused += 1
+            SESSION_REUSED_TOKENS.inc(reused)
+        return True
+
+    def _generate_pieces(
+        self,
+        messages: List[dict],
+        generation_options: dict,
+        tracker: GenerationTracker,
+        session_id: Optional[str] = None,
+    ) -> Iterator[str]:
+        """Raw text pieces from the batch engine or a pool replica. Raises on failure."""
+        if self.batch_engine is not None:
+            try:
+                engine = self.batch_engine
+                seq = engine.submit(messages, **self._batch_options(generation_options))
+            except PoolClosed:
+                engine = self.batch_engine
+                seq = engine.submit(messages, **self._batch_options(generation_options))
+            yield from engine.stream(seq)
+            tracker.prompt_tokens = len(seq.prompt_tokens)
+            tracker.completion_tokens = seq.n_generated
+            return
+
+        # Streaming như trong notebook, giữ replica cho đến hết stream
+        pool, model = self._checkout()
         try:
-            response = self.model.create_chat_completion(messages=messages, **generation_options)
-            return response['choices'][0]['message']['content']
-        except Exception as e:
-            logger.error(f"Error generating response: {e}")
-            return f"Lỗi khi tạo phản hồi: {str(e)}"
+            if session_id is None or not self._restore_session(model, session_id, messages):
+                self.prefix_cache.prepare(model)
+            for chunk in model.create_chat_completion(messages=messages, stream=True, **generation_options):
+                choice = chunk['choices'][0]['delta']
+                if 'content' in choice:
+                    yield choice['content']
+            if session_id is not None:
+                self.sessions.save_state(session_id, model.save_state())
+        finally:
+            pool.release(model)
+
+    def _checkout(self):
+        """Borrow a replica of the serving model; retried once if a swap retired the pool meanwhile"""
+        try:
+            pool = self.pool
+            return pool, pool.checkout()
+        except PoolClosed:
+            pool = self.pool
+            return pool, pool.checkout()
 
-    def streaming_response(self, user_input: str, max_tokens: Optional[int] = 256, temperature: Optional[float] = 0.7):
-        """Streaming response như trong notebook"""
+    def generate_response(
+        self,
+        user_input: str,
+        max_tokens: int = 256,
+        temperature: float = 0.7,
+        tracker: Optional[GenerationTracker] = None,
+        cancel_event: Optional[threading.Event] = None,
+        session_id: Optional[str] = None,
+        plan: Optional[ContextPlan] = None,
+    ):
+        """Batch prediction like in notebook"""
+        if not self.model_loaded:
+            return MODEL_NOT_LOADED_MESSAGE
+
+        # Dùng chung đường stream để có TTFT / tokens/sec cho cả /generate
+        return "".join(
+            self.streaming_response(user_input, max_tokens, temperature, tracker, cancel_event, session_id, plan)
+        )
+
+    def streaming_response(
+        self,
+        user_input: str,
+        max_tokens: Optional[int] = 256,
+        temperature: Optional[float] = 0.7,
+        tracker: Optional[GenerationTracker] = None,
+        cancel_event: Optional[threading.Event] = None,
+        session_id: Optional[str] = None,
+        plan: Optional[ContextPlan] = None,
+    ):
+        """
+        Streaming response như trong notebook. Raises ContextBudgetError if the prompt
+        does not fit, GenerationError if decoding fails after it started.
+        """
         if not self.is_model_loaded():
             logger.warn("Model is not loaded")
-            yield "Model not loaded yet."
+            yield MODEL_NOT_LOADED_MESSAGE
             return
 
-        # Format messages như trong notebook
-        messages = [
-            {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": user_input}
-        ]
+        if plan is None:
+            plan = self.plan_request(user_input, max_tokens, session_id)
+        messages = plan.messages
+        generation_options = self._generation_options(plan.max_tokens, temperature)
 
-        generation_options = {
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-            "top_p": 0.9,
-            "top_k": 40,
-            "stop": None,
-        }
+        # Bị huỷ khi còn đang xếp hàng - không tốn prefill
+        if cancel_event is not None and cancel_event.is_set():
+            return
 
+        tracker = tracker or GenerationTracker()
+        # Số token của prompt đã render, đếm chính xác lúc plan (batch engine ghi đè bằng số của nó)
+        tracker.prompt_tokens = plan.prompt_tokens
+        pieces = self._generate_pieces(messages, generation_options, tracker, session_id)
+        answer = []
         try:
-            # Streaming như trong notebook
-            for chunk in self.model.create_chat_completion(messages=messages, stream=True, **generation_options):
-                choice = chunk['choices'][0]['delta']
-                if 'content' in choice:
-                    yield choice['content']
+            for piece in pieces:
+                tracker.token()
+                answer.append(piece)
+                yield piece
+                # Cooperative cancel: dừng decode trong vòng một token
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+            else:
+                # Chỉ lưu lượt hội thoại đã sinh trọn vẹn
+                if session_id is not None:
+                    self.sessions.append_turn(session_id, user_input, "".join(answer))
         except Exception as e:
             logger.error(f"Error in streaming response: {e}")
-            yield f"Lỗi khi tạo phản hồi: {str(e)}"
+            raise GenerationError(f"{GENERATION_ERROR_PREFIX}: {e}") from e
+        finally:
+            # Đóng generator để trả replica / slot của batch engine ngay
+            pieces.close()
+            tracker.finish()
+
+    @staticmethod
+    def _batch_options(generation_options: dict) -> dict:
+        """create_chat_completion options -> BatchEngine.submit options"""
+        return {k: generation_options[k] for k in ("max_tokens", "temperature", "top_p", "top_k")}
+
+    async def agenerate_response(
+        self,
+        user_input: str,
+        max_tokens: int = 256,
+        temperature: float = 0.7,
+        tracker: Optional[GenerationTracker] = None,
+        cancel_event: Optional[threading.Event] = None,
+        session_id: Optional[str] = None,
+        plan: Optional[ContextPlan] = None,
+    ) -> str:
+        """Awaitable generate_response, runs on the inference executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            bind(functools.partial(
+                self.generate_response, user_input, max_tokens, temperature, tracker, cancel_event, session_id, plan
+            )),
+        )
+
+    async def astreaming_response(
+        self,
+        user_input: str,
+        max_tokens: Optional[int] = 256,
+        temperature: Optional[float] = 0.7,
+        tracker: Optional[GenerationTracker] = None,
+        cancel_event: Optional[threading.Event] = None,
+        session_id: Optional[str] = None,
+        plan: Optional[ContextPlan] = None,
+    ) -> AsyncIterator[str]:
+        """Async iterator over streaming_response, decode runs on the inference executor"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = cancel_event or threading.Event()
+
+        def produce():
+            try:
+                chunks = self.streaming_response(user_input, max_tokens, temperature, tracker, stop, session_id, plan)
+                for chunk in chunks:
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, _STREAM_END)
+
+        loop.run_in_executor(self.executor, bind(produce))
+
+        finished = False
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    finished = True
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Consumer dừng sớm (disconnect / huỷ) - báo producer thoát vòng decode
+            if not finished:
+                stop.set()
+
+    def shutdown(self):
+        """Stop accepting inference work and release worker threads"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.swap_executor.shutdown(wait=False, cancel_futures=True)
+        if self.pool is not None:
+            self._close_pool(self.pool, self.batch_engine)
 
 chatService = ChatService()
\ No newline at end of file
@@ -0,0 +1,70 @@
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from .tracing import span
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama, llama_chat_format
+
+# Cache formatter theo model để không compile lại jinja template mỗi request
+_formatters: Dict[int, Optional["llama_chat_format.Jinja2ChatFormatter"]] = {}
+
+
+def get_formatter(model: "Llama") -> Optional["llama_chat_format.Jinja2ChatFormatter"]:
+    """Jinja formatter built from the GGUF chat template, same as create_chat_completion uses"""
+    key = id(model)
+    if key not in _formatters:
+        template = (model.metadata or {}).get("tokenizer.chat_template")
+        if not template:
+            _formatters[key] = None
+        else:
+            from llama_cpp import llama_chat_format
+            eos_id, bos_id = model.token_eos(), model.token_bos()
+            eos_token = model._model.token_get_text(eos_id) if eos_id != -1 else ""
+            bos_token = model._model.token_get_text(bos_id) if bos_id != -1 else ""
+            _formatters[key] = llama_chat_format.Jinja2ChatFormatter(
+                template=template,
+                eos_token=eos_token,
+                bos_token=bos_token,
+            )
+    return _formatters[key]
+
+
+def render_prompt(model: "Llama", messages: List[dict]) -> Optional[Tuple[str, bool]]:
+    """
+    Render messages to the exact prompt text llama.cpp will see.
+
+    Returns (prompt, add_bos) or None if the model has no chat template.
+    """
+    formatter = get_formatter(model)
+    if formatter is None:
+        return None
+    with span("chat_template.render", messages=len(messages)):
+        result = formatter(messages=messages)
+    return result.prompt, not result.added_special
+
+
+def tokenize_prompt(model: "Llama", prompt: str, add_bos: bool) -> List[int]:
+    """Tokenize a rendered prompt the same way the chat completion handler does"""
+    with span("tokenize", chars=len(prompt)) as current:
+        tokens = model.tokenize(prompt.encode("utf-8"), add_bos=add_bos, special=True)
+        if current is not None:
+            current.set_attribute("tokens", len(tokens))
+    return tokens
+
+
+def system_prefix(model: "Llama", system_prompt: str) -> Optional[Tuple[str, bool]]:
+    """Prompt text shared by every request: everything before the user's content"""
+    marker = "\x00USER\x00"
+    rendered = render_prompt(model, [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": marker},
+    ])
+    if rendered is None:
+        return None
+    prompt, add_bos = rendered
+    return prompt[:prompt.index(marker)], add_bos
+
+
+def forget(model: "Llama"):
+    """Drop the cached formatter when a replica is closed"""
+    _formatters.pop(id(model), None)
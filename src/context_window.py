@@ -0,0 +1,206 @@
+from collections import OrderedDict
+from loguru import logger
+from typing import List, Optional
+import os
+import threading
+
+from .chat_template import render_prompt, tokenize_prompt
+from .dto import MessageDTO
+from .metrics import CONTEXT_MAX_TOKENS_CLAMPED, CONTEXT_REJECTED, CONTEXT_TRUNCATIONS
+
+POLICIES = ("truncate", "summarize", "reject")
+SUMMARY_PREFIX = "Tóm tắt các câu hỏi trước trong hội thoại"
+
+
+class ContextBudgetError(Exception):
+    """Request không thể vừa context window - từ chối trước khi prefill"""
+    status_code = 413
+
+    def __init__(self, message: str, prompt_tokens: int, n_ctx: int):
+        super().__init__(message)
+        self.prompt_tokens = prompt_tokens
+        self.n_ctx = n_ctx
+
+
+class ContextPlan:
+    """Messages and max_tokens that are guaranteed to fit the model's context window"""
+
+    def __init__(self, messages: List[dict], max_tokens: int, prompt_tokens: int, dropped: int = 0):
+        self.messages = messages
+        self.max_tokens = max_tokens
+        self.prompt_tokens = prompt_tokens
+        # Số message lịch sử (tính từ đầu) không được gửi cho model
+        self.dropped = dropped
+
+
+class ContextWindow:
+    """
+    Token-accurate context budgeting, done before a request takes a model slot.
+
+    Message token counts are cached (history is re-sent every turn), the final prompt
+    is rendered with the GGUF chat template and counted exactly. When history does not
+    fit, the oldest turns are dropped (`truncate`), replaced by a short extractive
+    summary (`summarize`), or the request is rejected (`reject`). `max_tokens` is clamped
+    to what is left of n_ctx.
+    """
+
+    def __init__(
+        self,
+        policy: str = "truncate",
+        min_completion_tokens: int = 32,
+        summary_tokens: int = 128,
+        message_overhead: int = 8,
+        cache_size: int = 4096,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown context policy {policy!r}, expected one of {POLICIES}")
+        self.policy = policy
+        self.min_completion_tokens = min_completion_tokens
+        self.summary_tokens = summary_tokens
+        # Token template thêm cho mỗi message khi model không có chat template
+        self.message_overhead = message_overhead
+        self.cache_size = cache_size
+
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, model, text: str) -> int:
+        """Token count of `text` with the model's tokenizer, LRU-cached"""
+        with self._lock:
+            n = self._counts.get(text)
+            if n is not None:
+                self._counts.move_to_end(text)
+                return n
+        n = len(model.tokenize(text.encode("utf-8"), add_bos=False, special=False))
+        with self._lock:
+            self._counts[text] = n
+            while len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return n
+
+    def clear(self):
+        """Drop cached counts (tokenizer changed, e.g. after a model swap)"""
+        with self._lock:
+            self._counts.clear()
+
+    def _estimate(self, model, messages: List[dict]) -> int:
+        return sum(self.count(model, m["content"]) + self.message_overhead for m in messages)
+
+    def prompt_tokens(self, model, messages: List[dict]) -> int:
+        """Exact prompt length as llama.cpp will see it, or an estimate without a chat template"""
+        rendered = render_prompt(model, messages)
+        if rendered is None:
+            return self._estimate(model, messages)
+        return len(tokenize_prompt(model, *rendered))
+
+    def _summary(self, model, dropped: List[MessageDTO]) -> Optional[str]:
+        """Extractive summary: the user's earlier questions, newest kept first, within summary_tokens"""
+        questions = [m.content.strip() for m in dropped if m.role.value == "user" and m.content.strip()]
+        if not questions or self.summary_tokens <= 0:
+            return None
+        kept, used = [], 0
+        for question in reversed(questions):
+            short = question if len(question) <= 200 else question[:200] + "…"
+            n = self.count(model, short) + 2
+            if used + n > self.summary_tokens:
+                break
+            kept.append(short)
+            used += n
+        if not kept:
+            return None
+        return f"{SUMMARY_PREFIX}: " + "; ".join(reversed(kept))
+
+    def _messages(self, model, system_prompt: str, history: List[MessageDTO], start: int, user_input: str) -> List[dict]:
+        system = system_prompt
+        if self.policy == "summarize" and start > 0:
+            summary = self._summary(model, history[:start])
+            if summary:
+                # Gộp vào system message - nhiều template không cho 2 system message liên tiếp
+                system = f"{system_prompt}\n\n{summary}"
+        return [
+            {"role": "system", "content": system},
+            *({"role": m.role.value, "content": m.content} for m in history[start:]),
+            {"role": "user", "content": user_input},
+        ]
+
+    def fit(
+        self,
+        model,
+        system_prompt: str,
+        history: List[MessageDTO],
+        user_input: str,
+        max_tokens: int,
+        start: int = 0,
+    ) -> ContextPlan:
+        """
+        Pick the history window and max_tokens for one request.
+
+        `start` is where the previous turn's window began; keeping it stable keeps the
+        prompt prefix (and the session's KV snapshot) reusable across turns.
+        Raises ContextBudgetError if even the bare question cannot fit.
+        """
+        n_ctx = model.n_ctx()
+        # max_tokens=None: sinh tới hết context như create_chat_completion
+        max_tokens = max_tokens or n_ctx
+        history = list(history or [])
+        start = min(max(0, start), len(history))
+        # Luôn cắt theo cặp user/assistant
+        start -= start % 2
+
+        # Câu trả lời ngắn nhất chấp nhận được; lịch sử chỉ bị cắt để giữ max_tokens
+        # tối đa nửa context (max_tokens=None không được xoá hết lịch sử)
+        needed = min(max_tokens, self.min_completion_tokens)
+        prompt_budget = n_ctx - max(needed, min(max_tokens, n_ctx // 2))
+
+        messages = self._messages(model, system_prompt, history, start, user_input)
+        n_prompt = self.prompt_tokens(model, messages)
+
+        if n_prompt > prompt_budget and start < len(history):
+            if self.policy == "reject":
+                CONTEXT_REJECTED.labels(reason="history").inc()
+                raise ContextBudgetError(
+                    f"Conversation is {n_prompt} tokens, exceeds the {n_ctx}-token context window",
+                    n_prompt, n_ctx,
+                )
+
+            # Ước lượng nhanh bằng count đã cache, sau đó kiểm tra lại bằng prompt render thật
+            per_message = [self.count(model, m.content) + self.message_overhead for m in history]
+            excess = n_prompt - prompt_budget
+            while start < len(history) and excess > 0:
+                excess -= sum(per_message[start:start + 2])
+                start = min(start + 2, len(history))
+            messages = self._messages(model, system_prompt, history, start, user_input)
+            n_prompt = self.prompt_tokens(model, messages)
+
+            while n_prompt > prompt_budget and start < len(history):
+                start = min(start + 2, len(history))
+                messages = self._messages(model, system_prompt, history, start, user_input)
+                n_prompt = self.prompt_tokens(model, messages)
+            CONTEXT_TRUNCATIONS.labels(policy=self.policy).inc()
+
+        if n_prompt + needed > n_ctx:
+            CONTEXT_REJECTED.labels(reason="prompt").inc()
+            raise ContextBudgetError(
+                f"Prompt is {n_prompt} tokens, leaving less than {needed} "
+                f"of the {n_ctx}-token context window for the answer",
+                n_prompt, n_ctx,
+            )
+
+        fitted_max_tokens = min(max_tokens, n_ctx - n_prompt)
+        if fitted_max_tokens < max_tokens:
+            CONTEXT_MAX_TOKENS_CLAMPED.inc()
+            logger.debug(f"max_tokens clamped {max_tokens} -> {fitted_max_tokens} (prompt {n_prompt}/{n_ctx})")
+
+        return ContextPlan(messages, fitted_max_tokens, n_prompt, dropped=start)
+
+
+def _build_context_window() -> ContextWindow:
+    return ContextWindow(
+        policy=os.getenv("CONTEXT_POLICY", "truncate"),
+        min_completion_tokens=int(os.getenv("CONTEXT_MIN_COMPLETION_TOKENS", "32")),
+        summary_tokens=int(os.getenv("CONTEXT_SUMMARY_TOKENS", "128")),
+        cache_size=int(os.getenv("CONTEXT_TOKEN_CACHE_SIZE", "4096")),
+    )
+
+
+contextWindow = _build_context_window()
@@ -4,6 +4,9 @@ from enum import Enum
 from datetime import datetime
 import time
 
+# Session id do client tạo (vd. uuid4), dùng làm key lưu lịch sử + KV snapshot
+SESSION_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+
 class ModelTypeDTO(str, Enum):
     USER = "user"
     SYSTEM = "system"
@@ -17,6 +20,7 @@ class MessageDTO(BaseModel):
 class ChatRequestDTO(BaseModel):
     message: str = Field(..., min_length=1, max_length=1000, description="User's question or message")
     max_tokens: Optional[int] = Field(default=200, ge=1, le=1000, description="Maximum tokens to generate")
+    session_id: Optional[str] = Field(default=None, pattern=SESSION_ID_PATTERN, description="Conversation id for multi-turn chat")
 
     @field_validator('message')
     @classmethod
@@ -30,6 +34,9 @@ class ChatResponseDTO(BaseModel):
     timestamp: float = Field(default_factory=lambda: time.time())
     response_time: Optional[float] = None
     model_used: str = "custom-llama"
+    cached: bool = False
+    deduplicated: bool = False
+    session_id: Optional[str] = None
 
 class HealthResponseDTO(BaseModel):
     status: str
@@ -41,6 +48,26 @@ class HealthResponseDTO(BaseModel):
 class StreamChatRequestDTO(BaseModel):
     message: str = Field(..., min_length=1, max_length=1000, description="User's current message")
     max_tokens: Optional[int] = Field(default=500, ge=1, le=1000, description="Maximum tokens to generate")
+    session_id: Optional[str] = Field(default=None, pattern=SESSION_ID_PATTERN, description="Conversation id for multi-turn chat")
+
+    @field_validator('message')
+    @classmethod
+    def validate_message(cls, v):
+        if not v.strip():
+            raise ValueError('Message cannot be empty')
+        return v.strip()
+
+class SessionResponseDTO(BaseModel):
+    session_id: str
+    history: List[MessageDTO]
+
+class ModelSwapRequestDTO(BaseModel):
+    version: Optional[str] = Field(default=None, max_length=32, description="MLflow registry version, latest if omitted")
+    model_path: Optional[str] = Field(default=None, description="Swap to a GGUF already on disk instead of the registry")
+
+class BatchItemDTO(BaseModel):
+    id: Optional[str] = Field(default=None, max_length=128, description="Caller's id, echoed back in the result")
+    message: str = Field(..., min_length=1, max_length=1000, description="Question to answer")
 
     @field_validator('message')
     @classmethod
@@ -49,6 +76,11 @@ class StreamChatRequestDTO(BaseModel):
             raise ValueError('Message cannot be empty')
         return v.strip()
 
+class BatchGenerateRequestDTO(BaseModel):
+    items: List[BatchItemDTO] = Field(..., min_length=1, max_length=256, description="Questions, answered independently (no session)")
+    max_tokens: Optional[int] = Field(default=200, ge=1, le=1000, description="Maximum tokens to generate per answer")
+    concurrency: Optional[int] = Field(default=None, ge=1, le=64, description="Items generated at once, default: low-priority slots")
+
 class ErrorResponseDTO(BaseModel):
     error: str
     detail: Optional[str] = None
@@ -1,68 +1,116 @@
 import gradio as gr
-import requests
-import json
+import httpx
 import os
+import time
+import uuid
 
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000/api/v1")
-
-def stream_chat_response(message, history):
+# Server gửi heartbeat mỗi STREAM_HEARTBEAT_S, read timeout là thời gian tối đa giữa hai lần nhận dữ liệu
+CONNECT_TIMEOUT = float(os.getenv("FRONTEND_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("FRONTEND_READ_TIMEOUT", "60"))
+# Gom token, cập nhật UI tối đa 1 lần mỗi FRONTEND_REFRESH_MS
+REFRESH_INTERVAL = float(os.getenv("FRONTEND_REFRESH_MS", "100")) / 1000
+MAX_CONNECTIONS = int(os.getenv("FRONTEND_MAX_CONNECTIONS", "64"))
+CONCURRENCY = int(os.getenv("FRONTEND_CONCURRENCY", "64"))
+
+_client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """One pooled keep-alive client for all chats, created on Gradio's event loop"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        )
+    return _client
+
+
+async def iter_sse(response: httpx.Response):
+    """(event, data) pairs of an SSE stream"""
+    # SSE: gom các dòng "data:" tới dòng trống, rồi xử lý theo "event:"
+    event, data_lines = "message", []
+    async for line in response.aiter_lines():
+        if line.startswith(":"):
+            continue  # heartbeat
+        if line.startswith("event:"):
+            event = line[6:].strip()
+            continue
+        if line.startswith("data:"):
+            value = line[5:]
+            data_lines.append(value[1:] if value.startswith(" ") else value)
+            continue
+        if line or not data_lines:
+            continue
+        yield event, "\n".join(data_lines)
+        event, data_lines = "message", []
+
+
+async def stream_chat_response(message, history, session_id=None):
     new_history = history + [[message, ""]]
     yield new_history
+    # Token tới nhanh hơn UI vẽ: chỉ yield theo nhịp REFRESH_INTERVAL, Gradio gửi phần diff
+    pending = []
+    last_update = time.monotonic()
     try:
-        payload = {"message": message, "max_tokens": 256}
-        response = requests.post(
-            f"{API_BASE_URL}/chat/stream",
-            json=payload,
-            stream=True,
-            timeout=60
-        )
-
-        accumulated = ""
-        for line in response.iter_lines():
-            if line:
-                decoded = line.decode("utf-8")
-                if decoded.startswith("data: "):
-                    data_str = decoded[6:]
-                    if data_str.strip() == "[DONE]":
-                        break
-                    try:
-                        data = json.loads(data_str)
-                        if "content" in data:
-                            accumulated += data["content"]
-                        elif "delta" in data and "content" in data["delta"]:
-                            accumulated += data["delta"]["content"]
-
-                        new_history[-1][1] = accumulated
+        # Server giữ lịch sử theo session_id, chỉ cần gửi câu hỏi hiện tại
+        payload = {"message": message, "max_tokens": 256, "session_id": session_id}
+        async with get_client().stream("POST", f"{API_BASE_URL}/chat/stream", json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                new_history[-1][1] = f"Lỗi: {response.status_code} {response.text}"
+                yield new_history
+                return
+            async for event, data in iter_sse(response):
+                # Không break ở [DONE]: đọc hết stream để connection quay lại pool keep-alive
+                if event == "chunk":
+                    pending.append(data)
+                    now = time.monotonic()
+                    if now - last_update >= REFRESH_INTERVAL:
+                        new_history[-1][1] += "".join(pending)
+                        pending.clear()
+                        last_update = now
                         yield new_history
-                    except:
-                        continue
+                elif event == "error":
+                    pending.clear()
+                    new_history[-1][1] = f"Lỗi: {data}"
+                    yield new_history
+        if pending:
+            new_history[-1][1] += "".join(pending)
+            yield new_history
     except Exception as e:
         new_history[-1][1] = f"Lỗi: {str(e)}"
         yield new_history
 
+def new_session_id():
+    return uuid.uuid4().hex
+
 def clear():
-    return [], ""
+    return [], "", new_session_id()
 
 
 with gr.Blocks(title="Chatbot Luật Việt Nam") as demo:
     gr.Markdown("<h2 style='text-align:center;'>Chatbot Luật Việt Nam</h2>")
 
     chatbot = gr.Chatbot()
+    session_id = gr.State(new_session_id)
 
     with gr.Row():
         msg = gr.Textbox(placeholder="Nhập câu hỏi...", show_label=False, scale=8)
         send = gr.Button("Gửi", scale=1)
         clear_btn = gr.Button("Xóa", scale=1)
 
-    def submit(message, history):
+    async def submit(message, history, session):
         if not message or not message.strip():
-            return history, ""
-        for update in stream_chat_response(message, history):
+            yield history, ""
+            return
+        async for update in stream_chat_response(message, history, session):
             yield update, ""
 
-    send.click(submit, [msg, chatbot], [chatbot, msg])
-    msg.submit(submit, [msg, chatbot], [chatbot, msg])
-    clear_btn.click(clear, [], [chatbot, msg])
+    send.click(submit, [msg, chatbot, session_id], [chatbot, msg])
+    msg.submit(submit, [msg, chatbot, session_id], [chatbot, msg])
+    clear_btn.click(clear, [], [chatbot, msg, session_id])
 
     # Examples
     gr.Markdown("### 💡 Câu hỏi mẫu:")
@@ -76,7 +124,8 @@ with gr.Blocks(title="Chatbot Luật Việt Nam") as demo:
     ]
 
     def set_example_question(example_text):
-        return example_text, []
+        # Câu hỏi mẫu bắt đầu hội thoại mới
+        return example_text, [], new_session_id()
 
     # Hiển thị theo 2 cột
     with gr.Row():
@@ -88,7 +137,7 @@ with gr.Blocks(title="Chatbot Luật Việt Nam") as demo:
                     example_btn.click(
                         fn=set_example_question,
                         inputs=[gr.State(example)],
-                        outputs=[msg, chatbot]
+                        outputs=[msg, chatbot, session_id]
                     )
         with gr.Column():
             for i, example in enumerate(examples):
@@ -98,10 +147,12 @@ with gr.Blocks(title="Chatbot Luật Việt Nam") as demo:
                     example_btn.click(
                         fn=set_example_question,
                         inputs=[gr.State(example)],
-                        outputs=[msg, chatbot]
+                        outputs=[msg, chatbot, session_id]
                     )
 
     gr.Markdown("<p style='text-align:center;color:#666;font-size:13px;'>Lưu ý: Chatbot chỉ hỗ trợ tham khảo, không thay thế tư vấn pháp lý.</p>")
 
 if __name__ == "__main__":
+    # Handler async không chiếm thread, mặc định Gradio chỉ chạy 1 sự kiện cùng lúc
+    demo.queue(default_concurrency_limit=CONCURRENCY)
     demo.launch(server_name="0.0.0.0", server_port=7860)
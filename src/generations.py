@@ -0,0 +1,92 @@
+from loguru import logger
+from typing import Dict, Optional
+import re
+import threading
+import time
+import uuid
+
+from .metrics import GENERATIONS_CANCELLED, CANCELLED_TOKENS_SAVED
+
+# Biết id là đủ để huỷ generation: id do client đặt phải khó đoán như uuid4
+_CLIENT_ID = re.compile(r"^[A-Za-z0-9_-]{22,128}$")
+
+
+class InvalidGenerationId(ValueError):
+    """Client-supplied generation id is too short / guessable"""
+    status_code = 400
+
+
+class GenerationIdConflict(InvalidGenerationId):
+    """Another in-flight generation already uses this id"""
+    status_code = 409
+
+
+class Generation:
+    """One in-flight generation that can be cancelled cooperatively"""
+
+    def __init__(self, generation_id: str, max_tokens: int):
+        self.id = generation_id
+        self.max_tokens = max_tokens
+        self.created = time.time()
+        # Decode loop kiểm tra event này sau mỗi token
+        self.cancel_event = threading.Event()
+        self.cancel_reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self, reason: str):
+        if not self.cancel_event.is_set():
+            self.cancel_reason = reason
+            self.cancel_event.set()
+
+
+class GenerationRegistry:
+    def __init__(self):
+        self._generations: Dict[str, Generation] = {}
+        self._lock = threading.Lock()
+
+    def start(self, max_tokens: int, generation_id: Optional[str] = None) -> Generation:
+        """
+        Register a generation under a server-generated id, or under `generation_id` chosen
+        by the client (so a /generate still waiting for its answer can be cancelled).
+        """
+        if generation_id is not None and not _CLIENT_ID.match(generation_id):
+            raise InvalidGenerationId("X-Generation-Id must be 22-128 random URL-safe characters, e.g. a uuid4 hex")
+        generation = Generation(generation_id or uuid.uuid4().hex, max_tokens)
+        with self._lock:
+            if generation.id in self._generations:
+                raise GenerationIdConflict(f"Generation {generation.id} is already running")
+            self._generations[generation.id] = generation
+        return generation
+
+    def get(self, generation_id: str) -> Optional[Generation]:
+        return self._generations.get(generation_id)
+
+    def cancel(self, generation_id: str, reason: str = "api") -> bool:
+        generation = self.get(generation_id)
+        if generation is None:
+            return False
+        generation.cancel(reason)
+        return True
+
+    def finish(self, generation: Generation, tokens_generated: int):
+        with self._lock:
+            self._generations.pop(generation.id, None)
+        if generation.cancelled:
+            # Event set trực tiếp bởi consumer (stream bị huỷ) không kèm reason
+            reason = generation.cancel_reason or "disconnect"
+            saved = max(0, generation.max_tokens - tokens_generated)
+            GENERATIONS_CANCELLED.labels(reason=reason).inc()
+            CANCELLED_TOKENS_SAVED.inc(saved)
+            logger.info(
+                f"Generation {generation.id} cancelled ({reason}) "
+                f"after {tokens_generated} tokens, ~{saved} tokens saved"
+            )
+
+    def __len__(self) -> int:
+        return len(self._generations)
+
+
+generationRegistry = GenerationRegistry()
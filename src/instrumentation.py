@@ -0,0 +1,108 @@
+from loguru import logger
+from typing import Callable, Optional
+import time
+
+from .metrics import (
+    CHAT_REQUESTS, CHAT_REQUEST_DURATION, COMPLETION_TOKENS, CPU_USAGE, DECODE_DURATION,
+    INTER_TOKEN_LATENCY, MEMORY_USAGE, MODEL_INFERENCE_DURATION, MODEL_LOADED, PREFILL_DURATION,
+    PROMPT_TOKENS, TIME_TO_FIRST_TOKEN, TOKENS_PER_SECOND,
+)
+from .tracing import record_span
+
+
+class RequestMetrics:
+    """chat_requests_total / chat_request_duration_seconds for one API call"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self._done = False
+
+    def done(self, status_code: int = 200):
+        if self._done:
+            return
+        self._done = True
+        CHAT_REQUESTS.labels(endpoint=self.endpoint, status_code=str(status_code)).inc()
+        CHAT_REQUEST_DURATION.labels(endpoint=self.endpoint).observe(time.perf_counter() - self.start)
+
+
+class GenerationTracker:
+    """
+    Per-generation timings: TTFT, inter-token latency, prefill vs decode, tokens/sec.
+
+    Created when a request starts running on the model (after the admission queue),
+    fed one `token()` call per streamed piece, closed with `finish()`.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.last_token_at: Optional[float] = None
+        self.end: Optional[float] = None
+        self.completion_tokens = 0
+        self.prompt_tokens = 0
+
+    def token(self, n: int = 1):
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+            TIME_TO_FIRST_TOKEN.observe(now - self.start)
+        else:
+            INTER_TOKEN_LATENCY.observe(now - self.last_token_at)
+        self.last_token_at = now
+        self.completion_tokens += n
+
+    @property
+    def ttft(self) -> Optional[float]:
+        return None if self.first_token_at is None else self.first_token_at - self.start
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        if self.first_token_at is None or self.completion_tokens < 2:
+            return None
+        decode_time = (self.end or time.perf_counter()) - self.first_token_at
+        return (self.completion_tokens - 1) / decode_time if decode_time > 0 else None
+
+    def finish(self, prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None):
+        if self.end is not None:
+            return
+        self.end = time.perf_counter()
+        if prompt_tokens is not None:
+            self.prompt_tokens = prompt_tokens
+        if completion_tokens is not None:
+            self.completion_tokens = completion_tokens
+
+        MODEL_INFERENCE_DURATION.observe(self.end - self.start)
+        PROMPT_TOKENS.inc(self.prompt_tokens)
+        COMPLETION_TOKENS.inc(self.completion_tokens)
+        if self.first_token_at is not None:
+            PREFILL_DURATION.observe(self.first_token_at - self.start)
+            DECODE_DURATION.observe(self.end - self.first_token_at)
+        tps = self.tokens_per_second
+        if tps is not None:
+            TOKENS_PER_SECOND.observe(tps)
+
+        # Prefill: từ lúc có slot đến token đầu (checkout replica, template, eval prompt)
+        if self.first_token_at is not None:
+            record_span("llm.prefill", self.start, self.first_token_at, prompt_tokens=self.prompt_tokens)
+            record_span("llm.decode", self.first_token_at, self.end,
+                        completion_tokens=self.completion_tokens, tokens_per_second=tps)
+        else:
+            record_span("llm.prefill", self.start, self.end, prompt_tokens=self.prompt_tokens)
+
+
+def register_service_gauges(is_model_loaded: Callable[[], bool]):
+    """Gauges computed at scrape time: model_loaded, memory_usage_bytes, cpu_usage_percent"""
+    MODEL_LOADED.set_function(lambda: 1 if is_model_loaded() else 0)
+
+    try:
+        import psutil
+    except ImportError:
+        logger.warning("psutil not installed, memory_usage_bytes / cpu_usage_percent disabled")
+        return
+
+    process = psutil.Process()
+    # Lần gọi đầu của cpu_percent luôn trả 0, các lần sau đo từ lần scrape trước
+    process.cpu_percent(None)
+    MEMORY_USAGE.set_function(lambda: process.memory_info().rss)
+    CPU_USAGE.set_function(lambda: process.cpu_percent(None))
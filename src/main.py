@@ -1,9 +1,13 @@
+import time
+_import_start = time.perf_counter()
+
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import uvicorn
 from loguru import logger
 from contextlib import asynccontextmanager
+import asyncio
 import os
 import sys
 import socket
@@ -14,22 +18,51 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from .api import Router as ChatRouter
 from .chat_service import chatService
+from .semantic_cache import semanticCache
+from .instrumentation import register_service_gauges
+from .startup import startupReport
+from .model_registry import modelRegistry
+from .tracing import TracingMiddleware, requestTracing
+
+startupReport.record("import", time.perf_counter() - _import_start)
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Handle startup and shutdown events"""
-    logger.info("Starting QA Chatbot service...")
 
+async def _load_and_warmup():
     # Load model (expects model to be downloaded at build time)
     try:
         await chatService.load_model()
         logger.info("Model loaded successfully on startup")
+        startupReport.mark_ready()
     except Exception as e:
         logger.warning(f"Could not load model on startup: {e}")
+        startupReport.mark_not_ready(str(e))
+        return
+    # Model mới trong MLflow registry được hot-swap, không cần build lại image
+    modelRegistry.start(chatService)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Handle startup and shutdown events"""
+    logger.info("Starting QA Chatbot service...")
+
+    # Load + warmup chạy nền: /health (liveness) trả lời ngay, /ready chỉ xanh khi warmup xong
+    startupReport.mark_not_ready()
+    loader = asyncio.create_task(_load_and_warmup())
 
     yield
 
     logger.info("Shutting down QA Chatbot service...")
+    startupReport.mark_not_ready()
+    if not loader.done():
+        loader.cancel()
+    modelRegistry.stop()
+    chatService.shutdown()
+    if semanticCache is not None:
+        semanticCache.shutdown()
+    if requestTracing is not None:
+        # Flush các span còn trong BatchSpanProcessor
+        requestTracing.shutdown()
 
 
 app = FastAPI(
@@ -43,6 +76,7 @@ app = FastAPI(
 
 # Prometheus instrumentation
 Instrumentator().instrument(app).expose(app)
+register_service_gauges(chatService.is_model_loaded)
 
 # CORS middleware
 app.add_middleware(
@@ -53,6 +87,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request id + OpenTelemetry server span; thêm sau cùng để bọc ngoài mọi middleware khác
+app.add_middleware(TracingMiddleware)
+
 # Include routers
 app.include_router(ChatRouter, prefix="/api/v1", tags=["chat"])
 
@@ -70,6 +107,14 @@ async def health_check():
         "instance_name": instance_name
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 200 only after the model is loaded and warmed up"""
+    body = {"status": "ready" if startupReport.ready else "starting", **startupReport.as_dict()}
+    if not startupReport.ready:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -0,0 +1,263 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Metrics được export qua /metrics (default registry của Instrumentator)
+
+# Admission control
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "admission_queue_depth",
+    "Number of generation requests waiting for a model slot",
+)
+ADMISSION_ACTIVE = Gauge(
+    "admission_active_requests",
+    "Number of generation requests currently holding a model slot",
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "admission_queue_wait_seconds",
+    "Time a request spent queued before being admitted",
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "Requests rejected by admission control",
+    ["reason"],
+)
+
+# System prompt prefix cache
+PREFIX_CACHE_TOKENS = Gauge(
+    "prefix_cache_tokens",
+    "Number of system prompt tokens kept pre-evaluated in each replica's KV cache",
+)
+PREFIX_CACHE_RESTORES = Counter(
+    "prefix_cache_restores_total",
+    "Times a replica was rolled back to the saved system prompt state",
+)
+
+# Response cache
+RESPONSE_CACHE_HITS = Counter(
+    "response_cache_hits_total",
+    "Answers served from the response cache",
+    ["endpoint", "tier"],
+)
+RESPONSE_CACHE_MISSES = Counter(
+    "response_cache_misses_total",
+    "Response cache lookups that fell through to the model",
+    ["endpoint"],
+)
+RESPONSE_CACHE_ENTRIES = Gauge(
+    "response_cache_entries",
+    "Entries held in the in-memory response cache",
+)
+RESPONSE_CACHE_BYTES = Gauge(
+    "response_cache_bytes",
+    "Bytes of answer text held in the in-memory response cache",
+)
+
+# Semantic cache
+SEMANTIC_CACHE_HITS = Counter(
+    "semantic_cache_hits_total",
+    "Answers served from the semantic (embedding) cache",
+)
+SEMANTIC_CACHE_MISSES = Counter(
+    "semantic_cache_misses_total",
+    "Semantic cache lookups below the similarity threshold",
+)
+SEMANTIC_CACHE_ENTRIES = Gauge(
+    "semantic_cache_entries",
+    "Question/answer pairs held in the semantic cache index",
+)
+SEMANTIC_CACHE_SIMILARITY = Histogram(
+    "semantic_cache_best_similarity",
+    "Cosine similarity of the nearest cached question",
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.96, 0.98, 1.0),
+)
+
+# Chat API (tên metric khớp với monitor/prometheus/alert_rules.yml)
+CHAT_REQUESTS = Counter(
+    "chat_requests_total",
+    "Chat API requests by endpoint and status code",
+    ["endpoint", "status_code"],
+)
+CHAT_REQUEST_DURATION = Histogram(
+    "chat_request_duration_seconds",
+    "End-to-end chat request duration, including streaming",
+    ["endpoint"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120),
+)
+MODEL_LOADED = Gauge(
+    "model_loaded",
+    "1 if the GGUF model is loaded and serving, else 0",
+)
+MEMORY_USAGE = Gauge(
+    "memory_usage_bytes",
+    "Resident memory of the API process",
+)
+CPU_USAGE = Gauge(
+    "cpu_usage_percent",
+    "CPU usage of the API process since the previous scrape",
+)
+
+# Inference
+MODEL_INFERENCE_DURATION = Histogram(
+    "model_inference_duration_seconds",
+    "Time spent in the model for one generation (prefill + decode)",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120),
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "time_to_first_token_seconds",
+    "Time from inference start to the first generated token",
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10),
+)
+INTER_TOKEN_LATENCY = Histogram(
+    "inter_token_latency_seconds",
+    "Time between consecutive generated tokens",
+    buckets=(0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1),
+)
+PREFILL_DURATION = Histogram(
+    "model_prefill_duration_seconds",
+    "Prompt processing time (up to the first token)",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+DECODE_DURATION = Histogram(
+    "model_decode_duration_seconds",
+    "Token generation time after the first token",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120),
+)
+PROMPT_TOKENS = Counter(
+    "prompt_tokens_total",
+    "Prompt tokens processed",
+)
+COMPLETION_TOKENS = Counter(
+    "completion_tokens_total",
+    "Completion tokens generated",
+)
+TOKENS_PER_SECOND = Histogram(
+    "generation_tokens_per_second",
+    "Decode throughput of a single generation",
+    buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200),
+)
+
+# Cancellation
+GENERATIONS_CANCELLED = Counter(
+    "generations_cancelled_total",
+    "Generations stopped before completion",
+    ["reason"],
+)
+CANCELLED_TOKENS_SAVED = Counter(
+    "cancelled_tokens_saved_total",
+    "Decode tokens not generated because of cancellation (max_tokens - generated)",
+)
+
+# Multi-turn sessions
+SESSION_ACTIVE = Gauge(
+    "chat_sessions_active",
+    "Chat sessions with server-side history",
+)
+SESSION_STATE_BYTES = Gauge(
+    "session_state_bytes",
+    "Bytes of per-session KV state snapshots held in memory",
+)
+SESSION_STATE_RESTORES = Counter(
+    "session_state_restores_total",
+    "Session KV snapshots reused for a follow-up turn",
+    ["tier"],
+)
+SESSION_STATE_SPILLS = Counter(
+    "session_state_spills_total",
+    "Session KV snapshots evicted from memory to disk",
+)
+SESSION_REUSED_TOKENS = Counter(
+    "session_reused_prompt_tokens_total",
+    "Prompt tokens served from a session's KV snapshot instead of being prefilled",
+)
+
+# Context window
+CONTEXT_TRUNCATIONS = Counter(
+    "context_truncations_total",
+    "Requests whose conversation history was cut to fit the context window",
+    ["policy"],
+)
+CONTEXT_REJECTED = Counter(
+    "context_rejected_total",
+    "Requests rejected before prefill because they cannot fit the context window",
+    ["reason"],
+)
+CONTEXT_MAX_TOKENS_CLAMPED = Counter(
+    "context_max_tokens_clamped_total",
+    "Requests whose max_tokens was reduced to the remaining context",
+)
+
+# Speculative decoding
+SPECULATIVE_DRAFT_TOKENS = Counter(
+    "speculative_draft_tokens_total",
+    "Tokens proposed by the draft (prompt lookup or draft model) and verified by the target",
+)
+SPECULATIVE_ACCEPTED_TOKENS = Counter(
+    "speculative_accepted_tokens_total",
+    "Draft tokens accepted by the target model",
+)
+SPECULATIVE_ACCEPTANCE_RATE = Histogram(
+    "speculative_acceptance_rate",
+    "Fraction of each draft proposal accepted by the target model",
+    buckets=(0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0),
+)
+
+# Startup / readiness
+STARTUP_PHASE_SECONDS = Gauge(
+    "startup_phase_seconds",
+    "Duration of each startup phase (import, prefault, load, warmup, prefix_cache)",
+    ["phase"],
+)
+SERVICE_READY = Gauge(
+    "service_ready",
+    "1 once the model is loaded and warmed up and the pod should receive traffic",
+)
+
+# Hot model swap
+MODEL_INFO = Gauge(
+    "model_info",
+    "1 for the registry version / GGUF path currently serving",
+    ["version", "path"],
+)
+MODEL_SWAPS = Counter(
+    "model_swaps_total",
+    "Hot model swap attempts by outcome (swapped, rolled_back, failed)",
+    ["result"],
+)
+MODEL_SWAP_WARMUP_SECONDS = Histogram(
+    "model_swap_canary_seconds",
+    "Slowest canary generation on a swap candidate",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+# Multi-process router (src.serve)
+ROUTER_INFLIGHT = Gauge(
+    "router_inflight_requests",
+    "Requests the router is currently proxying, per worker process",
+    ["worker"],
+)
+ROUTER_REQUESTS = Counter(
+    "router_requests_total",
+    "Requests dispatched by the router, per worker process",
+    ["worker"],
+)
+ROUTER_RETRIES = Counter(
+    "router_retries_total",
+    "Requests re-dispatched because the chosen worker was unreachable",
+)
+ROUTER_WORKERS_READY = Gauge(
+    "router_workers_ready",
+    "Worker processes currently passing their readiness probe",
+)
+
+SINGLE_FLIGHT_DEDUPLICATED = Counter(
+    "single_flight_deduplicated_total",
+    "Requests served by attaching to an identical in-flight generation",
+    ["endpoint"],
+)
+
+# Batch inference (/generate/batch, scripts/batch_generate.py)
+BATCH_ITEMS = Counter(
+    "batch_items_total",
+    "Batch questions answered, by outcome (generated, cached, error)",
+    ["status"],
+)
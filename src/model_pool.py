@@ -0,0 +1,164 @@
+from loguru import logger
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, List, Optional
+import queue
+import threading
+import time
+
+from .chat_template import forget
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+
+class PoolClosed(RuntimeError):
+    """The pool was retired by a model swap; borrow from the current pool instead"""
+
+
+class ModelPool:
+    """
+    K llama.cpp replicas of the same GGUF file.
+
+    Every replica opens the model with use_mmap=True, so the weights live once in the
+    OS page cache and only the per-context KV cache is duplicated. `n_threads` is split
+    across replicas so K concurrent requests do not oversubscribe the cores.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        replicas: int = 1,
+        n_threads: int = 8,
+        threads_per_replica: Optional[int] = None,
+        n_threads_batch: Optional[int] = None,
+        n_ctx: int = 4096,
+        model_factory: Optional[Callable[..., "Llama"]] = None,
+        draft_factory: Optional[Callable[[], object]] = None,
+        **llama_kwargs,
+    ):
+        self.model_path = model_path
+        self.replicas = max(1, replicas)
+        self.threads_per_replica = threads_per_replica or max(1, n_threads // self.replicas)
+        # Thread cho prefill (batch); None: llama.cpp dùng bằng n_threads
+        self.threads_batch_per_replica = max(1, n_threads_batch // self.replicas) if n_threads_batch else None
+        self.n_ctx = n_ctx
+        if model_factory is None:
+            # llama_cpp import ~0.2s: chỉ trả khi load model, không phải lúc import app
+            from llama_cpp import Llama
+            model_factory = Llama
+        self.model_factory = model_factory
+        # Speculative decoding: mỗi replica một draft riêng (draft giữ state)
+        self.draft_factory = draft_factory
+        self.llama_kwargs = llama_kwargs
+
+        self.models: List["Llama"] = []
+        # LIFO: replica vừa dùng xong được lấy lại trước, KV cache/page cache còn nóng
+        self._idle: "queue.LifoQueue[Llama]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.closed = False
+        # Số request đang dùng tokenizer của replica 0 (đếm token, không chiếm replica)
+        self._readers = 0
+
+    def load(self):
+        """Load all replicas (blocking)"""
+        for i in range(self.replicas):
+            logger.info(
+                f"Loading replica {i + 1}/{self.replicas} from {self.model_path} "
+                f"(n_threads={self.threads_per_replica}, n_ctx={self.n_ctx})"
+            )
+            kwargs = dict(self.llama_kwargs)
+            if self.threads_batch_per_replica:
+                kwargs["n_threads_batch"] = self.threads_batch_per_replica
+            if self.draft_factory is not None:
+                # llama-cpp-python cần logits của mọi vị trí để verify draft tokens
+                kwargs.update(draft_model=self.draft_factory(), logits_all=True)
+            model = self.model_factory(
+                model_path=self.model_path,
+                n_ctx=self.n_ctx,
+                n_threads=self.threads_per_replica,
+                use_mmap=True,
+                verbose=False,
+                **kwargs,
+            )
+            self.models.append(model)
+            self._idle.put(model)
+
+    @property
+    def size(self) -> int:
+        return len(self.models)
+
+    @property
+    def idle(self) -> int:
+        return self._idle.qsize()
+
+    def checkout(self, timeout: Optional[float] = None) -> "Llama":
+        """Borrow an idle replica; must be given back with release()"""
+        if self.closed:
+            raise PoolClosed("Model pool has been retired")
+        try:
+            model = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No idle model replica available")
+        # Pool bị retire trong lúc chờ (None là sentinel của close) - trả lại, không dùng
+        if model is None or self.closed:
+            self._idle.put(model)
+            raise PoolClosed("Model pool has been retired")
+        return model
+
+    def release(self, model: "Llama"):
+        self._idle.put(model)
+
+    @contextmanager
+    def acquire(self, timeout: Optional[float] = None):
+        """with pool.acquire() as model: ... borrows an idle replica for the block"""
+        model = self.checkout(timeout)
+        try:
+            yield model
+        finally:
+            self.release(model)
+
+    @contextmanager
+    def tokenizer(self):
+        """Replica 0 for read-only vocab work (tokenize / chat template) without borrowing it"""
+        with self._lock:
+            if self.closed or not self.models:
+                raise PoolClosed("Model pool has been retired")
+            self._readers += 1
+        try:
+            yield self.models[0]
+        finally:
+            with self._lock:
+                self._readers -= 1
+
+    def retire(self):
+        """Stop lending replicas; in-flight requests keep theirs until they finish"""
+        with self._lock:
+            self.closed = True
+
+    def drain(self, timeout: float, poll: float = 0.05) -> bool:
+        """Wait until every borrowed replica is back. False if `timeout` expired first."""
+        deadline = time.monotonic() + timeout
+        while self._idle.qsize() < len(self.models) or self._readers:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(poll)
+        return True
+
+    def close(self):
+        """Drop all replicas so llama.cpp frees their contexts"""
+        self.closed = True
+        with self._lock:
+            while not self._idle.empty():
+                self._idle.get_nowait()
+            for model in self.models:
+                forget(model)
+                try:
+                    draft = getattr(model, "draft_model", None)
+                    if draft is not None and hasattr(draft, "close"):
+                        draft.close()
+                    model.close()
+                except Exception as e:
+                    logger.warning(f"Error closing replica: {e}")
+            self.models = []
+            # Đánh thức request đang chờ checkout trên pool đã đóng
+            self._idle.put(None)
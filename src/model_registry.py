@@ -0,0 +1,120 @@
+from loguru import logger
+from typing import Optional, Tuple
+import asyncio
+import os
+import re
+import sys
+
+
+def _downloader():
+    """download_model.py: copied next to the src modules in the Docker image, in scripts/ in a checkout"""
+    try:
+        from . import download_model
+    except ImportError:
+        scripts = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+        if scripts not in sys.path:
+            sys.path.append(scripts)
+        import download_model
+    return download_model
+
+
+class ModelRegistry:
+    """
+    Fetches GGUF versions from the MLflow model registry at runtime and hands them to
+    ChatService.swap_model, either on demand (admin API) or from a polling watcher.
+
+    Each version is downloaded to `model_dir`; the file of a version that was swapped
+    out (or rejected by the canary) is deleted, the model baked into the image is not.
+    """
+
+    def __init__(self, model_name: str, model_dir: str = "./models", watch_interval: float = 0):
+        self.model_name = model_name
+        self.model_dir = model_dir
+        self.watch_interval = watch_interval
+        # Version đã bị rollback - watcher không thử lại cho tới khi có version mới hơn
+        self._rejected = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def resolve(self, version: Optional[str] = None) -> Tuple[str, str]:
+        """(version, s3 source) of `version`, or of the latest version"""
+        resolved = _downloader().resolve_version(self.model_name, version)
+        if resolved is None:
+            raise LookupError(f"No versions found for model '{self.model_name}'")
+        return resolved
+
+    def _path(self, version: str) -> str:
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", self.model_name)
+        return os.path.join(self.model_dir, f"{name}-v{version}.gguf")
+
+    def _owned(self, path: str) -> bool:
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.model_dir)
+
+    def _remove(self, path: str):
+        if self._owned(path) and os.path.exists(path):
+            # Replica cũ có thể còn mmap file này - unlink vẫn an toàn trên Linux
+            os.remove(path)
+            logger.info(f"Removed model file {path}")
+
+    def fetch(self, version: str, source: str) -> str:
+        path = self._path(version)
+        os.makedirs(self.model_dir, exist_ok=True)
+        if not _downloader().download_source(source, path):
+            raise RuntimeError(f"Download of {self.model_name} v{version} from {source} failed")
+        return path
+
+    async def swap(self, service, version: Optional[str] = None) -> dict:
+        """Download `version` (default: latest) and hot-swap the service to it"""
+        loop = asyncio.get_running_loop()
+        version, source = await loop.run_in_executor(None, self.resolve, version)
+        if version == service.model_version:
+            return {"status": "unchanged", "version": version, "model_path": service.model_path}
+
+        logger.info(f"Fetching {self.model_name} v{version} from {source}")
+        path = await loop.run_in_executor(None, self.fetch, version, source)
+        previous = service.model_path
+        result = await service.swap_model(path, version)
+        if result["status"] == "swapped":
+            self._rejected.discard(version)
+            self._remove(previous)
+        else:
+            self._rejected.add(version)
+            self._remove(path)
+        return result
+
+    async def _watch(self, service):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                version, _ = await loop.run_in_executor(None, self.resolve, None)
+                if version == service.model_version or version in self._rejected:
+                    continue
+                logger.info(f"Registry has {self.model_name} v{version} (serving {service.model_version})")
+                await self.swap(service, version)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Model registry watch failed: {e}")
+
+    def start(self, service):
+        """Poll the registry every `watch_interval` seconds (0 disables the watcher)"""
+        if self.watch_interval <= 0 or self._task is not None:
+            return
+        logger.info(f"Watching MLflow registry for {self.model_name} every {self.watch_interval:.0f}s")
+        self._task = asyncio.create_task(self._watch(service))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+def _build_registry() -> ModelRegistry:
+    return ModelRegistry(
+        model_name=os.getenv("MODEL_NAME", "health-llm-gguf"),
+        model_dir=os.getenv("MODEL_DIR", "./models"),
+        watch_interval=float(os.getenv("MODEL_WATCH_INTERVAL", "0")),
+    )
+
+
+modelRegistry = _build_registry()
@@ -0,0 +1,57 @@
+from loguru import logger
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+from .chat_template import system_prefix, tokenize_prompt
+from .metrics import PREFIX_CACHE_RESTORES, PREFIX_CACHE_TOKENS
+
+if TYPE_CHECKING:
+    from llama_cpp.llama import Llama, LlamaState
+
+
+class PrefixStateCache:
+    """
+    llama.cpp state snapshot taken right after evaluating the system prompt, per replica.
+
+    The system prompt is the same for every request, so it is prefilled once at load time.
+    Before each request the replica is rolled back to that snapshot if its KV cache no
+    longer starts with the prefix; llama.cpp's longest-prefix match in `generate` then
+    only prefills the user's question.
+    """
+
+    def __init__(self, system_prompt: str):
+        self.system_prompt = system_prompt
+        self._entries: Dict[int, Tuple[List[int], "LlamaState"]] = {}
+
+    def warm(self, model: "Llama") -> int:
+        """Evaluate the system prefix on `model` and save its state. Returns prefix length."""
+        prefix = system_prefix(model, self.system_prompt)
+        if prefix is None:
+            logger.warning("Model has no chat template, system prompt prefix cache disabled")
+            return 0
+
+        text, add_bos = prefix
+        tokens = tokenize_prompt(model, text, add_bos)
+        model.reset()
+        model.eval(tokens)
+        self._entries[id(model)] = (tokens, model.save_state())
+        PREFIX_CACHE_TOKENS.set(len(tokens))
+        return len(tokens)
+
+    def has_prefix(self, model: "Llama") -> bool:
+        entry = self._entries.get(id(model))
+        if entry is None:
+            return False
+        tokens = entry[0]
+        n = len(tokens)
+        return model.n_tokens >= n and list(model._input_ids[:n]) == tokens
+
+    def prepare(self, model: "Llama"):
+        """Make sure the replica's KV cache starts with the evaluated system prefix"""
+        entry = self._entries.get(id(model))
+        if entry is None or self.has_prefix(model):
+            return
+        model.load_state(entry[1])
+        PREFIX_CACHE_RESTORES.inc()
+
+    def forget(self, model: "Llama"):
+        self._entries.pop(id(model), None)
@@ -0,0 +1,103 @@
+from collections import Counter
+from typing import Dict, Optional, Tuple
+import os
+import sys
+import threading
+import time
+
+MODES = ("cpu", "wall")
+
+
+class ProfilerBusy(RuntimeError):
+    """Another profile is already being captured"""
+
+
+class SamplingProfiler:
+    """
+    In-process sampling profiler over every Python thread, output as collapsed stacks
+    ("thread;module:function;... weight" per line) for flamegraph.pl, inferno or speedscope.
+
+    `wall` counts one sample per thread per tick, idle waits included. `cpu` weights each
+    sample by the CPU time the thread used since the previous tick (microseconds, from
+    its pthread CPU clock), so threads blocked in queue.get / select do not show up.
+    Native frames are not resolved: time inside llama.cpp is attributed to the Python
+    frame that called it (e.g. Llama.eval). `lines` adds the line number to every frame
+    (module:function:line), which splits a function into one frame per call site.
+    """
+
+    def __init__(self, max_seconds: float = 300, max_depth: int = 128):
+        self.max_seconds = max_seconds
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def _stack(self, frame, lines: bool = False) -> str:
+        parts = []
+        while frame is not None and len(parts) < self.max_depth:
+            code = frame.f_code
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            parts.append(f"{module}:{code.co_name}:{frame.f_lineno}" if lines else f"{module}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(parts))
+
+    @staticmethod
+    def _cpu_time(ident: int) -> Optional[float]:
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(ident))
+        except (AttributeError, OSError):
+            return None
+
+    def profile(self, seconds: float, interval: float = 0.01, mode: str = "cpu", lines: bool = False) -> Tuple[Counter, dict]:
+        """Sample all threads for `seconds` (blocking). Returns (collapsed stacks -> weight, stats)"""
+        if mode not in MODES:
+            raise ValueError(f"Unknown profile mode {mode!r}, expected one of {MODES}")
+        seconds = min(seconds, self.max_seconds)
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            me = threading.get_ident()
+            stacks: Counter = Counter()
+            last_cpu: Dict[int, float] = {}
+            ticks = 0
+            start = time.perf_counter()
+            deadline = start + seconds
+            while time.perf_counter() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    weight = 1
+                    if mode == "cpu":
+                        cpu = self._cpu_time(ident)
+                        previous = last_cpu.get(ident)
+                        if cpu is not None:
+                            last_cpu[ident] = cpu
+                        if cpu is None or previous is None:
+                            continue  # Tick đầu tiên của thread chỉ lấy mốc CPU time
+                        weight = int((cpu - previous) * 1e6)
+                        if weight <= 0:
+                            continue
+                    stacks[f"{names.get(ident, ident)};{self._stack(frame, lines)}"] += weight
+                ticks += 1
+                time.sleep(interval)
+            stats = {
+                "mode": mode,
+                "seconds": round(time.perf_counter() - start, 3),
+                "interval": interval,
+                "ticks": ticks,
+                "stacks": len(stacks),
+                "unit": "cpu_microseconds" if mode == "cpu" else "samples",
+            }
+            return stacks, stats
+        finally:
+            self._lock.release()
+
+
+def collapsed(stacks: Counter) -> str:
+    return "".join(f"{stack} {weight}\n" for stack, weight in stacks.most_common())
+
+
+samplingProfiler = SamplingProfiler(max_seconds=float(os.getenv("PROFILE_MAX_SECONDS", "300")))
@@ -0,0 +1,209 @@
+from loguru import logger
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from .metrics import RESPONSE_CACHE_BYTES, RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_HITS, RESPONSE_CACHE_MISSES
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(message: str) -> str:
+    """NFC + casefold + collapse whitespace, so trivially different spellings share a key"""
+    text = unicodedata.normalize("NFC", message)
+    text = _WHITESPACE.sub(" ", text).strip().casefold()
+    return text
+
+
+def make_key(message: str, max_tokens: int, temperature: float, top_p: float, top_k: int,
+             model: Optional[str] = None) -> str:
+    payload = json.dumps(
+        {
+            "message": normalize_message(message),
+            "model": model,
+            "max_tokens": max_tokens,
+            "temperature": round(float(temperature), 4),
+            "top_p": round(float(top_p), 4),
+            "top_k": int(top_k),
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def replay_chunks(text: str, chunk_chars: int = 16) -> Iterator[str]:
+    """Split a cached answer into word-aligned chunks for /chat/stream replay"""
+    buf = ""
+    for word in re.split(r"(\s+)", text):
+        buf += word
+        if len(buf) >= chunk_chars:
+            yield buf
+            buf = ""
+    if buf:
+        yield buf
+
+
+class SQLiteCacheBackend:
+    """On-disk tier that survives restarts. Rows carry their own expiry."""
+
+    def __init__(self, path: str, max_entries: int = 100_000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return row[0], row[1]
+
+    def set(self, key: str, value: str, expires: float):
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, created, expires) VALUES (?, ?, ?, ?)",
+                (key, value, now, expires),
+            )
+            self._conn.execute("DELETE FROM response_cache WHERE expires < ?", (now,))
+            # Giữ tối đa max_entries dòng mới nhất
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE key NOT IN "
+                "(SELECT key FROM response_cache ORDER BY created DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """
+    In-memory LRU + TTL cache of full answers, bounded by entry count and bytes,
+    with an optional SQLite tier behind it.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 24 * 3600,
+        disk: Optional[SQLiteCacheBackend] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk = disk
+
+        self._entries: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _update_gauges(self):
+        RESPONSE_CACHE_ENTRIES.set(len(self._entries))
+        RESPONSE_CACHE_BYTES.set(self._bytes)
+
+    def _put_memory(self, key: str, value: str, expires: float):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[2]
+        self._entries[key] = (value, expires, size)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+        self._update_gauges()
+
+    def get(self, key: str, endpoint: str = "generate") -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires, size = entry
+                if expires >= time.time():
+                    self._entries.move_to_end(key)
+                    RESPONSE_CACHE_HITS.labels(endpoint=endpoint, tier="memory").inc()
+                    return value
+                del self._entries[key]
+                self._bytes -= size
+                self._update_gauges()
+
+        if self.disk is not None:
+            row = self.disk.get(key)
+            if row is not None:
+                value, expires = row
+                with self._lock:
+                    self._put_memory(key, value, expires)
+                RESPONSE_CACHE_HITS.labels(endpoint=endpoint, tier="disk").inc()
+                return value
+
+        RESPONSE_CACHE_MISSES.labels(endpoint=endpoint).inc()
+        return None
+
+    def set(self, key: str, value: str):
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._put_memory(key, value, expires)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value, expires)
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache disk write failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._update_gauges()
+        if self.disk is not None:
+            self.disk.clear()
+
+
+def _build_cache() -> Optional[ResponseCache]:
+    if os.getenv("RESPONSE_CACHE_ENABLED", "1") != "1":
+        return None
+    sqlite_path = os.getenv("RESPONSE_CACHE_SQLITE_PATH", "")
+    disk = SQLiteCacheBackend(sqlite_path) if sqlite_path else None
+    cache = ResponseCache(
+        max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024")),
+        max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600))),
+        disk=disk,
+    )
+    logger.info(f"Response cache enabled (disk={sqlite_path or 'off'})")
+    return cache
+
+
+responseCache = _build_cache()
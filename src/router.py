@@ -0,0 +1,432 @@
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from loguru import logger
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+from prometheus_client.parser import text_string_to_metric_families
+from typing import Awaitable, Callable, Dict, List, Optional
+import asyncio
+import functools
+import itertools
+import json
+import os
+
+import anyio
+import httpx
+
+from .metrics import ROUTER_INFLIGHT, ROUTER_REQUESTS, ROUTER_RETRIES, ROUTER_WORKERS_READY
+
+# Header hop-by-hop, không chuyển tiếp giữa router và worker
+_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length", "host", "upgrade"}
+
+
+# Metric của chính process router giữ lại cạnh metric cùng tên của worker (label worker="router")
+_PROCESS_METRIC_PREFIXES = ("process_", "python_")
+
+
+def _forward_headers(headers) -> Dict[str, str]:
+    return {k: v for k, v in headers.items() if k.lower() not in _HOP_HEADERS}
+
+
+class _Families:
+    """Collector over already-collected metric families, so generate_latest can render them"""
+
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+def _label_worker(family, worker: str):
+    family.samples = [s._replace(labels={**s.labels, "worker": worker}) for s in family.samples]
+    return family
+
+
+def merge_metrics(own, worker_texts: Dict[str, str]) -> bytes:
+    """
+    The router's own metric families plus every worker's /metrics, as one exposition.
+    Worker samples get a `worker` label. Application metrics the router only imports
+    (never records, e.g. model_loaded = 0) are dropped in favour of the workers' values.
+    """
+    merged: "OrderedDict[str, object]" = OrderedDict()
+    for worker, text in worker_texts.items():
+        for family in text_string_to_metric_families(text):
+            _label_worker(family, worker)
+            if family.name in merged:
+                merged[family.name].samples.extend(family.samples)
+            else:
+                merged[family.name] = family
+    for family in own:
+        if family.name not in merged:
+            merged[family.name] = family
+        elif family.name.startswith(_PROCESS_METRIC_PREFIXES):
+            merged[family.name].samples.extend(_label_worker(family, "router").samples)
+    registry = CollectorRegistry(auto_describe=False)
+    registry.register(_Families(list(merged.values())))
+    return generate_latest(registry)
+
+
+class _RelayResponse(StreamingResponse):
+    """StreamingResponse that runs `on_close` even when the body is never iterated"""
+
+    def __init__(self, *args, on_close: Callable[[], Awaitable[None]], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Client ngắt trước khi body được gửi / task bị huỷ: generator không chạy tới finally
+            with anyio.CancelScope(shield=True):
+                await self.on_close()
+
+
+class Worker:
+    """One inference process (src.main:app) listening on a Unix socket"""
+
+    def __init__(self, index: int, socket_path: str):
+        self.index = index
+        self.socket_path = socket_path
+        self.inflight = 0
+        self.ready = False
+        self.client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(uds=socket_path),
+            base_url="http://worker",
+            # Stream dài tới vài phút - chỉ giới hạn thời gian connect
+            timeout=httpx.Timeout(None, connect=5.0),
+        )
+
+    @property
+    def label(self) -> str:
+        return str(self.index)
+
+    async def probe(self) -> bool:
+        try:
+            self.ready = (await self.client.get("/ready", timeout=2.0)).status_code == 200
+        except httpx.HTTPError:
+            self.ready = False
+        return self.ready
+
+
+class Router:
+    """
+    Least-loaded dispatch over N worker processes, with stream proxying.
+
+    The router counts in-flight requests per worker itself (it sees every request) and
+    sends new ones to the ready worker with the fewest. Requests carrying a session_id
+    stick to the worker that holds the session's history and KV snapshot.
+    """
+
+    def __init__(
+        self,
+        workers: List[Worker],
+        admin_token: str = "",
+        watch_interval: float = 0,
+        max_sessions: int = 10000,
+        on_model_change: Optional[Callable[[str, Optional[str]], None]] = None,
+    ):
+        self.workers = workers
+        self.admin_token = admin_token
+        self.watch_interval = watch_interval
+        self.max_sessions = max_sessions
+        # serve.py khởi động lại worker chết với model hiện tại (sau hot swap)
+        self.on_model_change = on_model_change
+        self._affinity: "OrderedDict[str, int]" = OrderedDict()
+        self._rr = itertools.count()
+        self._swap_lock = asyncio.Lock()
+        self._tasks: List[asyncio.Task] = []
+
+    # ---- worker selection ----
+
+    def _ready(self) -> List[Worker]:
+        return [w for w in self.workers if w.ready]
+
+    def pick(self, session_id: Optional[str] = None, exclude: Optional[Worker] = None) -> Optional[Worker]:
+        ready = [w for w in self._ready() if w is not exclude]
+        if not ready:
+            return None
+        if session_id is not None:
+            index = self._affinity.get(session_id)
+            if index is not None and self.workers[index] in ready:
+                self._affinity.move_to_end(session_id)
+                return self.workers[index]
+        # Hoà nhau thì xoay vòng để không dồn hết vào worker 0
+        offset = next(self._rr)
+        worker = min(ready, key=lambda w: (w.inflight, (w.index - offset) % len(self.workers)))
+        if session_id is not None:
+            self._affinity[session_id] = worker.index
+            while len(self._affinity) > self.max_sessions:
+                self._affinity.popitem(last=False)
+        return worker
+
+    # ---- proxying ----
+
+    async def proxy(self, request: Request, session_id: Optional[str] = None, body: Optional[bytes] = None) -> Response:
+        if body is None:
+            body = await request.body()
+        worker = self.pick(session_id)
+        for attempt in range(2):
+            if worker is None:
+                return JSONResponse(status_code=503, content={"detail": "No inference worker ready"},
+                                    headers={"Retry-After": "1"})
+            upstream = worker.client.build_request(
+                request.method,
+                httpx.URL(path=request.url.path, query=request.url.query.encode("utf-8")),
+                headers=_forward_headers(request.headers),
+                content=body,
+            )
+            worker.inflight += 1
+            ROUTER_INFLIGHT.labels(worker=worker.label).inc()
+            try:
+                response = await worker.client.send(upstream, stream=True)
+            except httpx.TransportError as e:
+                # Worker chết / đang restart: request chưa tới worker nên thử worker khác
+                self._release(worker)
+                worker.ready = False
+                logger.warning(f"Worker {worker.index} unreachable: {e}")
+                ROUTER_RETRIES.inc()
+                worker = self.pick(session_id, exclude=worker)
+                continue
+            ROUTER_REQUESTS.labels(worker=worker.label).inc()
+            return _RelayResponse(
+                response.aiter_raw(),
+                status_code=response.status_code,
+                headers=_forward_headers(response.headers),
+                on_close=functools.partial(self._close, worker, response),
+            )
+        return JSONResponse(status_code=503, content={"detail": "No inference worker reachable"})
+
+    def _release(self, worker: Worker):
+        worker.inflight -= 1
+        ROUTER_INFLIGHT.labels(worker=worker.label).dec()
+
+    async def _close(self, worker: Worker, response: httpx.Response):
+        # Cũng chạy khi client ngắt kết nối: đóng upstream, worker tự huỷ generation
+        self._release(worker)
+        await response.aclose()
+
+    async def scrape(self) -> Dict[str, str]:
+        """/metrics text of every reachable worker, by worker label"""
+        responses = await self.broadcast("GET", "/metrics", timeout=5.0)
+        return {w.label: r.text for w, r in zip(self.workers, responses) if r is not None and r.status_code == 200}
+
+    async def broadcast(self, method: str, path: str, **kwargs) -> List[Optional[httpx.Response]]:
+        async def call(worker: Worker):
+            try:
+                return await worker.client.request(method, path, **kwargs)
+            except httpx.HTTPError as e:
+                logger.warning(f"Worker {worker.index} {method} {path} failed: {e}")
+                return None
+        return await asyncio.gather(*(call(w) for w in self.workers))
+
+    # ---- model swap ----
+
+    async def _swap_worker(self, worker: Worker, body: dict, headers: Dict[str, str]) -> dict:
+        try:
+            response = await worker.client.post("/api/v1/admin/model/swap", json=body, headers=headers)
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            return {"status": "failed", "reason": str(e)}
+
+    async def _roll_back(self, swapped: List[tuple], headers: Dict[str, str], results: List[dict]) -> bool:
+        """Put workers that already took the new model back on the model they served before"""
+        _, first = swapped[0]
+        body = {"version": first.get("previous_version")}
+        # File model cũ bị xoá sau swap nếu tải từ registry - khi đó tải lại theo version
+        if first.get("previous_model_path") and os.path.exists(first["previous_model_path"]):
+            body["model_path"] = first["previous_model_path"]
+        elif body["version"] is None:
+            logger.error("Rolling swap: previous model file is gone and has no registry version, cannot roll back")
+            return False
+
+        ok = True
+        for worker, _ in swapped:
+            result = await self._swap_worker(worker, body, headers)
+            results.append({"worker": worker.index, "rollback": True, **result})
+            if result.get("status") not in ("swapped", "unchanged"):
+                logger.error(f"Rolling swap: worker {worker.index} could not be rolled back: {result.get('reason')}")
+                ok = False
+            elif result.get("model_path"):
+                # Worker sau dùng đúng file worker trước đã khôi phục, không tải lại
+                body = {**body, "model_path": result["model_path"]}
+        return ok
+
+    async def rolling_swap(self, body: dict, headers: Dict[str, str]) -> dict:
+        """
+        Swap workers one at a time so N-1 keep serving. The first worker resolves the
+        version (latest by default); the others are pinned to it. At the first failure
+        or canary rollback, the workers already swapped are swapped back to the model
+        they served before, so the fleet ends on a single version. The status is "mixed"
+        if that rollback fails as well.
+        """
+        if self._swap_lock.locked():
+            return {"status": "in_progress"}
+        async with self._swap_lock:
+            results = []
+            swapped = []
+            status = "unchanged"
+            for worker in self.workers:
+                result = await self._swap_worker(worker, body, headers)
+                results.append({"worker": worker.index, **result})
+                if result.get("status") not in ("swapped", "unchanged"):
+                    status = result.get("status", "failed")
+                    if swapped and not await self._roll_back(swapped, headers, results):
+                        status = "mixed"
+                    break
+                if result.get("status") == "swapped":
+                    status = "swapped"
+                    swapped.append((worker, result))
+                # Các worker sau dùng đúng version worker đầu đã resolve
+                if result.get("version"):
+                    body = {**body, "version": result["version"]}
+                    if result.get("model_path") and not body.get("model_path"):
+                        body["model_path"] = result["model_path"]
+            if status == "swapped" and self.on_model_change is not None:
+                self.on_model_change(body["model_path"], body.get("version"))
+            return {"status": status, "workers": results}
+
+    async def _watch(self):
+        headers = {"X-Admin-Token": self.admin_token}
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                result = await self.rolling_swap({}, headers)
+                if result["status"] not in ("unchanged", "in_progress"):
+                    logger.info(f"Registry watch: rolling swap {result['status']}")
+            except Exception as e:
+                logger.warning(f"Registry watch failed: {e}")
+
+    # ---- health ----
+
+    async def _probe_loop(self, interval: float = 1.0):
+        while True:
+            await asyncio.gather(*(w.probe() for w in self.workers))
+            ROUTER_WORKERS_READY.set(len(self._ready()))
+            await asyncio.sleep(interval)
+
+    def start(self):
+        self._tasks.append(asyncio.create_task(self._probe_loop()))
+        if self.watch_interval > 0 and self.admin_token:
+            logger.info(f"Router watching model registry every {self.watch_interval:.0f}s")
+            self._tasks.append(asyncio.create_task(self._watch()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for worker in self.workers:
+            await worker.client.aclose()
+
+
+def _session_id(body: bytes) -> Optional[str]:
+    """session_id of a JSON chat request, for sticky routing"""
+    if not body or b"session_id" not in body:
+        return None
+    try:
+        value = json.loads(body).get("session_id")
+    except (ValueError, AttributeError):
+        return None
+    return value if isinstance(value, str) else None
+
+
+def create_app(router: Router, on_shutdown: Optional[Callable[[], None]] = None) -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        router.start()
+        yield
+        await router.stop()
+        if on_shutdown is not None:
+            on_shutdown()
+
+    app = FastAPI(title="QA Chatbot Router", lifespan=lifespan, docs_url=None, redoc_url=None, openapi_url=None)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy", "service": "qa-chatbot-router", "workers": len(router.workers)}
+
+    @app.get("/ready")
+    async def ready():
+        workers = [{"worker": w.index, "ready": w.ready, "inflight": w.inflight} for w in router.workers]
+        body = {"status": "ready" if router._ready() else "starting", "workers": workers}
+        return JSONResponse(status_code=200 if router._ready() else 503, content=body)
+
+    @app.get("/metrics")
+    async def metrics():
+        # Metric inference / cache / admission nằm trong từng worker: gộp lại, label worker
+        return Response(merge_metrics(REGISTRY.collect(), await router.scrape()), media_type=CONTENT_TYPE_LATEST)
+
+    @app.get("/workers/{index}/metrics")
+    async def worker_metrics(index: int):
+        if not 0 <= index < len(router.workers):
+            return JSONResponse(status_code=404, content={"detail": "Unknown worker"})
+        try:
+            upstream = await router.workers[index].client.get("/metrics")
+        except httpx.HTTPError as e:
+            return JSONResponse(status_code=503, content={"detail": str(e)})
+        return Response(upstream.content, media_type=upstream.headers.get("content-type"))
+
+    @app.post("/workers/{index}/admin/profile")
+    async def worker_profile(index: int, request: Request):
+        # /api/v1/admin/profile qua router rơi vào worker bất kỳ - route này chọn đúng worker
+        if not 0 <= index < len(router.workers):
+            return JSONResponse(status_code=404, content={"detail": "Unknown worker"})
+        headers = {k: v for k, v in request.headers.items() if k.lower() == "x-admin-token"}
+        try:
+            upstream = await router.workers[index].client.post(
+                "/api/v1/admin/profile", params=request.query_params, headers=headers
+            )
+        except httpx.HTTPError as e:
+            return JSONResponse(status_code=503, content={"detail": str(e)})
+        return Response(upstream.content, status_code=upstream.status_code,
+                        media_type=upstream.headers.get("content-type"), headers=_forward_headers(upstream.headers))
+
+    @app.get("/api/v1/model/status")
+    async def model_status():
+        responses = await router.broadcast("GET", "/api/v1/model/status")
+        return {"workers": [
+            {"worker": w.index, **(r.json() if r is not None and r.status_code == 200 else {"error": "unreachable"})}
+            for w, r in zip(router.workers, responses)
+        ]}
+
+    @app.delete("/api/v1/generations/{generation_id}")
+    async def cancel_generation(generation_id: str):
+        # Generation id chỉ worker đang chạy nó biết - gửi cho tất cả
+        responses = await router.broadcast("DELETE", f"/api/v1/generations/{generation_id}")
+        for response in responses:
+            if response is not None and response.status_code == 200:
+                return response.json()
+        return JSONResponse(status_code=404, content={"detail": "Generation not found or already finished"})
+
+    @app.api_route("/api/v1/sessions/{session_id}", methods=["GET", "DELETE"])
+    async def session(session_id: str, request: Request):
+        return await router.proxy(request, session_id=session_id)
+
+    @app.post("/api/v1/admin/model/swap")
+    async def swap(request: Request):
+        headers = {k: v for k, v in request.headers.items() if k.lower() == "x-admin-token"}
+        try:
+            body = await request.json()
+        except ValueError:
+            body = {}
+        result = await router.rolling_swap(body if isinstance(body, dict) else {}, headers)
+        status_code = {"swapped": 200, "unchanged": 200, "in_progress": 409, "mixed": 500}.get(result["status"], 422)
+        return JSONResponse(status_code=status_code, content=result)
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
+    async def forward(path: str, request: Request):
+        body = await request.body()
+        return await router.proxy(request, session_id=_session_id(body), body=body)
+
+    return app
+
+
+def build_router(socket_paths: List[str], on_model_change=None) -> Router:
+    return Router(
+        [Worker(i, path) for i, path in enumerate(socket_paths)],
+        admin_token=os.getenv("ADMIN_TOKEN", ""),
+        watch_interval=float(os.getenv("MODEL_WATCH_INTERVAL", "0")),
+        max_sessions=int(os.getenv("SESSION_MAX", "1000")) * max(1, len(socket_paths)),
+        on_model_change=on_model_change,
+    )
@@ -0,0 +1,92 @@
+from loguru import logger
+from typing import Any, Callable, Dict, Optional
+import json
+import math
+import os
+import platform
+
+RUNTIME_CONFIG_PATH = os.getenv("MODEL_RUNTIME_CONFIG", "./runtime_config.json")
+
+# Tên KV cache type trong file config -> ggml_type của llama.cpp
+KV_CACHE_TYPES = {"f32": 0, "f16": 1, "q4_0": 2, "q4_1": 3, "q5_0": 6, "q5_1": 7, "q8_0": 8}
+
+
+def available_cpus() -> int:
+    """CPUs this process may use: affinity mask, capped by the cgroup CPU quota"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def _cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or "unknown"
+
+
+def node_type() -> str:
+    """Key of this node's profile: architecture, CPU model and usable CPUs"""
+    return f"{platform.machine()}/{_cpu_model()}/{available_cpus()}cpu"
+
+
+def load_runtime_profile(path: str = RUNTIME_CONFIG_PATH) -> Dict[str, Any]:
+    """
+    Tuned llama.cpp settings for this node from scripts/tune_llama.py output.
+
+    The file holds one profile per node type; falls back to the "default" profile,
+    or {} when the file or a matching profile is missing.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            profiles = json.load(f).get("profiles", {})
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning(f"Ignoring runtime config {path}: {e}")
+        return {}
+
+    key = node_type()
+    name = key if key in profiles else "default" if "default" in profiles else None
+    if name is None:
+        logger.info(f"No runtime profile for node type {key} in {path}, using defaults")
+        return {}
+    logger.info(f"Using runtime profile {name} from {path}")
+    return {"name": name, **profiles[name]}
+
+
+def env(name: str, default: Any, cast: Callable[[Any], Any] = int) -> Any:
+    """Env var cast with `cast`; empty counts as unset (helm renders unset chart values as "")"""
+    value = os.getenv(name)
+    return cast(value) if value else default
+
+
+def setting(profile: Dict[str, Any], key: str, env_name: str, default: Any, cast: Callable[[Any], Any] = int) -> Any:
+    """Explicit env var > tuned profile > default (an empty env var counts as unset)"""
+    value = os.getenv(env_name)
+    if value:
+        return cast(value)
+    value = profile.get("llama", {}).get(key)
+    return default if value is None else cast(value)
+
+
+def as_bool(value: Any) -> bool:
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def kv_cache_type(value: Any) -> Optional[int]:
+    if value is None or isinstance(value, int):
+        return value
+    if value not in KV_CACHE_TYPES:
+        raise ValueError(f"Unknown KV cache type {value!r} (expected one of {', '.join(KV_CACHE_TYPES)})")
+    return KV_CACHE_TYPES[value]
@@ -0,0 +1,300 @@
+from loguru import logger
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from .metrics import SEMANTIC_CACHE_ENTRIES, SEMANTIC_CACHE_HITS, SEMANTIC_CACHE_MISSES, SEMANTIC_CACHE_SIMILARITY
+from .response_cache import normalize_message
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+class LlamaEmbedder:
+    """Sentence embeddings from a GGUF in embedding mode (mean pooled, L2 normalized)"""
+
+    def __init__(self, model_path: str, n_threads: int = 2, n_ctx: int = 512):
+        self.model_path = model_path
+        self.n_threads = n_threads
+        self.n_ctx = n_ctx
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        import llama_cpp
+
+        logger.info(f"Loading embedding model from: {self.model_path}")
+        self._model = llama_cpp.Llama(
+            model_path=self.model_path,
+            embedding=True,
+            pooling_type=llama_cpp.LLAMA_POOLING_TYPE_MEAN,
+            n_ctx=self.n_ctx,
+            n_threads=self.n_threads,
+            use_mmap=True,
+            verbose=False,
+        )
+
+    def embed(self, text: str) -> np.ndarray:
+        with self._lock:
+            if self._model is None:
+                self._load()
+            vector = np.asarray(self._model.embed(text, normalize=True, truncate=True), dtype=np.float32)
+        return vector.reshape(-1)
+
+
+class SemanticIndex:
+    """
+    Bounded question→answer vector index.
+
+    Exact cosine search is NumPy brute force over a preallocated matrix; when hnswlib
+    is installed and the index is large, an HNSW graph is used for candidates and the
+    result is re-scored exactly. Full index evicts the least recently used row.
+    """
+
+    def __init__(self, dim: int, max_entries: int = 5000, use_ann: bool = True, ann_min_entries: int = 2000):
+        self.dim = dim
+        self.max_entries = max_entries
+        self.ann_min_entries = ann_min_entries
+
+        self.vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self.questions: List[str] = []
+        self.answers: List[str] = []
+        self.params: List[str] = []
+        self.last_used = np.zeros(max_entries, dtype=np.float64)
+
+        self._ann = None
+        if use_ann and hnswlib is not None:
+            self._ann = hnswlib.Index(space="ip", dim=dim)
+            self._ann.init_index(max_elements=max_entries, ef_construction=100, M=16)
+            self._ann.set_ef(64)
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def add(self, vector: np.ndarray, question: str, answer: str, params_key: str):
+        n = len(self.questions)
+        if n < self.max_entries:
+            row = n
+            self.questions.append(question)
+            self.answers.append(answer)
+            self.params.append(params_key)
+        else:
+            row = int(np.argmin(self.last_used[:n]))
+            self.questions[row] = question
+            self.answers[row] = answer
+            self.params[row] = params_key
+
+        self.vectors[row] = vector
+        self.last_used[row] = time.time()
+        if self._ann is not None:
+            # hnswlib cập nhật vector nếu label đã tồn tại
+            self._ann.add_items(vector.reshape(1, -1), np.array([row]))
+
+    def _candidates(self, vector: np.ndarray) -> np.ndarray:
+        n = len(self.questions)
+        if self._ann is not None and n >= self.ann_min_entries:
+            labels, _ = self._ann.knn_query(vector.reshape(1, -1), k=min(16, n))
+            return labels[0].astype(np.int64)
+        return np.arange(n)
+
+    def search(self, vector: np.ndarray, params_key: str) -> Optional[Tuple[int, float]]:
+        """Best row with matching generation params, as (row, cosine similarity)"""
+        if not self.questions:
+            return None
+        rows = self._candidates(vector)
+        scores = self.vectors[rows] @ vector
+        mask = np.fromiter((self.params[r] == params_key for r in rows), dtype=bool, count=len(rows))
+        if not mask.any():
+            return None
+        scores = np.where(mask, scores, -np.inf)
+        best = int(np.argmax(scores))
+        return int(rows[best]), float(scores[best])
+
+    def touch(self, row: int):
+        self.last_used[row] = time.time()
+
+    def save(self, directory: str):
+        """
+        Write to temp files, then rename over the old ones. entries.json carries the
+        checksum of its vectors, so a crash between the two renames is caught by load().
+        """
+        os.makedirs(directory, exist_ok=True)
+        n = len(self.questions)
+        vectors = np.ascontiguousarray(self.vectors[:n])
+        vectors_path = os.path.join(directory, "vectors.npy")
+        entries_path = os.path.join(directory, "entries.json")
+        suffix = f".tmp-{os.getpid()}"
+        with open(vectors_path + suffix, "wb") as f:
+            np.save(f, vectors)
+        with open(entries_path + suffix, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "dim": self.dim,
+                    "questions": self.questions,
+                    "answers": self.answers,
+                    "params": self.params,
+                    "last_used": self.last_used[:n].tolist(),
+                    "vectors_sha256": hashlib.sha256(vectors.tobytes()).hexdigest(),
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(vectors_path + suffix, vectors_path)
+        os.replace(entries_path + suffix, entries_path)
+
+    def load(self, directory: str) -> bool:
+        """Restore a saved index; a missing, truncated or mismatched pair of files loads nothing"""
+        vectors_path = os.path.join(directory, "vectors.npy")
+        entries_path = os.path.join(directory, "entries.json")
+        if not (os.path.exists(vectors_path) and os.path.exists(entries_path)):
+            return False
+        try:
+            with open(entries_path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data["dim"] != self.dim:
+                logger.warning("Semantic cache on disk has a different embedding size, ignoring it")
+                return False
+            vectors = np.load(vectors_path)
+            n = len(data["questions"])
+            if vectors.shape != (n, self.dim) or not (len(data["answers"]) == len(data["params"]) == len(data["last_used"]) == n):
+                raise ValueError("entries do not match vectors")
+            if hashlib.sha256(np.ascontiguousarray(vectors).tobytes()).hexdigest() != data.get("vectors_sha256"):
+                raise ValueError("vectors checksum mismatch")
+        except (ValueError, OSError, IndexError, KeyError, TypeError) as e:
+            logger.warning(f"Semantic cache on disk is unreadable ({e}), starting empty")
+            return False
+
+        # Giữ các entry dùng gần nhất nếu file lớn hơn max_entries hiện tại
+        order = np.argsort(data["last_used"])[::-1][:self.max_entries]
+        for i in sorted(order, key=lambda i: data["last_used"][i]):
+            self.add(vectors[i], data["questions"][i], data["answers"][i], data["params"][i])
+            self.last_used[len(self.questions) - 1] = data["last_used"][i]
+        return True
+
+
+class SemanticCache:
+    """Near-duplicate lookup for paraphrased questions, in front of ChatService"""
+
+    def __init__(
+        self,
+        embedder: LlamaEmbedder,
+        threshold: float = 0.92,
+        max_entries: int = 5000,
+        persist_dir: Optional[str] = None,
+        use_ann: bool = True,
+        save_every: int = 50,
+    ):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.persist_dir = persist_dir
+        self.use_ann = use_ann
+        self.save_every = save_every
+
+        self.index: Optional[SemanticIndex] = None
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        # Embedding chạy trên thread riêng, không chiếm inference executor
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding")
+
+    def _ensure_index(self, dim: int):
+        if self.index is None:
+            self.index = SemanticIndex(dim, self.max_entries, use_ann=self.use_ann)
+            if self.persist_dir and self.index.load(self.persist_dir):
+                logger.info(f"Loaded {len(self.index)} semantic cache entries from {self.persist_dir}")
+            SEMANTIC_CACHE_ENTRIES.set(len(self.index))
+
+    def lookup(self, message: str, params_key: str) -> Tuple[Optional[str], np.ndarray]:
+        """Returns (answer or None, question embedding) so a miss can be stored without re-embedding"""
+        vector = self.embedder.embed(normalize_message(message))
+        with self._lock:
+            self._ensure_index(vector.shape[0])
+            result = self.index.search(vector, params_key)
+            if result is not None:
+                row, similarity = result
+                SEMANTIC_CACHE_SIMILARITY.observe(similarity)
+                if similarity >= self.threshold:
+                    self.index.touch(row)
+                    SEMANTIC_CACHE_HITS.inc()
+                    return self.index.answers[row], vector
+        SEMANTIC_CACHE_MISSES.inc()
+        return None, vector
+
+    def store(self, message: str, answer: str, params_key: str, vector: Optional[np.ndarray] = None):
+        if vector is None:
+            vector = self.embedder.embed(normalize_message(message))
+        with self._lock:
+            self._ensure_index(vector.shape[0])
+            self.index.add(vector, message, answer, params_key)
+            SEMANTIC_CACHE_ENTRIES.set(len(self.index))
+            self._unsaved += 1
+            if self.persist_dir and self._unsaved >= self.save_every:
+                self._save_locked()
+
+    def _save_locked(self):
+        if self.index is None or not self.persist_dir:
+            return
+        try:
+            self.index.save(self.persist_dir)
+            self._unsaved = 0
+        except OSError as e:
+            logger.warning(f"Could not persist semantic cache: {e}")
+
+    def save(self):
+        with self._lock:
+            self._save_locked()
+
+    def clear(self):
+        """Drop every entry (model swap); the empty index is persisted so a restart does not reload them"""
+        with self._lock:
+            if self.index is not None:
+                self.index = SemanticIndex(self.index.dim, self.max_entries, use_ann=self.use_ann)
+                self._save_locked()
+            elif self.persist_dir:
+                for name in ("vectors.npy", "entries.json"):
+                    path = os.path.join(self.persist_dir, name)
+                    if os.path.exists(path):
+                        os.remove(path)
+            SEMANTIC_CACHE_ENTRIES.set(0)
+
+    async def alookup(self, message: str, params_key: str) -> Tuple[Optional[str], np.ndarray]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.lookup, message, params_key)
+
+    async def astore(self, message: str, answer: str, params_key: str, vector: Optional[np.ndarray] = None):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.store, message, answer, params_key, vector)
+
+    def shutdown(self):
+        self.save()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _build_cache() -> Optional[SemanticCache]:
+    if os.getenv("SEMANTIC_CACHE_ENABLED", "0") != "1":
+        return None
+    embedder = LlamaEmbedder(
+        model_path=os.getenv("SEMANTIC_CACHE_EMBEDDING_MODEL", "./gguf_model.gguf"),
+        n_threads=int(os.getenv("SEMANTIC_CACHE_THREADS", "2")),
+    )
+    cache = SemanticCache(
+        embedder,
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+        max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000")),
+        persist_dir=os.getenv("SEMANTIC_CACHE_DIR", "./semantic_cache") or None,
+        use_ann=os.getenv("SEMANTIC_CACHE_ANN", "1") == "1",
+    )
+    logger.info(f"Semantic cache enabled (threshold={cache.threshold}, ann={'hnswlib' if hnswlib and cache.use_ann else 'off'})")
+    return cache
+
+
+semanticCache = _build_cache()
@@ -0,0 +1,150 @@
+"""
+Multi-process serving: N inference workers behind a least-loaded router.
+
+    python -m src.serve --workers 4 --port 8000
+
+Every worker is a separate `uvicorn src.main:app` process on a Unix socket with its
+own llama.cpp context(s). The GGUF is mmap'd, so all workers share one copy of the
+weights in the page cache; tokenization, JSON and SSE framing run on N GILs instead
+of one. MODEL_THREADS and MODEL_THREADS_BATCH (or the tuned runtime profile) are split
+across workers. Dead workers are restarted.
+"""
+from loguru import logger
+from typing import List, Optional
+import argparse
+import os
+import subprocess
+import sys
+import threading
+
+import uvicorn
+
+from .router import build_router, create_app
+from .runtime_config import env, load_runtime_profile, setting
+
+
+class WorkerProcess:
+    def __init__(self, index: int, app: str, socket_path: str, env: dict):
+        self.index = index
+        self.app = app
+        self.socket_path = socket_path
+        self.env = env
+        self.proc: Optional[subprocess.Popen] = None
+        self.restarts = 0
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", self.app, "--uds", self.socket_path, "--log-level", "warning"],
+            env=self.env,
+        )
+        logger.info(f"Started worker {self.index} (pid {self.proc.pid}) on {self.socket_path}")
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self, timeout: float = 10):
+        if not self.alive:
+            return
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+class Supervisor:
+    """Spawns the worker processes and restarts any that exit"""
+
+    def __init__(self, workers: int, app: str, socket_dir: str, threads: int, replicas: int,
+                 threads_batch: Optional[int] = None):
+        os.makedirs(socket_dir, exist_ok=True)
+        threads_per_worker = max(1, threads // workers)
+        # Rỗng: semantic cache không persist
+        semantic_dir = os.getenv("SEMANTIC_CACHE_DIR", "./semantic_cache")
+        self.processes: List[WorkerProcess] = []
+        for i in range(workers):
+            env = dict(os.environ)
+            env.update(
+                INSTANCE_ID=f"{os.getenv('INSTANCE_ID', 'instance')}-w{i}",
+                MODEL_THREADS=str(threads_per_worker),
+                MODEL_REPLICAS=str(replicas),
+                # Router điều phối swap lần lượt từng worker, worker không tự poll registry
+                MODEL_WATCH_INTERVAL="0",
+                SESSION_STATE_DIR=os.path.join(os.getenv("SESSION_STATE_DIR", "./session_states"), f"w{i}"),
+                # Mỗi worker ghi index riêng, không đè / làm hỏng file của worker khác
+                SEMANTIC_CACHE_DIR=os.path.join(semantic_dir, f"w{i}") if semantic_dir else "",
+            )
+            if threads_batch:
+                env["MODEL_THREADS_BATCH"] = str(max(1, threads_batch // workers))
+            self.processes.append(WorkerProcess(i, app, os.path.join(socket_dir, f"worker-{i}.sock"), env))
+        self._stopping = threading.Event()
+
+    @property
+    def socket_paths(self) -> List[str]:
+        return [p.socket_path for p in self.processes]
+
+    def set_model(self, model_path: str, version: Optional[str]):
+        """Worker restart sau hot swap phải load model mới, không phải model trong image"""
+        for p in self.processes:
+            p.env["MODEL_PATH"] = model_path
+            if version:
+                p.env["MODEL_VERSION"] = version
+
+    def start(self):
+        for p in self.processes:
+            p.start()
+        threading.Thread(target=self._watch, name="supervisor", daemon=True).start()
+
+    def _watch(self, interval: float = 1.0):
+        while not self._stopping.wait(interval):
+            for p in self.processes:
+                if not p.alive and not self._stopping.is_set():
+                    p.restarts += 1
+                    logger.warning(f"Worker {p.index} exited with {p.proc.returncode}, restarting (#{p.restarts})")
+                    p.start()
+
+    def stop(self):
+        self._stopping.set()
+        for p in self.processes:
+            if p.alive:
+                p.proc.terminate()
+        for p in self.processes:
+            p.stop()
+            if os.path.exists(p.socket_path):
+                os.remove(p.socket_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=env("SERVE_WORKERS", 2))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--app", default="src.main:app", help="ASGI app each worker runs")
+    parser.add_argument("--socket-dir", default=os.getenv("SERVE_SOCKET_DIR", "/tmp/qa-chatbot"))
+    profile = load_runtime_profile()
+    parser.add_argument("--threads", type=int, default=setting(profile, "n_threads", "MODEL_THREADS", 8),
+                        help="Total llama.cpp threads, split across workers")
+    parser.add_argument("--threads-batch", type=int,
+                        default=setting(profile, "n_threads_batch", "MODEL_THREADS_BATCH", None),
+                        help="Total llama.cpp prefill threads, split across workers")
+    parser.add_argument("--replicas", type=int, default=env("MODEL_REPLICAS", 1),
+                        help="Model replicas inside each worker")
+    args = parser.parse_args(argv)
+
+    supervisor = Supervisor(args.workers, args.app, args.socket_dir, args.threads, args.replicas, args.threads_batch)
+    supervisor.start()
+    router = build_router(supervisor.socket_paths, on_model_change=supervisor.set_model)
+
+    # Dừng worker trong lifespan của router: uvicorn raise lại SIGTERM sau khi shutdown,
+    # code sau uvicorn.run không chắc được chạy
+    try:
+        uvicorn.run(create_app(router, on_shutdown=supervisor.stop), host=args.host, port=args.port, log_level="info")
+    finally:
+        supervisor.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+from collections import OrderedDict
+from loguru import logger
+from typing import List, Optional
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+from .dto import MessageDTO, ModelTypeDTO
+from .metrics import SESSION_ACTIVE, SESSION_STATE_BYTES, SESSION_STATE_RESTORES, SESSION_STATE_SPILLS
+
+
+def state_nbytes(state) -> int:
+    """Approximate resident size of a llama.cpp state snapshot"""
+    size = int(getattr(state, "llama_state_size", 0) or 0)
+    for attr in ("scores", "input_ids"):
+        nbytes = getattr(getattr(state, attr, None), "nbytes", None)
+        if nbytes:
+            size += int(nbytes)
+    return size
+
+
+def state_tokens(state) -> List[int]:
+    """Tokens the snapshot's KV cache was built from"""
+    return [int(t) for t in state.input_ids[:state.n_tokens]]
+
+
+class Session:
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.history: List[MessageDTO] = []
+        self.state = None
+        self.state_bytes = 0
+        self.spilled = False
+        self.last_used = time.time()
+        # Index message đầu tiên còn nằm trong context window (các lượt cũ hơn đã bị cắt)
+        self.window_start = 0
+
+
+class SessionStore:
+    """
+    Server-side chat history plus one llama.cpp state snapshot per session.
+
+    Snapshots are kept in memory in LRU order under `memory_budget` bytes; the least
+    recently used ones are pickled to `spill_dir` and loaded back on the next turn.
+    Sessions idle for longer than `ttl` are dropped together with their spill file.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int = 1024 * 1024 * 1024,
+        spill_dir: Optional[str] = "./session_states",
+        ttl: float = 3600,
+        max_sessions: int = 1000,
+    ):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _update_gauges(self):
+        SESSION_ACTIVE.set(len(self._sessions))
+        SESSION_STATE_BYTES.set(self._bytes)
+
+    def _spill_path(self, session_id: str) -> str:
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.spill_dir, f"{name}.state")
+
+    def _drop_state(self, session: Session):
+        if session.state is not None:
+            self._bytes -= session.state_bytes
+        session.state = None
+        session.state_bytes = 0
+        if session.spilled:
+            session.spilled = False
+            try:
+                os.remove(self._spill_path(session.id))
+            except OSError:
+                pass
+
+    def _expire(self):
+        now = time.time()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+            self._drop_state(session)
+
+    def _victims(self) -> list:
+        """Pick LRU snapshots to move out of memory until we are under budget"""
+        victims = []
+        for session in self._sessions.values():
+            if self._bytes <= self.memory_budget:
+                break
+            if session.state is None:
+                continue
+            victims.append((session, session.state))
+            self._bytes -= session.state_bytes
+            session.state = None
+            session.state_bytes = 0
+            session.spilled = bool(self.spill_dir)
+        return victims
+
+    def _spill(self, victims):
+        # Ghi đĩa ngoài lock - snapshot có thể lớn hàng trăm MB
+        if not victims or not self.spill_dir:
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        for session, state in victims:
+            try:
+                with open(self._spill_path(session.id), "wb") as f:
+                    pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                SESSION_STATE_SPILLS.inc()
+            except OSError as e:
+                logger.warning(f"Failed to spill session state {session.id}: {e}")
+                session.spilled = False
+
+    def _touch(self, session_id: str) -> Session:
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = Session(session_id)
+            self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        session.last_used = time.time()
+        return session
+
+    def history(self, session_id: str, create: bool = True) -> Optional[List[MessageDTO]]:
+        """Messages of previous turns; None if the session is unknown and `create` is False"""
+        with self._lock:
+            self._expire()
+            if not create and session_id not in self._sessions:
+                return None
+            history = list(self._touch(session_id).history)
+            self._update_gauges()
+            return history
+
+    def window_start(self, session_id: str) -> int:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session.window_start if session is not None else 0
+
+    def set_window_start(self, session_id: str, start: int):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.window_start = start
+
+    def append_turn(self, session_id: str, user_message: str, answer: str):
+        with self._lock:
+            session = self._touch(session_id)
+            session.history.append(MessageDTO(role=ModelTypeDTO.USER, content=user_message))
+            session.history.append(MessageDTO(role=ModelTypeDTO.ASSISTANT, content=answer))
+
+    def snapshot(self, session_id: str):
+        """KV state saved after the session's last turn, loaded back from disk if it was spilled"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if session.state is not None:
+                SESSION_STATE_RESTORES.labels(tier="memory").inc()
+                return session.state
+            if not session.spilled:
+                return None
+            path = self._spill_path(session_id)
+
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"Failed to load spilled session state {session_id}: {e}")
+            return None
+
+        SESSION_STATE_RESTORES.labels(tier="disk").inc()
+        self.save_state(session_id, state)
+        return state
+
+    def save_state(self, session_id: str, state):
+        size = state_nbytes(state)
+        with self._lock:
+            session = self._touch(session_id)
+            self._drop_state(session)
+            session.state = state
+            session.state_bytes = size
+            self._bytes += size
+            # Snapshot lớn hơn cả budget sẽ bị spill ngay trong _victims
+            victims = self._victims()
+            self._update_gauges()
+        self._spill(victims)
+
+    def drop_states(self):
+        """Forget every KV snapshot but keep histories (the model they were built with is gone)"""
+        with self._lock:
+            for session in self._sessions.values():
+                self._drop_state(session)
+            self._update_gauges()
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return False
+            self._drop_state(session)
+            self._update_gauges()
+            return True
+
+
+def _build_store() -> SessionStore:
+    return SessionStore(
+        memory_budget=int(os.getenv("SESSION_STATE_MEMORY_BYTES", str(1024 * 1024 * 1024))),
+        spill_dir=os.getenv("SESSION_STATE_DIR", "./session_states") or None,
+        ttl=float(os.getenv("SESSION_TTL", "3600")),
+        max_sessions=int(os.getenv("SESSION_MAX", "1000")),
+    )
+
+
+sessionStore = _build_store()
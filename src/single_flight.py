@@ -0,0 +1,161 @@
+from loguru import logger
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import os
+import threading
+
+from .generations import generationRegistry
+from .instrumentation import GenerationTracker
+from .metrics import SINGLE_FLIGHT_DEDUPLICATED
+
+
+class Flight:
+    """
+    One running generation shared by every request with the same key.
+
+    Pieces are kept for the life of the flight, so a subscriber that joins late gets
+    the prefix replayed in one chunk and then follows the live stream.
+    """
+
+    def __init__(self, key: str, max_tokens: int):
+        self.key = key
+        # Generation thật (chạy trên model); mỗi subscriber có Generation riêng để huỷ
+        self.generation = generationRegistry.start(max_tokens)
+        self.tracker = GenerationTracker()
+        self.pieces: List[str] = []
+        self.subscribers = 1
+        self.done = False
+        self.error: Optional[str] = None
+        self.start_error: Optional[Exception] = None
+        self.task: Optional[asyncio.Task] = None
+        self._started = asyncio.Event()
+        self._wakeup = asyncio.Event()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.pieces)
+
+    @property
+    def completed(self) -> bool:
+        """Finished the whole answer (not cancelled, no error)"""
+        return self.done and self.error is None and not self.generation.cancelled
+
+    def started(self):
+        """The producer holds a model slot"""
+        self._started.set()
+
+    async def wait_started(self):
+        """Wait until the flight has a model slot; re-raises its admission rejection"""
+        await self._started.wait()
+        if self.start_error is not None:
+            raise self.start_error
+
+    def publish(self, piece: str):
+        self.pieces.append(piece)
+        self._wake()
+
+    def _wake(self):
+        wakeup, self._wakeup = self._wakeup, asyncio.Event()
+        wakeup.set()
+
+    def close(self, error: Optional[Exception] = None):
+        if not self._started.is_set():
+            # CancelledError (huỷ khi còn xếp hàng) không ném lại cho subscriber
+            self.start_error = error if isinstance(error, Exception) else RuntimeError("Generation did not start")
+            self._started.set()
+        elif error is not None:
+            self.error = str(error)
+        self.done = True
+        self._wake()
+
+    async def stream(self, cancel_event: Optional[threading.Event] = None) -> AsyncIterator[str]:
+        """Replay buffered pieces, then follow the live ones until the flight ends"""
+        sent = 0
+        while cancel_event is None or not cancel_event.is_set():
+            if sent < len(self.pieces):
+                # Subscriber đến muộn: gửi cả phần đã sinh trong một chunk
+                end = len(self.pieces)
+                yield self.pieces[sent] if end == sent + 1 else "".join(self.pieces[sent:end])
+                sent = end
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise RuntimeError(self.error)
+                return
+            await self._wakeup.wait()
+
+
+class SingleFlight:
+    """
+    In-flight request coalescing: identical requests (same normalized prompt and
+    sampling params, i.e. the response cache key) share one generation instead of each
+    starting their own. The flight is cancelled once every subscriber has left.
+
+    Only deterministic generations (temperature 0) are coalesced unless `sampled` is
+    set: otherwise every request would silently get the same sampled answer.
+    """
+
+    def __init__(self, sampled: bool = False):
+        self.sampled = sampled
+        self._flights: Dict[str, Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def coalesces(self, temperature: float) -> bool:
+        """Whether identical requests sampled at `temperature` may share one flight"""
+        return temperature <= 0 or self.sampled
+
+    def acquire(
+        self,
+        key: str,
+        max_tokens: int,
+        produce: Callable[[Flight], Awaitable[None]],
+        endpoint: str,
+    ) -> Tuple[Flight, bool]:
+        """(flight, leader): join the running flight for `key`, or start `produce` as a new one"""
+        flight = self._flights.get(key)
+        if flight is not None and not flight.done and not flight.generation.cancelled:
+            flight.subscribers += 1
+            SINGLE_FLIGHT_DEDUPLICATED.labels(endpoint=endpoint).inc()
+            return flight, False
+
+        flight = Flight(key, max_tokens)
+        self._flights[key] = flight
+        flight.task = asyncio.create_task(self._run(flight, produce))
+        return flight, True
+
+    async def _run(self, flight: Flight, produce: Callable[[Flight], Awaitable[None]]):
+        error = None
+        try:
+            await produce(flight)
+        except asyncio.CancelledError as e:
+            error = e
+        except Exception as e:
+            if flight._started.is_set():
+                logger.error(f"Shared generation failed: {e}")
+            error = e
+        finally:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            flight.close(error)
+
+    def leave(self, flight: Flight):
+        flight.subscribers -= 1
+        if flight.subscribers > 0 or flight.done:
+            return
+        # Không còn ai nghe: huỷ generation, hoặc rời hàng đợi admission nếu chưa chạy
+        if flight._started.is_set():
+            flight.generation.cancel("disconnect")
+        elif flight.task is not None:
+            flight.task.cancel()
+
+
+def _build_single_flight() -> Optional[SingleFlight]:
+    if os.getenv("SINGLE_FLIGHT_ENABLED", "1") != "1":
+        return None
+    # Opt-in: request giống hệt nhận chung một câu trả lời đã sample (như khi cache hit)
+    return SingleFlight(sampled=os.getenv("SINGLE_FLIGHT_SAMPLED", "0") == "1")
+
+
+singleFlight = _build_single_flight()
@@ -0,0 +1,133 @@
+import llama_cpp
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+from loguru import logger
+from typing import Any, Callable, Optional
+import os
+
+import numpy as np
+
+from .metrics import SPECULATIVE_ACCEPTANCE_RATE, SPECULATIVE_ACCEPTED_TOKENS, SPECULATIVE_DRAFT_TOKENS
+
+MODES = ("off", "prompt_lookup", "draft")
+
+
+def _common_prefix(a: np.ndarray, b: np.ndarray) -> int:
+    n = min(len(a), len(b))
+    if n == 0:
+        return 0
+    mismatch = np.nonzero(a[:n] != b[:n])[0]
+    return int(mismatch[0]) if len(mismatch) else n
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """
+    Greedy draft tokens from a small GGUF model that shares the target's tokenizer.
+
+    The draft keeps its own KV cache and only evaluates the suffix that changed since
+    the previous call (accepted tokens + the target's correction).
+    """
+
+    def __init__(self, model_path: str, num_pred_tokens: int = 4, n_ctx: int = 4096, n_threads: int = 2):
+        self.num_pred_tokens = num_pred_tokens
+        self.model = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            use_mmap=True,
+            verbose=False,
+        )
+        self.n_vocab = self.model.n_vocab()
+        self.eos_token = self.model.token_eos()
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs: Any) -> np.ndarray:
+        model = self.model
+        if len(input_ids) == 0:
+            return np.array([], dtype=np.intc)
+        # Luôn eval lại ít nhất token cuối để có logits mới
+        common = min(_common_prefix(model.input_ids[:model.n_tokens], input_ids), len(input_ids) - 1)
+        model.n_tokens = common
+        model.eval(input_ids[common:].tolist())
+
+        drafted = []
+        budget = min(self.num_pred_tokens, model.n_ctx() - model.n_tokens)
+        for _ in range(budget):
+            logits = np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(model.ctx, -1), shape=(self.n_vocab,))
+            token = int(np.argmax(logits))
+            if token == self.eos_token:
+                break
+            drafted.append(token)
+            if len(drafted) < budget:
+                model.eval([token])
+        return np.array(drafted, dtype=np.intc)
+
+    def close(self):
+        self.model.close()
+
+
+class InstrumentedDraft(LlamaDraftModel):
+    """
+    Wraps a draft model and records how many proposed tokens the target accepted.
+
+    Llama.generate calls the draft again right after verifying the previous proposal, so
+    the accepted count is the common prefix between that proposal and what actually
+    landed in input_ids. One instance per replica (drafts are stateful).
+    """
+
+    def __init__(self, inner: LlamaDraftModel):
+        self.inner = inner
+        self.drafted = 0
+        self.accepted = 0
+        self._pending = None
+
+    def _resolve(self, input_ids: np.ndarray):
+        start, anchor, proposal = self._pending
+        self._pending = None
+        # Request mới (không nối tiếp proposal trước) - bỏ qua
+        if len(input_ids) <= start or int(input_ids[start - 1]) != anchor:
+            return
+        accepted = _common_prefix(input_ids[start:start + len(proposal)], proposal)
+        self.drafted += len(proposal)
+        self.accepted += accepted
+        SPECULATIVE_DRAFT_TOKENS.inc(len(proposal))
+        SPECULATIVE_ACCEPTED_TOKENS.inc(accepted)
+        SPECULATIVE_ACCEPTANCE_RATE.observe(accepted / len(proposal))
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs: Any) -> np.ndarray:
+        if self._pending is not None:
+            self._resolve(input_ids)
+        proposal = self.inner(input_ids, **kwargs)
+        if len(proposal) and len(input_ids):
+            self._pending = (len(input_ids), int(input_ids[-1]), np.asarray(proposal, dtype=np.intc))
+        return proposal
+
+    def close(self):
+        close = getattr(self.inner, "close", None)
+        if close is not None:
+            close()
+
+
+def draft_factory(
+    mode: str,
+    num_pred_tokens: int = 10,
+    max_ngram_size: int = 2,
+    draft_model_path: Optional[str] = None,
+    n_ctx: int = 4096,
+    n_threads: int = 2,
+) -> Optional[Callable[[], LlamaDraftModel]]:
+    """Callable creating one draft per replica, or None when speculative decoding is off"""
+    if mode not in MODES:
+        raise ValueError(f"Unknown speculative mode {mode!r}, expected one of {MODES}")
+    if mode == "off":
+        return None
+    if mode == "draft":
+        if not draft_model_path or not os.path.exists(draft_model_path):
+            raise FileNotFoundError(f"Draft model not found at: {draft_model_path}")
+        logger.info(f"Speculative decoding: draft model {draft_model_path} ({num_pred_tokens} tokens/step)")
+        return lambda: InstrumentedDraft(GGUFDraftModel(draft_model_path, num_pred_tokens, n_ctx, n_threads))
+
+    # Prompt lookup: câu trả lời luật thường trích nguyên văn điều khoản trong câu hỏi
+    logger.info(f"Speculative decoding: prompt lookup (ngram<={max_ngram_size}, {num_pred_tokens} tokens/step)")
+    return lambda: InstrumentedDraft(
+        LlamaPromptLookupDecoding(max_ngram_size=max_ngram_size, num_pred_tokens=num_pred_tokens)
+    )
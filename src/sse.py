@@ -0,0 +1,108 @@
+from typing import AsyncIterator, Optional, Union
+import asyncio
+import json
+import os
+import time
+
+# Marker yield bởi coalesce() khi stream rảnh quá lâu
+HEARTBEAT = object()
+
+DONE_FRAME = "data: [DONE]\n\n"
+HEARTBEAT_FRAME = ": ping\n\n"
+
+
+def encode_event(data: str, event: Optional[str] = None) -> str:
+    """
+    One SSE frame. Text goes out raw (one `data:` line per line of text), no JSON,
+    so a chunk costs a string join instead of a json.dumps.
+    """
+    text = data.replace("\r\n", "\n").replace("\r", "\n")
+    lines = "".join(f"data: {line}\n" for line in text.split("\n"))
+    if event:
+        return f"event: {event}\n{lines}\n"
+    return f"{lines}\n"
+
+
+def encode_json_event(payload: dict, event: str) -> str:
+    return encode_event(json.dumps(payload, ensure_ascii=False, separators=(",", ":")), event)
+
+
+class FlushPolicy:
+    """Coalesce streamed tokens: flush every `max_tokens` pieces or `max_ms` after the first buffered piece"""
+
+    def __init__(self, max_tokens: int = 4, max_ms: float = 50.0, heartbeat_s: float = 15.0):
+        self.max_tokens = max(1, max_tokens)
+        self.max_delay = max_ms / 1000.0
+        self.heartbeat = heartbeat_s
+
+    @classmethod
+    def from_env(cls) -> "FlushPolicy":
+        return cls(
+            max_tokens=int(os.getenv("STREAM_FLUSH_TOKENS", "4")),
+            max_ms=float(os.getenv("STREAM_FLUSH_MS", "50")),
+            heartbeat_s=float(os.getenv("STREAM_HEARTBEAT_S", "15")),
+        )
+
+
+async def coalesce(pieces: AsyncIterator[str], policy: FlushPolicy) -> AsyncIterator[Union[str, object]]:
+    """
+    Group pieces into batched text per the flush policy; yields HEARTBEAT when
+    nothing has been produced for `policy.heartbeat` seconds (e.g. long prefill).
+    """
+    iterator = pieces.__aiter__()
+    buffer = []
+    first_buffered_at = 0.0
+    last_output_at = time.monotonic()
+    next_piece = asyncio.ensure_future(iterator.__anext__())
+
+    try:
+        while True:
+            now = time.monotonic()
+            if buffer:
+                timeout = max(0.0, first_buffered_at + policy.max_delay - now)
+            else:
+                timeout = max(0.0, last_output_at + policy.heartbeat - now)
+
+            done, _ = await asyncio.wait({next_piece}, timeout=timeout)
+
+            if not done:
+                # Hết hạn chờ: flush phần đang buffer, hoặc gửi heartbeat giữ kết nối
+                if buffer:
+                    yield "".join(buffer)
+                    buffer = []
+                else:
+                    yield HEARTBEAT
+                last_output_at = time.monotonic()
+                continue
+
+            try:
+                piece = next_piece.result()
+            except StopAsyncIteration:
+                break
+
+            if piece:
+                if not buffer:
+                    first_buffered_at = time.monotonic()
+                buffer.append(piece)
+                if len(buffer) >= policy.max_tokens:
+                    yield "".join(buffer)
+                    buffer = []
+                    last_output_at = time.monotonic()
+            next_piece = asyncio.ensure_future(iterator.__anext__())
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if not next_piece.done():
+            next_piece.cancel()
+            try:
+                await next_piece
+            except (asyncio.CancelledError, Exception):
+                pass
+        # Đóng generator nguồn để decode dừng ngay khi client ngắt
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except RuntimeError:
+                pass
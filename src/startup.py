@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from loguru import logger
+from typing import Optional
+import os
+import time
+
+from .metrics import SERVICE_READY, STARTUP_PHASE_SECONDS
+
+WARMUP_QUESTION = "Xin chào"
+
+
+class StartupReport:
+    """
+    Phase timings of process startup (import, prefault, load, warmup, ...) and the
+    readiness flag behind /ready. Liveness (/health) is up as soon as uvicorn serves;
+    readiness only after the model has been loaded and warmed up.
+    """
+
+    def __init__(self):
+        self.phases: "OrderedDict[str, float]" = OrderedDict()
+        self.ready = False
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = round(seconds, 3)
+        STARTUP_PHASE_SECONDS.labels(phase=name).set(seconds)
+        logger.info(f"Startup phase {name}: {seconds:.2f}s")
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def mark_ready(self):
+        self.ready = True
+        self.error = None
+        SERVICE_READY.set(1)
+        logger.info(f"Service ready after {time.perf_counter() - self._started:.2f}s")
+
+    def mark_not_ready(self, error: Optional[str] = None):
+        self.ready = False
+        self.error = error
+        SERVICE_READY.set(0)
+
+    def as_dict(self) -> dict:
+        return {
+            "ready": self.ready,
+            "phases": dict(self.phases),
+            "error": self.error,
+        }
+
+
+def prefault(path: str, chunk_size: int = 16 * 1024 * 1024) -> int:
+    """
+    Read the whole file once so its pages sit in the OS page cache. llama.cpp mmaps the
+    GGUF, so the first request would otherwise take the major page faults.
+    """
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    total = 0
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            n = f.readinto(view)
+            if not n:
+                break
+            total += n
+    return total
+
+
+def warmup(model, system_prompt: str, max_tokens: int, question: str = WARMUP_QUESTION) -> int:
+    """One short greedy generation: touches the weights and initializes compute buffers"""
+    result = model.create_chat_completion(
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": question},
+        ],
+        max_tokens=max_tokens,
+        temperature=0.0,
+    )
+    usage = result.get("usage") or {}
+    return int(usage.get("completion_tokens", 0))
+
+
+startupReport = StartupReport()
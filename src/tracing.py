@@ -0,0 +1,243 @@
+from contextlib import contextmanager
+from loguru import logger
+from typing import Callable, Dict, Iterator, Optional
+import base64
+import contextvars
+import functools
+import os
+import threading
+import time
+import uuid
+
+# Request đang xử lý (id, thời điểm nhận) - đặt bởi TracingMiddleware
+_request: contextvars.ContextVar[Optional["RequestContext"]] = contextvars.ContextVar("request", default=None)
+
+
+class RequestContext:
+    def __init__(self, request_id: str, start: float):
+        self.request_id = request_id
+        self.start = start
+
+
+def _epoch_ns(perf_time: float) -> int:
+    """perf_counter() timestamp -> wall clock ns, as OpenTelemetry expects"""
+    return time.time_ns() - int((time.perf_counter() - perf_time) * 1e9)
+
+
+class OTLPJsonFileExporter:
+    """
+    Spans as OTLP/JSON lines (one ExportTraceServiceRequest per line): the format of the
+    collector's file exporter, which its otlpjsonfile receiver can read back.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans):
+        from google.protobuf.json_format import MessageToDict
+        from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+        from opentelemetry.sdk.trace.export import SpanExportResult
+        import json
+
+        request = MessageToDict(encode_spans(spans), use_integers_for_enums=True)
+        # OTLP/JSON ghi trace/span id dạng hex, không phải base64 như proto3 JSON
+        for resource_spans in request.get("resourceSpans", []):
+            for scope_spans in resource_spans.get("scopeSpans", []):
+                for span in scope_spans.get("spans", []):
+                    for key in ("traceId", "spanId", "parentSpanId"):
+                        if span.get(key):
+                            span[key] = base64.b64decode(span[key]).hex()
+        line = json.dumps(request, ensure_ascii=False, separators=(",", ":"))
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.warning(f"Writing traces to {self.path} failed: {e}")
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+    def shutdown(self):
+        pass
+
+
+class Tracing:
+    """
+    OpenTelemetry tracer for the request path: validation, cache lookup, chat template,
+    tokenization, admission wait, prefill, decode and SSE streaming, all under one server
+    span per request. Spans go to an OTLP/JSON lines file or an OTLP/HTTP collector.
+    """
+
+    def __init__(self, exporter: str, path: str, sample_ratio: float, service_name: str, exclude_paths=()):
+        from opentelemetry import propagate, trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+        if exporter == "otlp":
+            # Endpoint / headers theo env chuẩn OTEL_EXPORTER_OTLP_*
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            span_exporter = OTLPSpanExporter()
+        elif exporter == "file":
+            span_exporter = OTLPJsonFileExporter(path)
+        else:
+            raise ValueError(f"Unknown TRACING_EXPORTER {exporter!r}, expected 'file' or 'otlp'")
+
+        resource = Resource.create({
+            "service.name": service_name,
+            "service.instance.id": os.getenv("INSTANCE_ID", "unknown"),
+        })
+        self.provider = TracerProvider(resource=resource, sampler=ParentBased(TraceIdRatioBased(sample_ratio)))
+        # Export theo batch trên thread riêng, request không chờ ghi file / gửi collector
+        self.provider.add_span_processor(BatchSpanProcessor(span_exporter))
+        trace.set_tracer_provider(self.provider)
+        self.tracer = self.provider.get_tracer("qa-chatbot")
+        self.exclude_paths = set(exclude_paths)
+        self.extract = propagate.extract
+        self.server_kind = trace.SpanKind.SERVER
+        self.current_span = trace.get_current_span
+
+    def in_request(self) -> bool:
+        """Spans outside a request (startup warmup, swap canary) would each be a lone trace"""
+        return self.current_span().get_span_context().is_valid
+
+    def shutdown(self):
+        self.provider.shutdown()
+
+
+def _build_tracing() -> Optional[Tracing]:
+    if os.getenv("TRACING_ENABLED", "0") != "1":
+        return None
+    try:
+        tracing = Tracing(
+            exporter=os.getenv("TRACING_EXPORTER", "file"),
+            path=os.getenv("TRACING_FILE", "./traces/traces.jsonl"),
+            sample_ratio=float(os.getenv("TRACING_SAMPLE_RATIO", "1.0")),
+            service_name=os.getenv("OTEL_SERVICE_NAME", "qa-chatbot"),
+            exclude_paths=[p for p in os.getenv("TRACING_EXCLUDE_PATHS", "/metrics,/health,/ready").split(",") if p],
+        )
+    except ImportError as e:
+        logger.warning(f"OpenTelemetry SDK not installed, tracing disabled: {e}")
+        return None
+    logger.info(f"Tracing enabled ({os.getenv('TRACING_EXPORTER', 'file')} exporter)")
+    return tracing
+
+
+requestTracing = _build_tracing()
+
+
+def _attributes(attributes: dict) -> dict:
+    return {k: v for k, v in attributes.items() if v is not None}
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[object]]:
+    """with span("tokenize", tokens=n) as s: ... - no-op when tracing is off"""
+    if requestTracing is None or not requestTracing.in_request():
+        yield None
+        return
+    with requestTracing.tracer.start_as_current_span(name, attributes=_attributes(attributes)) as current:
+        yield current
+
+
+def start_span(name: str, **attributes) -> Optional[object]:
+    """Span that is not made current, ended by the caller (e.g. across an async generator's yields)"""
+    if requestTracing is None or not requestTracing.in_request():
+        return None
+    return requestTracing.tracer.start_span(name, attributes=_attributes(attributes))
+
+
+def record_span(name: str, start: float, end: float, **attributes):
+    """Span for an interval measured earlier with perf_counter() (prefill, decode, ...)"""
+    if requestTracing is None or not requestTracing.in_request():
+        return
+    requestTracing.tracer.start_span(
+        name, start_time=_epoch_ns(start), attributes=_attributes(attributes)
+    ).end(end_time=_epoch_ns(end))
+
+
+def bind(fn: Callable) -> Callable:
+    """Run `fn` in the current context from an executor thread, so its spans join this request"""
+    if requestTracing is None:
+        return fn
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def current_request_id() -> Optional[str]:
+    request = _request.get()
+    return request.request_id if request is not None else None
+
+
+def handler_entered():
+    """
+    Called first thing in an endpoint: the time since the request arrived went to
+    reading the body, JSON parsing and pydantic validation of the DTO.
+    """
+    request = _request.get()
+    if request is not None:
+        record_span("request.validate", request.start, time.perf_counter())
+
+
+class TracingMiddleware:
+    """
+    Request id (X-Request-ID, generated if missing) and one server span per HTTP request.
+
+    Pure ASGI rather than BaseHTTPMiddleware so the span stays open until a streamed
+    body has been fully sent. Incoming W3C traceparent headers are continued.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers: Dict[str, str] = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        request_id = headers.get("x-request-id") or uuid.uuid4().hex
+        request = RequestContext(request_id, time.perf_counter())
+        token = _request.set(request)
+        traced = requestTracing is not None and scope["path"] not in requestTracing.exclude_paths
+        server_span = None
+        status = {"code": 500}
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                extra = [(b"x-request-id", request_id.encode("latin-1"))]
+                if server_span is not None and server_span.get_span_context().trace_flags.sampled:
+                    extra.append((b"x-trace-id", format(server_span.get_span_context().trace_id, "032x").encode()))
+                message = {**message, "headers": list(message.get("headers", [])) + extra}
+            await send(message)
+
+        try:
+            if not traced:
+                await self.app(scope, receive, send_with_headers)
+                return
+
+            with requestTracing.tracer.start_as_current_span(
+                f"{scope['method']} {scope['path']}",
+                context=requestTracing.extract(headers),
+                kind=requestTracing.server_kind,
+                attributes={"http.request.method": scope["method"], "url.path": scope["path"],
+                            "request.id": request_id},
+            ) as server_span:
+                request.start = time.perf_counter()  # request.validate nằm trong server span
+                try:
+                    await self.app(scope, receive, send_with_headers)
+                finally:
+                    # Tên span theo route template (/generations/{generation_id}), không theo path
+                    route = scope.get("route")
+                    if route is not None and hasattr(route, "path"):
+                        server_span.update_name(f"{scope['method']} {route.path}")
+                        server_span.set_attribute("http.route", route.path)
+                    server_span.set_attribute("http.response.status_code", status["code"])
+        finally:
+            _request.reset(token)
@@ -0,0 +1,97 @@
+from typing import Iterator, List, Optional, Sequence
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+class CompletionCollator:
+    """
+    Dynamic padding for the output of data_prep.tokenize_batch / pack_sequences.
+
+    Each batch is padded to its own longest row (rounded up to `pad_to_multiple_of`),
+    labels with -100. Packed rows (with `seq_lengths`) get position_ids restarting at 0
+    for every example and no attention_mask (the DataCollatorWithFlattening convention):
+    transformers only derives per-example causal masks from position_ids when the mask
+    is None, on flash-attention-2, sdpa and eager alike. Padding keeps position 0, so
+    every pad token is a one-token sequence of its own. The model must run with
+    use_cache=False (as the fine-tuning notebook sets), else the split is skipped.
+    """
+
+    def __init__(self, pad_token_id: int, pad_to_multiple_of: Optional[int] = 8, label_pad_token_id: int = -100):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.label_pad_token_id = label_pad_token_id
+
+    def __call__(self, features: List[dict]) -> dict:
+        longest = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            longest = -(-longest // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        input_ids = torch.full((len(features), longest), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((len(features), longest), self.label_pad_token_id, dtype=torch.long)
+        packed = any("seq_lengths" in f for f in features)
+        attention_mask = None if packed else torch.zeros((len(features), longest), dtype=torch.long)
+        position_ids = torch.zeros((len(features), longest), dtype=torch.long) if packed else None
+
+        for row, f in enumerate(features):
+            n = len(f["input_ids"])
+            input_ids[row, :n] = torch.as_tensor(f["input_ids"], dtype=torch.long)
+            labels[row, :n] = torch.as_tensor(f["labels"], dtype=torch.long)
+            if packed:
+                seq_lengths = list(f.get("seq_lengths") or [n])
+                position_ids[row, :n] = torch.cat([torch.arange(length) for length in seq_lengths])
+            else:
+                attention_mask[row, :n] = 1
+
+        if packed:
+            # Mask 2D 1 trên cả dòng sẽ cho các example trong dòng attend lẫn nhau
+            return {"input_ids": input_ids, "labels": labels, "position_ids": position_ids}
+        return {"input_ids": input_ids, "labels": labels, "attention_mask": attention_mask}
+
+
+class LengthGroupedBatchSampler(Sampler[List[int]]):
+    """
+    Batches of similar-length rows, in random order.
+
+    Indices are shuffled, cut into mega-batches of `batch_size * mega_batch_mult`, sorted
+    by length inside each mega-batch and split into batches; the batch order is shuffled
+    again so training does not see lengths in a fixed progression. For HF Trainer use
+    group_by_length=True with length_column_name="length" instead.
+    """
+
+    def __init__(
+        self,
+        lengths: Sequence[int],
+        batch_size: int,
+        mega_batch_mult: int = 50,
+        drop_last: bool = False,
+        seed: int = 42,
+    ):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.batch_size = batch_size
+        self.mega_batch_mult = mega_batch_mult
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return -(-len(self.lengths) // self.batch_size)
+
+    def __iter__(self) -> Iterator[List[int]]:
+        rng = np.random.default_rng(self.seed + self.epoch)
+        indices = rng.permutation(len(self.lengths))
+        mega = self.batch_size * self.mega_batch_mult
+        batches = []
+        for start in range(0, len(indices), mega):
+            chunk = indices[start:start + mega]
+            chunk = chunk[np.argsort(-self.lengths[chunk], kind="stable")]
+            batches.extend(chunk[i:i + self.batch_size] for i in range(0, len(chunk), self.batch_size))
+        if self.drop_last:
+            batches = [b for b in batches if len(b) == self.batch_size]
+        for i in rng.permutation(len(batches)):
+            yield batches[i].tolist()
@@ -1,12 +1,23 @@
-from datasets import load_dataset, Dataset
-from tqdm.auto import tqdm
-import pandas as pd
-from sklearn.model_selection import train_test_split
+from datasets import load_dataset, load_from_disk, Dataset
+from typing import List, Optional, Tuple
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+DATASET_NAME = "thangvip/vietnamese-legal-qa"
+DATA_CACHE_DIR = os.getenv("DATA_PREP_CACHE_DIR", "./data_cache")
+# Tăng khi đổi logic xử lý để không dùng lại cache cũ
+PREP_VERSION = 1
+SYSTEM_PROMPT = (
+    "Bạn là một trợ lý luật pháp Việt Nam thông minh, luôn trả lời bằng tiếng Việt chuẩn và dễ hiểu."
+)
 
 def preprocess_function(example):
-    SYSTEM_PROMPT = (
-    "Bạn là một trợ lý luật pháp Việt Nam thông minh, luôn trả lời bằng tiếng Việt chuẩn và dễ hiểu."
-    )
     user_content = example["question"].strip()
     assistant_content = example["answer"].strip()
 
@@ -18,39 +29,102 @@ def preprocess_function(example):
         ]
     }
 
-def get_dataset(n_samples=8000):
-    ds = load_dataset("thangvip/vietnamese-legal-qa", split="train")
-
-    rows = []
-
-    for i in tqdm(range(len(ds))):
-        qa_pairs = ds[i]["generated_qa_pairs"]
-        for qa_pair in qa_pairs:
-            rows.append({
-                "question": qa_pair["question"],
-                "answer": qa_pair["answer"]
-            })
-
-    df = pd.DataFrame(rows)
-
-    df = df.assign(
-        num_tokens=df["answer"].apply(lambda text: len(str(text).split()))
+def count_words(texts: pa.Array) -> pa.Array:
+    """len(text.split()) for every string, computed in Arrow"""
+    parts = pc.utf8_split_whitespace(pc.fill_null(texts, ""))
+    # utf8_split_whitespace tách từng ký tự trắng: "a  b" -> ["a", "", "b"], bỏ các chuỗi rỗng
+    empty = pc.equal(pc.binary_length(pc.list_flatten(parts)), 0).to_numpy(zero_copy_only=False)
+    parents = pc.list_parent_indices(parts).to_numpy()
+    n_empty = np.bincount(parents[empty], minlength=len(texts))
+    return pc.subtract(pc.list_value_length(parts), pa.array(n_empty, pa.int32()))
+
+def explode_qa_pairs(batch: pa.Table, max_answer_words: int) -> pa.Table:
+    """One row per element of `generated_qa_pairs`, keeping answers shorter than `max_answer_words` words"""
+    pairs = pc.list_flatten(batch.column("generated_qa_pairs").combine_chunks())
+    questions = pc.struct_field(pairs, "question")
+    answers = pc.struct_field(pairs, "answer")
+    num_tokens = count_words(answers)
+    keep = pc.and_(
+        pc.less(num_tokens, max_answer_words),
+        pc.and_(pc.is_valid(questions), pc.is_valid(answers)),
     )
-
-    df = df.loc[df["num_tokens"] < 256]
-    if len(df) > n_samples:
-        df = df.sample(n_samples, random_state=42).reset_index(drop=True)
-
-    # df_train, df_val = train_test_split(df, test_size=0.1, random_state=42)
-
-    ds_train = Dataset.from_pandas(df)
-    # ds_val = Dataset.from_pandas(df_val)
-
-    # Áp dụng preprocess_function
-    ds_train = ds_train.map(preprocess_function).select_columns(["messages"])
-    # ds_val = ds_val.map(preprocess_function).select_columns(["messages"])
-
-    return ds_train
+    table = pa.table({"question": questions, "answer": answers, "num_tokens": num_tokens})
+    return table.filter(keep)
+
+def to_messages(batch: pa.Table) -> pa.Table:
+    """Batched preprocess_function: system/user/assistant messages built column-wise in Arrow"""
+    questions = pc.utf8_trim_whitespace(batch.column("question")).combine_chunks()
+    answers = pc.utf8_trim_whitespace(batch.column("answer")).combine_chunks()
+    n = len(questions)
+    system = pa.repeat(pa.scalar(SYSTEM_PROMPT, questions.type), n)
+    # [system_0..n, user_0..n, assistant_0..n] -> system_0, user_0, assistant_0, system_1, ...
+    order = np.arange(3 * n).reshape(3, n).T.ravel()
+    content = pa.concat_arrays([system, questions, answers]).take(order)
+    roles = pa.array(["system", "user", "assistant"], questions.type).take(np.tile(np.arange(3), n))
+    values = pa.StructArray.from_arrays([roles, content], names=["role", "content"])
+    offsets = pa.array(np.arange(0, 3 * n + 1, 3, dtype=np.int32))
+    return pa.table({"messages": pa.ListArray.from_arrays(offsets, values)})
+
+def _cache_path(cache_dir: str, source: str, **params) -> str:
+    key = json.dumps({"source": source, "version": PREP_VERSION, **params}, sort_keys=True)
+    return os.path.join(cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest()[:16])
+
+def get_dataset(
+    n_samples: Optional[int] = 8000,
+    max_answer_words: int = 256,
+    seed: int = 42,
+    num_proc: Optional[int] = None,
+    cache_dir: Optional[str] = DATA_CACHE_DIR,
+    revision: Optional[str] = None,
+    dataset: Optional[Dataset] = None,
+) -> Dataset:
+    """
+    Chat-format training set from vietnamese-legal-qa: one row per QA pair, answers
+    under `max_answer_words` words, `n_samples` rows sampled with `seed`.
+
+    Runs as batched Arrow maps over `num_proc` processes (default: CPU count) and never
+    builds Python lists of the whole dataset. The result is saved under `cache_dir`,
+    keyed by the parameters, and later calls memory-map it instead of recomputing.
+    `dataset` replaces the Hub download (same schema).
+    """
+    source = dataset._fingerprint if dataset is not None else f"{DATASET_NAME}@{revision or 'main'}"
+    path = None
+    if cache_dir:
+        path = _cache_path(cache_dir, source, n_samples=n_samples, max_answer_words=max_answer_words, seed=seed)
+        if os.path.exists(path):
+            return load_from_disk(path)
+
+    ds = dataset if dataset is not None else load_dataset(DATASET_NAME, split="train", revision=revision)
+    num_proc = num_proc or min(os.cpu_count() or 1, 8)
+    # Không chia process cho dataset nhỏ: chi phí khởi tạo lớn hơn phần việc
+    num_proc = num_proc if num_proc > 1 and len(ds) >= 1000 * num_proc else None
+
+    ds = ds.select_columns(["generated_qa_pairs"]).with_format("arrow").map(
+        explode_qa_pairs,
+        batched=True,
+        batch_size=1000,
+        num_proc=num_proc,
+        fn_kwargs={"max_answer_words": max_answer_words},
+        remove_columns=["generated_qa_pairs"],
+        desc="Explode QA pairs",
+    )
+    if n_samples is not None and len(ds) > n_samples:
+        ds = ds.shuffle(seed=seed).select(range(n_samples))
+
+    # Áp dụng preprocess_function (bản batched)
+    ds = ds.map(to_messages, batched=True, batch_size=1000, remove_columns=ds.column_names, desc="Build messages")
+    ds = ds.with_format(None)
+
+    if path is None:
+        return ds
+    # Ghi vào thư mục tạm rồi rename: process khác không đọc phải cache dở dang
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    ds.save_to_disk(tmp_path)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)  # process khác vừa ghi xong cùng key
+    return load_from_disk(path)
 
 def tokenize_and_mask(example, tokenizer, max_length):
     messages = example["messages"]
@@ -72,3 +146,100 @@ def tokenize_and_mask(example, tokenizer, max_length):
     labels = labels[:max_length]
 
     return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+
+def tokenize_batch(batch, tokenizer, max_length: int) -> dict:
+    """
+    Batched tokenize_and_mask without padding (the collator pads per batch).
+
+    Each conversation is tokenized once; the prompt/completion boundary is the first
+    token whose character offset falls in the completion. Adds `length` for
+    length-grouped sampling and drops rows whose completion was truncated away.
+    """
+    prompts = [
+        tokenizer.apply_chat_template(messages[:-1], tokenize=False, add_generation_prompt=False)
+        for messages in batch["messages"]
+    ]
+    texts = [
+        prompt + messages[-1]["content"] + tokenizer.eos_token
+        for prompt, messages in zip(prompts, batch["messages"])
+    ]
+    if tokenizer.is_fast:
+        encoded = tokenizer(texts, truncation=True, max_length=max_length, return_offsets_mapping=True)
+        prompt_lens = []
+        for offsets, prompt in zip(encoded["offset_mapping"], prompts):
+            # BOS thêm bởi post-processor có offset (0, 0) nên được tính vào prompt
+            starts = np.fromiter((start for start, _ in offsets), dtype=np.int64, count=len(offsets))
+            in_completion = starts >= len(prompt)
+            prompt_lens.append(int(np.argmax(in_completion)) if in_completion.any() else len(offsets))
+    else:
+        # Tokenizer chậm không có offset: tokenize prompt riêng như tokenize_and_mask
+        encoded = tokenizer(texts, truncation=True, max_length=max_length)
+        prompt_lens = [len(ids) for ids in tokenizer(prompts, truncation=True, max_length=max_length)["input_ids"]]
+
+    out = {"input_ids": [], "labels": [], "length": []}
+    for input_ids, prompt_len in zip(encoded["input_ids"], prompt_lens):
+        if prompt_len >= len(input_ids):
+            continue  # Không còn token completion nào để học
+        out["input_ids"].append(input_ids)
+        out["labels"].append([-100] * prompt_len + input_ids[prompt_len:])
+        out["length"].append(len(input_ids))
+    return out
+
+def tokenize_dataset(ds: Dataset, tokenizer, max_length: int, num_proc: Optional[int] = None) -> Dataset:
+    """tokenize_batch over a `messages` dataset (e.g. from get_dataset)"""
+    return ds.map(
+        tokenize_batch,
+        batched=True,
+        batch_size=1000,
+        num_proc=num_proc,
+        fn_kwargs={"tokenizer": tokenizer, "max_length": max_length},
+        remove_columns=ds.column_names,
+        desc="Tokenize",
+    )
+
+def _first_fit_decreasing(lengths: np.ndarray, capacity: int) -> List[List[int]]:
+    """Bins of example indices, each summing to at most `capacity` tokens"""
+    order = np.argsort(-lengths, kind="stable")
+    bins: List[List[int]] = []
+    # Dung lượng còn lại của các bin, sắp xếp tăng dần: bisect tìm bin vừa khít nhất
+    free: List[Tuple[int, int]] = []
+    for index in order.tolist():
+        length = int(lengths[index])
+        pos = bisect.bisect_left(free, (length, -1))
+        if pos == len(free):
+            bins.append([index])
+            remaining, bin_id = capacity - length, len(bins) - 1
+        else:
+            remaining, bin_id = free.pop(pos)
+            bins[bin_id].append(index)
+            remaining -= length
+        if remaining > 0:
+            bisect.insort(free, (remaining, bin_id))
+    return bins
+
+def pack_sequences(ds: Dataset, max_length: int, seed: int = 42) -> Dataset:
+    """
+    Pack tokenized examples into rows of at most `max_length` tokens (first-fit
+    decreasing). Labels keep each example's prompt masked, and `seq_lengths` lets the
+    collator restart position_ids per example. Rows are concatenated in Arrow.
+    """
+    lengths = np.asarray(ds["length"], dtype=np.int64)
+    bins = _first_fit_decreasing(lengths, max_length)
+    np.random.default_rng(seed).shuffle(bins)
+
+    order = [index for packed in bins for index in packed]
+    table = ds.select_columns(["input_ids", "labels"]).select(order).with_format("arrow")[:]
+    row_lengths = np.fromiter((lengths[packed].sum() for packed in bins), dtype=np.int64, count=len(bins))
+    offsets = pa.array(np.concatenate([[0], np.cumsum(row_lengths)]).astype(np.int32))
+
+    def regroup(column: str) -> pa.ListArray:
+        return pa.ListArray.from_arrays(offsets, pc.list_flatten(table.column(column).combine_chunks()))
+
+    seq_offsets = pa.array(np.concatenate([[0], np.cumsum([len(packed) for packed in bins])]).astype(np.int32))
+    packed = pa.table({
+        "input_ids": regroup("input_ids"),
+        "labels": regroup("labels"),
+        "length": pa.array(row_lengths),
+        "seq_lengths": pa.ListArray.from_arrays(seq_offsets, pa.array(lengths[order])),
+    })
+    return Dataset(packed)
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from src.admission import AdmissionController, Priority, QueueFullError, QueueTimeoutError
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_queue_full_is_rejected_immediately():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue_depth=1)
+        assert await controller.acquire() == 0.0
+        waiter = asyncio.create_task(controller.acquire())
+        await _settle()
+
+        with pytest.raises(QueueFullError) as rejected:
+            await controller.acquire()
+        assert rejected.value.retry_after >= 1
+        controller.release()
+        await waiter
+        assert controller.active == 1 and controller.queue_depth == 0
+
+    asyncio.run(scenario())
+
+
+def test_release_hands_slot_over_by_priority_then_fifo():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue_depth=8)
+        await controller.acquire()
+        order = []
+
+        async def request(name, priority):
+            await controller.acquire(priority)
+            order.append(name)
+
+        tasks = [
+            asyncio.create_task(request(name, priority))
+            for name, priority in [("low", Priority.LOW), ("normal-1", Priority.NORMAL),
+                                   ("high", Priority.HIGH), ("normal-2", Priority.NORMAL)]
+        ]
+        await _settle()
+        assert controller.queue_depth == 4
+        for _ in tasks:
+            controller.release()
+            await _settle()
+        assert order == ["high", "normal-1", "normal-2", "low"]
+        # Slot chuyển thẳng cho waiter: số slot đang giữ không đổi
+        assert controller.active == 1
+
+    asyncio.run(scenario())
+
+
+def test_low_priority_is_capped_and_leaves_a_slot_for_interactive():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=2, max_queue_depth=1)
+        assert controller.max_low_active == 1
+        await controller.acquire(Priority.LOW)
+
+        # Slot thứ hai còn trống nhưng LOW đã chạm giới hạn: phải chờ
+        low = asyncio.create_task(controller.acquire(Priority.LOW))
+        await _settle()
+        assert not low.done() and controller.queue_depth == 1
+        # LOW đang chờ không tính vào hàng đợi của request interactive
+        await controller.acquire(Priority.NORMAL)
+        assert controller.active == 2
+
+        controller.release(priority=Priority.NORMAL)
+        await _settle()
+        assert not low.done() and controller.active == 1
+        controller.release(priority=Priority.LOW)
+        await low
+        assert controller.active == 1 and controller.queue_depth == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_and_cancellation_leave_the_queue():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue_depth=4, queue_timeout=0.05)
+        await controller.acquire()
+
+        with pytest.raises(QueueTimeoutError):
+            await controller.acquire()
+        assert controller.queue_depth == 0
+
+        cancelled = asyncio.create_task(controller.acquire())
+        await _settle()
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert controller.queue_depth == 0
+
+        # Không còn waiter sống: release trả slot về, không chuyển cho future đã huỷ
+        controller.release()
+        assert controller.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_slot_context_releases_on_error():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1)
+        with pytest.raises(RuntimeError):
+            async with controller.slot():
+                assert controller.active == 1
+                raise RuntimeError("boom")
+        assert controller.active == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,48 @@
+import pytest
+import torch
+
+from src.utils.collator import CompletionCollator
+
+PACKED = {"input_ids": [5, 6, 7, 8, 9], "labels": [-100, 6, 7, -100, 9], "seq_lengths": [3, 2]}
+SINGLE = {"input_ids": [3, 4, 5], "labels": [-100, 4, 5], "seq_lengths": [3]}
+
+
+def test_packed_rows_have_positions_per_example_and_no_mask():
+    batch = CompletionCollator(pad_token_id=0, pad_to_multiple_of=8)([PACKED, SINGLE])
+
+    # attention_mask 2D che mất ranh giới example: transformers chỉ dùng position_ids khi mask là None
+    assert "attention_mask" not in batch
+    assert batch["position_ids"].tolist() == [[0, 1, 2, 0, 1, 0, 0, 0], [0, 1, 2, 0, 0, 0, 0, 0]]
+    assert batch["input_ids"].tolist()[0] == [5, 6, 7, 8, 9, 0, 0, 0]
+    assert batch["labels"].tolist()[0] == [-100, 6, 7, -100, 9, -100, -100, -100]
+
+
+def test_unpacked_rows_keep_padding_mask():
+    features = [{"input_ids": [1, 2, 3], "labels": [-100, 2, 3]}, {"input_ids": [4], "labels": [4]}]
+    batch = CompletionCollator(pad_token_id=0, pad_to_multiple_of=None)(features)
+
+    assert "position_ids" not in batch
+    assert batch["attention_mask"].tolist() == [[1, 1, 1], [1, 0, 0]]
+
+
+@pytest.mark.parametrize("attn_implementation", ["sdpa", "eager"])
+def test_packed_examples_do_not_attend_to_each_other(attn_implementation):
+    transformers = pytest.importorskip("transformers")
+    config = transformers.LlamaConfig(
+        vocab_size=16, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=4, max_position_embeddings=32,
+        # Như notebook fine-tune: có KV cache thì transformers bỏ qua việc tách packed sequence
+        use_cache=False,
+    )
+    torch.manual_seed(0)
+    model = transformers.LlamaForCausalLM(config).eval()
+    model.config._attn_implementation = attn_implementation
+
+    batch = CompletionCollator(pad_token_id=0, pad_to_multiple_of=8)([PACKED, SINGLE])
+    with torch.no_grad():
+        packed = model(input_ids=batch["input_ids"], position_ids=batch["position_ids"]).logits
+        first = model(input_ids=torch.tensor([[5, 6, 7]])).logits
+        second = model(input_ids=torch.tensor([[8, 9]])).logits
+
+    torch.testing.assert_close(packed[0, :3], first[0], atol=1e-5, rtol=1e-4)
+    torch.testing.assert_close(packed[0, 3:5], second[0], atol=1e-5, rtol=1e-4)
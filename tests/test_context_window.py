@@ -0,0 +1,89 @@
+import pytest
+
+from src.context_window import SUMMARY_PREFIX, ContextBudgetError, ContextWindow
+from src.dto import MessageDTO, ModelTypeDTO
+
+
+class FakeModel:
+    """No chat template (ContextWindow estimates per message); one token per word"""
+
+    metadata = {}
+
+    def __init__(self, n_ctx: int = 100):
+        self._n_ctx = n_ctx
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def tokenize(self, text: bytes, add_bos: bool = False, special: bool = False):
+        return text.decode("utf-8").split()
+
+
+def _history(turns: int, words: int = 10):
+    history = []
+    for i in range(turns):
+        history.append(MessageDTO(role=ModelTypeDTO.USER, content=f"hỏi{i} " + "w " * (words - 1)))
+        history.append(MessageDTO(role=ModelTypeDTO.ASSISTANT, content=f"đáp{i} " + "w " * (words - 1)))
+    return history
+
+
+def test_short_conversation_is_sent_whole():
+    plan = ContextWindow().fit(FakeModel(), "sys", _history(1), "q", max_tokens=20)
+
+    assert plan.dropped == 0 and len(plan.messages) == 4
+    # (1 + 8) * 2 cho system và câu hỏi, (10 + 8) * 2 cho lượt cũ
+    assert plan.prompt_tokens == 54 and plan.max_tokens == 20
+
+
+def test_max_tokens_is_clamped_to_what_is_left():
+    plan = ContextWindow().fit(FakeModel(), "sys", [], "q", max_tokens=500)
+    assert plan.max_tokens == 100 - plan.prompt_tokens
+
+
+def test_truncate_drops_oldest_turns_in_pairs():
+    history = _history(3)
+    plan = ContextWindow(policy="truncate").fit(FakeModel(), "sys", history, "q", max_tokens=20)
+
+    # 126 token > budget 80: bỏ 2 lượt cũ nhất
+    assert plan.dropped == 4
+    assert plan.messages[1]["content"] == history[4].content
+    assert plan.messages[-1] == {"role": "user", "content": "q"}
+    assert plan.prompt_tokens <= 80
+
+
+def test_previous_window_start_is_kept_and_rounded_to_a_pair():
+    plan = ContextWindow().fit(FakeModel(), "sys", _history(3), "q", max_tokens=10, start=3)
+    assert plan.dropped == 2 and plan.messages[1]["content"].startswith("hỏi1")
+
+
+def test_summarize_replaces_dropped_turns_with_their_questions():
+    plan = ContextWindow(policy="summarize").fit(FakeModel(), "sys", _history(3), "q", max_tokens=20)
+
+    system = plan.messages[0]["content"]
+    assert plan.dropped >= 4
+    assert system.startswith("sys") and SUMMARY_PREFIX in system
+    assert "hỏi0" in system and "đáp0" not in system
+    assert plan.prompt_tokens <= 80
+
+
+def test_reject_policy_refuses_long_history():
+    with pytest.raises(ContextBudgetError) as rejected:
+        ContextWindow(policy="reject").fit(FakeModel(), "sys", _history(3), "q", max_tokens=20)
+    assert rejected.value.status_code == 413 and rejected.value.n_ctx == 100
+
+
+def test_question_that_cannot_fit_is_rejected_under_any_policy():
+    question = "w " * 90
+    for policy in ("truncate", "summarize"):
+        with pytest.raises(ContextBudgetError):
+            ContextWindow(policy=policy).fit(FakeModel(), "sys", _history(2), question, max_tokens=20)
+
+
+def test_unlimited_max_tokens_keeps_half_the_context_for_the_answer():
+    plan = ContextWindow().fit(FakeModel(), "sys", _history(3), "q", max_tokens=None)
+    assert plan.prompt_tokens <= 50 and plan.max_tokens == 100 - plan.prompt_tokens
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        ContextWindow(policy="drop-everything")
@@ -0,0 +1,160 @@
+import numpy as np
+import pyarrow as pa
+import pytest
+from datasets import Dataset
+from transformers import PreTrainedTokenizer
+
+from src.utils.data_prep import (
+    count_words,
+    explode_qa_pairs,
+    pack_sequences,
+    to_messages,
+    tokenize_and_mask,
+    tokenize_batch,
+)
+
+CHAT_TEMPLATE = (
+    "{% for message in messages %}<|{{ message['role'] }}|>\n{{ message['content'].strip() }}\n"
+    "{{ eos_token }}{% endfor %}"
+)
+
+
+class CharTokenizer(PreTrainedTokenizer):
+    """Slow (no offset mapping) character-level tokenizer with a BOS token"""
+
+    def __init__(self, **kwargs):
+        self._vocab = {"<pad>": 0, "<s>": 1, "</s>": 2, "<unk>": 3}
+        for ch in sorted(set("abcdefghijklmnopqrstuvwxyzđàáảãạăâêôơư|<>/ ?.,\n")):
+            self._vocab.setdefault(ch, len(self._vocab))
+        self._ids = {i: t for t, i in self._vocab.items()}
+        super().__init__(bos_token="<s>", eos_token="</s>", pad_token="<pad>", unk_token="<unk>", **kwargs)
+        self.chat_template = CHAT_TEMPLATE
+
+    @property
+    def vocab_size(self):
+        return len(self._vocab)
+
+    def get_vocab(self):
+        return dict(self._vocab)
+
+    def _tokenize(self, text):
+        return list(text)
+
+    def _convert_token_to_id(self, token):
+        return self._vocab.get(token, self._vocab["<unk>"])
+
+    def _convert_id_to_token(self, index):
+        return self._ids.get(index, "<unk>")
+
+    def build_inputs_with_special_tokens(self, token_ids_0, token_ids_1=None):
+        return [self.bos_token_id] + token_ids_0
+
+
+@pytest.mark.parametrize("text", ["", "a", "  a  b ", "một  hai\tba\nbốn", " x y", "trailing "])
+def test_count_words_matches_str_split(text):
+    assert count_words(pa.array([text])).to_pylist() == [len(text.split())]
+
+
+def test_count_words_null_is_zero():
+    assert count_words(pa.array(["a b", None, "c"])).to_pylist() == [2, 0, 1]
+
+
+def test_explode_qa_pairs_drops_nulls_and_long_answers():
+    batch = pa.table({"generated_qa_pairs": [
+        [{"question": "q1", "answer": "ngắn"}, {"question": None, "answer": "a"}],
+        None,
+        [{"question": "q3", "answer": None}, {"question": "q4", "answer": "một hai ba"}],
+    ]})
+    table = explode_qa_pairs(batch, max_answer_words=3)
+
+    assert table.column("question").to_pylist() == ["q1"]
+    assert table.column("num_tokens").to_pylist() == [1]
+    assert explode_qa_pairs(batch, max_answer_words=4).column("question").to_pylist() == ["q1", "q4"]
+
+
+def test_to_messages_interleaves_roles():
+    messages = to_messages(pa.table({"question": [" q1 ", "q2"], "answer": ["a1", " a2"]})).column("messages")
+    first, second = messages.to_pylist()
+    assert [m["role"] for m in first] == ["system", "user", "assistant"]
+    assert [m["content"] for m in second[1:]] == ["q2", "a2"]
+
+
+def _tokenized(lengths, prompt_len=2):
+    rows = [list(range(100 * i, 100 * i + n)) for i, n in enumerate(lengths)]
+    return Dataset.from_dict({
+        "input_ids": rows,
+        "labels": [[-100] * prompt_len + ids[prompt_len:] for ids in rows],
+        "length": list(lengths),
+    })
+
+
+def test_pack_sequences_fills_bins_within_capacity():
+    ds = _tokenized([3, 2, 4, 5, 2, 3])
+    packed = pack_sequences(ds, max_length=5)
+
+    examples = {tuple(ids): labels for ids, labels in zip(ds["input_ids"], ds["labels"])}
+    seen = []
+    for row in packed:
+        assert len(row["input_ids"]) == row["length"] == sum(row["seq_lengths"]) <= 5
+        start = 0
+        for n in row["seq_lengths"]:
+            ids = tuple(row["input_ids"][start:start + n])
+            # Label mask của từng example giữ nguyên sau khi ghép
+            assert row["labels"][start:start + n] == examples[ids]
+            seen.append(ids)
+            start += n
+    assert sorted(seen) == sorted(examples)
+    # First-fit decreasing: [5], [4], [3, 2], [3, 2]
+    assert len(packed) == 4
+
+
+def test_pack_sequences_example_from_review():
+    ds = Dataset.from_dict({
+        "input_ids": [[1, 2, 3], [4, 5], [6, 7, 8, 9]],
+        "labels": [[-100, 2, 3], [-100, 5], [-100, -100, 8, 9]],
+        "length": [3, 2, 4],
+    })
+    rows = sorted(pack_sequences(ds, max_length=5), key=lambda row: row["input_ids"][0])
+
+    assert [row["input_ids"] for row in rows] == [[1, 2, 3, 4, 5], [6, 7, 8, 9]]
+    assert rows[0]["labels"] == [-100, 2, 3, -100, 5]
+    assert rows[1]["labels"] == [-100, -100, 8, 9]
+
+
+def _conversation(question, answer):
+    return [
+        {"role": "system", "content": "bạn là trợ lý."},
+        {"role": "user", "content": question},
+        {"role": "assistant", "content": answer},
+    ]
+
+
+@pytest.mark.parametrize("truncate", [False, True])
+def test_tokenize_batch_matches_tokenize_and_mask_slow_tokenizer(truncate):
+    tokenizer = CharTokenizer()
+    assert not tokenizer.is_fast
+    batch = {"messages": [
+        _conversation("hỏi gì?", "trả lời ngắn."),
+        _conversation("một câu hỏi dài hơn, có dấu phẩy?", "đáp án."),
+    ]}
+    # Cắt giữa completion của dòng có prompt dài nhất
+    prompt = tokenizer.apply_chat_template(batch["messages"][1][:-1], tokenize=False)
+    max_length = len(tokenizer(prompt)["input_ids"]) + 3 if truncate else 256
+    out = tokenize_batch(batch, tokenizer, max_length)
+
+    assert len(out["input_ids"]) == 2
+    for messages, input_ids, labels in zip(batch["messages"], out["input_ids"], out["labels"]):
+        legacy = tokenize_and_mask({"messages": messages}, tokenizer, max_length)
+        n = len(input_ids)
+        assert input_ids == legacy["input_ids"][:n]
+        assert labels == legacy["labels"][:n]
+        assert labels[0] == -100 and labels[-1] != -100
+
+
+def test_tokenize_batch_drops_rows_with_completion_truncated_away():
+    tokenizer = CharTokenizer()
+    batch = {"messages": [_conversation("hỏi gì?", "trả lời."), _conversation("q" * 80, "a")]}
+    out = tokenize_batch(batch, tokenizer, max_length=50)
+
+    assert out["length"] == [len(out["input_ids"][0])]
+    assert np.all(np.asarray(out["labels"][0][:10]) == -100)
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import sys
+
+import boto3
+import pytest
+from boto3.s3.transfer import TransferConfig
+from moto import mock_aws
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import download_model  # noqa: E402
+
+MB = download_model.MB
+BUCKET = "models"
+KEY = "health-llm/model.gguf"
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def _upload_multipart(client, data, part_size):
+    """Multipart upload without any published SHA256: only the ETag can verify it"""
+    upload = client.create_multipart_upload(Bucket=BUCKET, Key=KEY)
+    parts = []
+    for number, start in enumerate(range(0, len(data), part_size), start=1):
+        part = client.upload_part(
+            Bucket=BUCKET, Key=KEY, UploadId=upload["UploadId"], PartNumber=number,
+            Body=data[start:start + part_size],
+        )
+        parts.append({"ETag": part["ETag"], "PartNumber": number})
+    client.complete_multipart_upload(
+        Bucket=BUCKET, Key=KEY, UploadId=upload["UploadId"], MultipartUpload={"Parts": parts},
+    )
+    return client.head_object(Bucket=BUCKET, Key=KEY)["ETag"].strip('"')
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def test_part_sizes_cover_every_mib_size_for_the_part_count():
+    size = 12 * MB + 123
+    sizes = download_model._etag_part_sizes(size, "0" * 32 + "-3", chunk_size=64 * MB)
+    assert 5 * MB in sizes
+    assert all(-(-size // p) == 3 and p % MB == 0 for p in sizes)
+    assert sizes == list(dict.fromkeys(sizes))
+
+
+@pytest.mark.parametrize("part_size", [5 * MB, 6 * MB])
+def test_multipart_download_verified_with_uncommon_part_size(s3, tmp_path, capsys, part_size):
+    data = os.urandom(12 * MB + 4321)
+    etag = _upload_multipart(s3, data, part_size)
+    assert etag.endswith("-3")
+
+    dest = tmp_path / "model.gguf"
+    config = TransferConfig(multipart_chunksize=4 * MB, max_concurrency=4)
+    assert download_model.download_s3_model(s3, BUCKET, "health-llm", dest=str(dest), cache_dir="", config=config)
+    assert hashlib.sha256(dest.read_bytes()).digest() == hashlib.sha256(data).digest()
+    assert f"Multipart ETag verified (part size {part_size // MB} MB)" in capsys.readouterr().out
+
+
+def test_corrupted_multipart_file_is_rejected(s3, tmp_path):
+    data = os.urandom(12 * MB + 4321)
+    etag = _upload_multipart(s3, data, 6 * MB)
+    corrupted = bytearray(data)
+    corrupted[7 * MB] ^= 0xFF
+
+    path = _write(tmp_path / "model.gguf.part", bytes(corrupted))
+    ok, _ = download_model.verify_file(path, len(data), None, etag, 4 * MB, allow_unverified=False)
+    assert not ok
+
+
+def test_unreproducible_etag_needs_allow_unverified(tmp_path):
+    data = os.urandom(12 * MB)
+    path = _write(tmp_path / "model.gguf.part", data)
+    # ETag của object mã hoá KMS: không phải MD5 của các part
+    etag = "f" * 32 + "-3"
+
+    assert not download_model.verify_file(path, len(data), None, etag, 4 * MB, allow_unverified=False)[0]
+    assert download_model.verify_file(path, len(data), None, etag, 4 * MB, allow_unverified=True)[0]
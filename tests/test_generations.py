@@ -0,0 +1,50 @@
+import uuid
+
+import pytest
+
+from src.generations import GenerationIdConflict, GenerationRegistry, InvalidGenerationId
+
+
+def test_server_ids_are_unique_and_finish_removes_them():
+    registry = GenerationRegistry()
+    first, second = registry.start(16), registry.start(16)
+    assert first.id != second.id and len(registry) == 2
+
+    registry.finish(first, 16)
+    assert registry.get(first.id) is None and len(registry) == 1
+
+
+@pytest.mark.parametrize("generation_id", ["1", "abc", "x" * 21, "x" * 129, "a" * 30 + "/..", "id with spaces " * 2])
+def test_guessable_or_malformed_client_ids_are_rejected(generation_id):
+    registry = GenerationRegistry()
+    with pytest.raises(InvalidGenerationId) as rejected:
+        registry.start(16, generation_id)
+    assert rejected.value.status_code == 400
+    assert len(registry) == 0
+
+
+def test_client_id_cannot_take_over_a_running_generation():
+    registry = GenerationRegistry()
+    generation_id = uuid.uuid4().hex
+    running = registry.start(16, generation_id)
+
+    with pytest.raises(GenerationIdConflict) as conflict:
+        registry.start(16, generation_id)
+    assert conflict.value.status_code == 409
+    assert registry.get(generation_id) is running
+
+    # Id dùng lại được sau khi generation trước đã xong
+    registry.finish(running, 16)
+    assert registry.start(16, generation_id).id == generation_id
+
+
+def test_cancel_sets_event_once_with_first_reason():
+    registry = GenerationRegistry()
+    generation = registry.start(64)
+
+    assert registry.cancel(generation.id, "api")
+    generation.cancel("disconnect")
+    assert generation.cancelled and generation.cancel_reason == "api"
+    assert not registry.cancel("unknown")
+    registry.finish(generation, 10)
+    assert len(registry) == 0
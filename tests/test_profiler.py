@@ -0,0 +1,50 @@
+import re
+import threading
+import time
+
+from src.profiler import SamplingProfiler, collapsed
+
+
+def _work(stop):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+def _caller(stop):
+    # Hai call site của cùng một hàm
+    while not stop.is_set():
+        _work(stop)
+        _work(stop)
+
+
+def _profile(lines):
+    stop = threading.Event()
+    thread = threading.Thread(target=_caller, args=(stop,), name="busy")
+    thread.start()
+    try:
+        stacks, stats = SamplingProfiler().profile(0.2, interval=0.005, mode="wall", lines=lines)
+    finally:
+        stop.set()
+        thread.join()
+    return [stack for stack in stacks if stack.startswith("busy;")], stats
+
+
+def test_frames_are_keyed_by_function():
+    stacks, stats = _profile(lines=False)
+    assert stacks and stats["ticks"] > 0
+    frames = {frame for stack in stacks for frame in stack.split(";")[1:]}
+    assert "test_profiler:_caller" in frames and "test_profiler:_work" in frames
+    assert not any(re.search(r":\d+$", frame) for frame in frames)
+
+
+def test_line_numbers_are_optional():
+    stacks, _ = _profile(lines=True)
+    frames = {frame for stack in stacks for frame in stack.split(";")[1:]}
+    assert all(re.search(r":\d+$", frame) for frame in frames)
+    assert any(frame.startswith("test_profiler:_caller:") for frame in frames)
+
+
+def test_collapsed_output_is_one_stack_per_line():
+    from collections import Counter
+
+    assert collapsed(Counter({"main;a:f;a:g": 3, "main;a:f": 5})) == "main;a:f 5\nmain;a:f;a:g 3\n"
@@ -0,0 +1,148 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from prometheus_client import CollectorRegistry, Counter, Gauge
+from prometheus_client.parser import text_string_to_metric_families
+
+from src.router import Router, Worker, merge_metrics
+
+WORKER_METRICS = """\
+# HELP chat_requests_total Chat requests
+# TYPE chat_requests_total counter
+chat_requests_total{endpoint="/generate",status="200"} 3.0
+# HELP model_loaded Model loaded
+# TYPE model_loaded gauge
+model_loaded 1.0
+# HELP process_cpu_seconds_total CPU time
+# TYPE process_cpu_seconds_total counter
+process_cpu_seconds_total 1.5
+"""
+
+
+def _samples(text):
+    return {
+        (s.name, tuple(sorted(s.labels.items()))): s.value
+        for family in text_string_to_metric_families(text) for s in family.samples
+    }
+
+
+def test_merge_metrics_labels_worker_series():
+    own = CollectorRegistry()
+    Gauge("model_loaded", "Model loaded", registry=own)
+    Counter("router_requests", "Router requests", registry=own).inc()
+    Counter("process_cpu_seconds", "CPU time", registry=own).inc(0.5)
+
+    text = merge_metrics(own.collect(), {"0": WORKER_METRICS, "1": WORKER_METRICS}).decode()
+    samples = _samples(text)
+
+    for worker in ("0", "1"):
+        assert samples[("chat_requests_total", (("endpoint", "/generate"), ("status", "200"), ("worker", worker)))] == 3
+        assert samples[("model_loaded", (("worker", worker),))] == 1
+    # model_loaded = 0 của router không che giá trị của worker
+    assert ("model_loaded", ()) not in samples
+    assert samples[("router_requests_total", ())] == 1
+    assert samples[("process_cpu_seconds_total", (("worker", "router"),))] == 0.5
+
+
+def _worker(index, handler):
+    worker = Worker(index, f"/tmp/worker-{index}.sock")
+    worker.client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://worker")
+    return worker
+
+
+def _swap_handler(fleet, index, fail_version=None):
+    def handler(request):
+        body = json.loads(request.content)
+        version = body.get("version") or "v2"
+        if version == fail_version:
+            return httpx.Response(422, json={"status": "rolled_back", "reason": "canary failed"})
+        previous = fleet[index]
+        fleet[index] = version
+        return httpx.Response(200, json={
+            "status": "swapped", "version": version, "model_path": body.get("model_path") or f"/models/{version}.gguf",
+            "previous_version": previous, "previous_model_path": f"/models/{previous}.gguf",
+        })
+    return handler
+
+
+def test_rolling_swap_rolls_back_swapped_workers():
+    fleet = {0: "v1", 1: "v1", 2: "v1"}
+    workers = [_worker(i, _swap_handler(fleet, i, fail_version="v2" if i == 2 else None)) for i in range(3)]
+    router = Router(workers)
+
+    result = asyncio.run(router.rolling_swap({}, {}))
+
+    assert result["status"] == "rolled_back"
+    assert fleet == {0: "v1", 1: "v1", 2: "v1"}
+    assert [r["worker"] for r in result["workers"] if r.get("rollback")] == [0, 1]
+
+
+def test_rolling_swap_reports_mixed_fleet_when_rollback_fails():
+    fleet = {0: "v1", 1: "v1"}
+    workers = [_worker(0, _swap_handler(fleet, 0, fail_version="v1")), _worker(1, _swap_handler(fleet, 1, fail_version="v2"))]
+    router = Router(workers)
+
+    result = asyncio.run(router.rolling_swap({}, {}))
+
+    assert result["status"] == "mixed"
+    assert fleet == {0: "v2", 1: "v1"}
+
+
+def _stream_worker():
+    async def body():
+        for chunk in (b"data: a\n\n", b"data: b\n\n"):
+            yield chunk
+
+    return _worker(0, lambda request: httpx.Response(200, content=body(), headers={"content-type": "text/event-stream"}))
+
+
+def _request():
+    from starlette.requests import Request
+
+    scope = {"type": "http", "method": "POST", "path": "/api/v1/chat/stream", "query_string": b"",
+             "headers": [], "http_version": "1.1", "asgi": {"version": "3.0", "spec_version": "2.4"}}
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    return scope, receive, Request(scope, receive)
+
+
+def test_inflight_released_when_client_leaves_before_the_body_is_sent():
+    async def scenario():
+        worker = _stream_worker()
+        worker.ready = True
+        router = Router([worker])
+        scope, receive, request = _request()
+        response = await router.proxy(request, body=b"{}")
+        assert worker.inflight == 1
+
+        async def send(message):
+            raise OSError("client went away")
+
+        with pytest.raises(Exception):
+            await response(scope, receive, send)
+        assert worker.inflight == 0
+
+    asyncio.run(scenario())
+
+
+def test_inflight_released_once_after_a_full_stream():
+    async def scenario():
+        worker = _stream_worker()
+        worker.ready = True
+        router = Router([worker])
+        scope, receive, request = _request()
+        response = await router.proxy(request, body=b"{}")
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await response(scope, receive, send)
+        assert b"".join(m.get("body", b"") for m in sent) == b"data: a\n\ndata: b\n\n"
+        assert worker.inflight == 0
+
+    asyncio.run(scenario())
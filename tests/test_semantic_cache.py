@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+
+from src.semantic_cache import SemanticIndex
+
+
+def _index(n, dim=8):
+    index = SemanticIndex(dim, max_entries=16, use_ann=False)
+    rng = np.random.default_rng(n)
+    for i in range(n):
+        vector = rng.standard_normal(dim).astype(np.float32)
+        index.add(vector / np.linalg.norm(vector), f"q{i}", f"a{i}", "p")
+    return index
+
+
+def test_save_load_roundtrip(tmp_path):
+    saved = _index(3)
+    saved.save(str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ["entries.json", "vectors.npy"]
+
+    loaded = SemanticIndex(8, max_entries=16, use_ann=False)
+    assert loaded.load(str(tmp_path))
+    assert sorted(loaded.questions) == ["q0", "q1", "q2"]
+    row, similarity = loaded.search(saved.vectors[1], "p")
+    assert loaded.answers[row] == "a1" and similarity > 0.999
+
+
+def test_truncated_entries_load_empty(tmp_path):
+    _index(3).save(str(tmp_path))
+    with open(tmp_path / "entries.json", "r+", encoding="utf-8") as f:
+        f.truncate(20)
+
+    index = SemanticIndex(8, max_entries=16, use_ann=False)
+    assert not index.load(str(tmp_path))
+    assert len(index) == 0
+
+
+def test_vectors_from_another_save_load_empty(tmp_path):
+    # Crash giữa hai lần rename: vectors.npy mới, entries.json cũ cùng số dòng
+    saved = _index(3)
+    saved.save(str(tmp_path))
+    np.save(tmp_path / "vectors.npy", -saved.vectors[:3])
+
+    index = SemanticIndex(8, max_entries=16, use_ann=False)
+    assert not index.load(str(tmp_path))
+    assert len(index) == 0
@@ -0,0 +1,88 @@
+import os
+import time
+
+import numpy as np
+
+from src.session_store import SessionStore
+
+
+class FakeState:
+    """Picklable stand-in for LlamaState: state_nbytes reads llama_state_size + arrays"""
+
+    def __init__(self, tag: str, size: int = 100):
+        self.tag = tag
+        self.llama_state_size = size
+        self.input_ids = np.zeros(0, dtype=np.intc)
+        self.n_tokens = 0
+
+
+def _store(tmp_path, **kwargs) -> SessionStore:
+    return SessionStore(spill_dir=str(tmp_path / "states"), **{"memory_budget": 150, **kwargs})
+
+
+def test_lookup_without_create_does_not_allocate(tmp_path):
+    store = _store(tmp_path)
+    assert store.history("unknown", create=False) is None
+    assert len(store) == 0
+
+    store.append_turn("s", "hỏi", "đáp")
+    assert [m.content for m in store.history("s", create=False)] == ["hỏi", "đáp"]
+    assert store.history("new") == [] and len(store) == 2
+
+
+def test_least_recently_used_session_is_dropped_over_max_sessions(tmp_path):
+    store = _store(tmp_path, max_sessions=2)
+    store.append_turn("a", "q", "a")
+    store.append_turn("b", "q", "b")
+    store.history("a")
+    store.append_turn("c", "q", "c")
+    store.history("c")
+
+    assert store.history("b", create=False) is None
+    assert store.history("a", create=False) is not None
+
+
+def test_idle_sessions_expire_with_their_spill_file(tmp_path):
+    store = _store(tmp_path, ttl=60, memory_budget=0)
+    store.save_state("old", FakeState("old"))
+    spilled = os.listdir(tmp_path / "states")
+    assert len(spilled) == 1
+
+    store._sessions["old"].last_used = time.time() - 120
+    assert store.history("old", create=False) is None
+    assert os.listdir(tmp_path / "states") == []
+
+
+def test_snapshots_over_budget_spill_to_disk_and_come_back(tmp_path):
+    store = _store(tmp_path)
+    store.save_state("a", FakeState("a"))
+    store.save_state("b", FakeState("b"))
+
+    # 200 bytes > budget 150: snapshot của a (LRU) chuyển xuống đĩa
+    assert store._bytes == 100
+    assert store._sessions["a"].state is None and store._sessions["a"].spilled
+    assert store.snapshot("a").tag == "a"
+    # Nạp lại a đẩy b xuống đĩa
+    assert store._sessions["b"].spilled and store._sessions["a"].state is not None
+    assert store.snapshot("b").tag == "b"
+
+
+def test_without_spill_dir_evicted_snapshots_are_forgotten(tmp_path):
+    store = SessionStore(memory_budget=150, spill_dir=None)
+    store.save_state("a", FakeState("a"))
+    store.save_state("b", FakeState("b"))
+    assert store.snapshot("a") is None
+    assert store.history("a", create=False) is not None
+
+
+def test_drop_states_and_delete_remove_spill_files(tmp_path):
+    store = _store(tmp_path, memory_budget=0)
+    store.save_state("a", FakeState("a"))
+    store.save_state("b", FakeState("b"))
+    assert len(os.listdir(tmp_path / "states")) == 2
+
+    assert store.delete("a") and not store.delete("a")
+    assert len(os.listdir(tmp_path / "states")) == 1
+    store.drop_states()
+    assert os.listdir(tmp_path / "states") == []
+    assert store.snapshot("b") is None and store.history("b", create=False) == []
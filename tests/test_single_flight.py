@@ -0,0 +1,171 @@
+import asyncio
+import functools
+
+import pytest
+
+from src import api
+from src.admission import AdmissionController, QueueFullError
+from src.generations import generationRegistry
+from src.single_flight import SingleFlight
+
+
+def _produce(message):
+    return functools.partial(
+        api._produce_flight, message=message, max_tokens=16, plan=None, session_id=None, cache_key=message,
+    )
+
+
+def test_rejected_flight_releases_its_generation(monkeypatch):
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue_depth=0)
+        monkeypatch.setattr(api, "admissionController", controller)
+        await controller.acquire()
+
+        flight, leader = SingleFlight().acquire("q", 16, _produce("q"), "generate")
+        assert leader
+        with pytest.raises(QueueFullError):
+            await flight.wait_started()
+        await flight.task
+        assert controller.active == 1
+
+    asyncio.run(scenario())
+    assert len(generationRegistry) == 0
+
+
+def test_flight_cancelled_while_queued_releases_its_generation(monkeypatch):
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue_depth=4)
+        monkeypatch.setattr(api, "admissionController", controller)
+        await controller.acquire()
+
+        flights = SingleFlight()
+        flight, _ = flights.acquire("q", 16, _produce("q"), "chat_stream")
+        await asyncio.sleep(0)
+        assert controller.queue_depth == 1
+        # Subscriber duy nhất rời đi khi flight còn xếp hàng
+        flights.leave(flight)
+        await flight.task
+        assert flight.generation.cancel_reason == "disconnect"
+        assert controller.queue_depth == 0 and controller.active == 1
+        assert len(flights) == 0
+
+    asyncio.run(scenario())
+    assert len(generationRegistry) == 0
+
+
+def test_only_deterministic_requests_coalesce_by_default(monkeypatch):
+    assert SingleFlight().coalesces(0.0)
+    assert not SingleFlight().coalesces(0.7)
+    assert SingleFlight(sampled=True).coalesces(0.7)
+
+    monkeypatch.setattr(api, "singleFlight", SingleFlight())
+    monkeypatch.setattr(api.chatService, "temperature", 0.7)
+    assert not api._coalescing(True)
+    monkeypatch.setattr(api.chatService, "temperature", 0.0)
+    assert api._coalescing(True) and not api._coalescing(False)
+
+
+def _controlled_produce(steps: asyncio.Queue):
+    """Publishes whatever the test puts on `steps`; None ends the flight, an exception fails it"""
+    async def produce(flight):
+        flight.started()
+        try:
+            while True:
+                piece = await steps.get()
+                if piece is None:
+                    return
+                if isinstance(piece, Exception):
+                    raise piece
+                flight.publish(piece)
+        finally:
+            generationRegistry.finish(flight.generation, len(flight.pieces))
+    return produce
+
+
+async def _collect(flight, into, cancel_event=None):
+    async for chunk in flight.stream(cancel_event):
+        into.append(chunk)
+
+
+def test_late_joiner_gets_prefix_in_one_chunk_then_live_pieces():
+    async def scenario():
+        flights, steps = SingleFlight(), asyncio.Queue()
+        leader, is_leader = flights.acquire("q", 16, _controlled_produce(steps), "chat_stream")
+        assert is_leader
+        await leader.wait_started()
+        first = []
+        first_task = asyncio.create_task(_collect(leader, first))
+        for piece in ("a", "b", "c"):
+            steps.put_nowait(piece)
+            await asyncio.sleep(0.01)
+
+        joined, is_leader = flights.acquire("q", 16, _controlled_produce(asyncio.Queue()), "chat_stream")
+        assert joined is leader and not is_leader and leader.subscribers == 2
+        late = []
+        late_task = asyncio.create_task(_collect(joined, late))
+        await asyncio.sleep(0.01)
+        steps.put_nowait("d")
+        steps.put_nowait(None)
+        await asyncio.gather(first_task, late_task, leader.task)
+
+        assert first == ["a", "b", "c", "d"]
+        assert late == ["abc", "d"]
+        assert leader.completed and len(flights) == 0
+
+    asyncio.run(scenario())
+    assert len(generationRegistry) == 0
+
+
+def test_finished_flight_is_not_joined():
+    async def scenario():
+        flights, steps = SingleFlight(), asyncio.Queue()
+        flight, _ = flights.acquire("q", 16, _controlled_produce(steps), "generate")
+        steps.put_nowait(None)
+        await flight.task
+        again, is_leader = flights.acquire("q", 16, _controlled_produce(steps), "generate")
+        assert is_leader and again is not flight
+        steps.put_nowait(None)
+        await again.task
+
+    asyncio.run(scenario())
+
+
+def test_flight_error_reaches_every_subscriber():
+    async def scenario():
+        flights, steps = SingleFlight(), asyncio.Queue()
+        flight, _ = flights.acquire("q", 16, _controlled_produce(steps), "generate")
+        flights.acquire("q", 16, _controlled_produce(steps), "generate")
+        await flight.wait_started()
+        steps.put_nowait("a")
+        steps.put_nowait(RuntimeError("model failed"))
+        for _ in range(2):
+            pieces = []
+            with pytest.raises(RuntimeError, match="model failed"):
+                await _collect(flight, pieces)
+            assert pieces == ["a"]
+        assert not flight.completed
+
+    asyncio.run(scenario())
+    assert len(generationRegistry) == 0
+
+
+def test_generation_is_cancelled_only_when_the_last_subscriber_leaves():
+    async def scenario():
+        flights, steps = SingleFlight(), asyncio.Queue()
+        flight, _ = flights.acquire("q", 16, _controlled_produce(steps), "chat_stream")
+        flights.acquire("q", 16, _controlled_produce(steps), "chat_stream")
+        await flight.wait_started()
+
+        flights.leave(flight)
+        assert not flight.generation.cancelled
+        flights.leave(flight)
+        assert flight.generation.cancel_reason == "disconnect"
+        # Flight bị huỷ không nhận subscriber mới
+        other, is_leader = flights.acquire("q", 16, _controlled_produce(steps), "chat_stream")
+        assert is_leader and other is not flight
+        for _ in range(2):
+            steps.put_nowait(None)
+        await asyncio.gather(flight.task, other.task)
+
+    asyncio.run(scenario())
+    assert len(generationRegistry) == 0